@@ -0,0 +1,87 @@
+# benchmarks/bench_firestore_concurrency.py
+"""
+Compares how invoice reads scale with the number of concurrent requests:
+
+- sync: the blocking repository read on a 40-thread pool, i.e. what a sync `def` route
+  gets from Starlette's default threadpool
+- async: the AsyncClient read awaited directly, i.e. what an `async def` route on the
+  async repository functions gets
+
+Needs Firestore credentials (GOOGLE_APPLICATION_CREDENTIALS) or the emulator
+(FIRESTORE_EMULATOR_HOST) and an existing invoice. The invoice cache is bypassed.
+
+Run from the project root:
+    python -m benchmarks.bench_firestore_concurrency --company acme --invoice ACM092026
+    python -m benchmarks.bench_firestore_concurrency --company acme --tenant t1 --invoice T1092026 --concurrency 40 160 640
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_configs.firebase_db import firestore_async_client
+from repositories.invoice_repo import _invoice_doc_ref, _load_invoice
+
+DEFAULT_CONCURRENCY = [10, 40, 80, 160, 320]
+# anyio's default thread limiter used by Starlette for sync routes
+STARLETTE_THREADPOOL_SIZE = 40
+
+
+def _run_sync(concurrency: int, args) -> tuple[float, list[float]]:
+    """
+    `concurrency` simultaneous requests, served by at most 40 threads. All requests of a
+    round arrive at once, so a request's latency includes the time it waited for a thread.
+    """
+    def one(_) -> float:
+        _load_invoice(args.company, args.tenant, args.invoice)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=STARLETTE_THREADPOOL_SIZE) as pool:
+        latencies = list(pool.map(one, range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+async def _run_async(concurrency: int, args) -> tuple[float, list[float]]:
+    """`concurrency` simultaneous requests on the event loop."""
+    async def one() -> float:
+        await _invoice_doc_ref(firestore_async_client, args.company, args.tenant, args.invoice).get()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(concurrency)))
+    return time.perf_counter() - start, list(latencies)
+
+
+def _p(latencies: list[float], q: float) -> float:
+    return statistics.quantiles(latencies, n=100)[q - 1] if len(latencies) > 1 else latencies[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--company", required=True)
+    parser.add_argument("--tenant", default=None)
+    parser.add_argument("--invoice", required=True)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+
+    if _load_invoice(args.company, args.tenant, args.invoice) is None:
+        raise SystemExit(f"Invoice {args.invoice} not found")
+
+    async def run_all():
+        # Warm up the async channel before measuring
+        await _run_async(1, args)
+        print(f"{'concurrent':>10} {'mode':>6} {'wall (s)':>9} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+        for concurrency in args.concurrency:
+            sync_wall, sync_lat = await asyncio.to_thread(_run_sync, concurrency, args)
+            async_wall, async_lat = await _run_async(concurrency, args)
+            for mode, wall, lat in (("sync", sync_wall, sync_lat), ("async", async_wall, async_lat)):
+                print(f"{concurrency:>10} {mode:>6} {wall:>9.3f} {concurrency / wall:>8.0f} "
+                      f"{_p(lat, 50) * 1000:>9.1f} {_p(lat, 99) * 1000:>9.1f}")
+
+    asyncio.run(run_all())
+
+
+if __name__ == "__main__":
+    main()
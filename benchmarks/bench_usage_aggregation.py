@@ -0,0 +1,69 @@
+# benchmarks/bench_usage_aggregation.py
+"""
+Compares the generator-expression billed-minute path that generate_monthly_bill used
+(`sum(math.ceil(c.get("duration", 0) / 60) for c in calls)`) with the vectorized
+NumPy path in services/usage_aggregation.py.
+
+Run from the project root:
+    python -m benchmarks.bench_usage_aggregation
+    python -m benchmarks.bench_usage_aggregation --sizes 10000 1000000
+"""
+import argparse
+import math
+import random
+import time
+
+from services.usage_aggregation import load_durations, billed_minutes, summarize_durations
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+# Calls are drawn from a pool of shared dicts so that 10M calls fit in memory;
+# the per-call work done by both paths is unchanged.
+POOL_SIZE = 10_000
+
+
+def _make_calls(n: int) -> list[dict]:
+    random.seed(42)
+    pool = [{"duration": random.randint(0, 900)} for _ in range(POOL_SIZE)]
+    return [pool[i % POOL_SIZE] for i in range(n)]
+
+
+def _generator_path(calls: list[dict]) -> int:
+    return sum(math.ceil(c.get("duration", 0) / 60) for c in calls)
+
+
+def _numpy_path(calls: list[dict]) -> int:
+    return int(billed_minutes(load_durations(calls)).sum())
+
+
+def _best_of(fn, arg, repeat: int) -> tuple[float, int]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'calls':>12} {'genexpr (s)':>12} {'numpy load+agg (s)':>19} {'numpy agg only (s)':>19} {'speedup':>8}")
+    for n in args.sizes:
+        calls = _make_calls(n)
+        gen_time, gen_total = _best_of(_generator_path, calls, args.repeat)
+        np_time, np_total = _best_of(_numpy_path, calls, args.repeat)
+
+        # Aggregation alone, once durations are already in a contiguous array
+        durations = load_durations(calls)
+        agg_time, agg_totals = _best_of(summarize_durations, durations, args.repeat)
+
+        assert gen_total == np_total == agg_totals["total_minutes"], "billed minutes mismatch"
+        print(f"{n:>12,} {gen_time:>12.4f} {np_time:>19.4f} {agg_time:>19.4f} {gen_time / agg_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,12 @@
-from services.invoice_service import generate_invoices_for_all
+import os
+
+# The scheduled run keeps a copy of every invoice PDF and call log CSV in invoices/;
+# read by utils.artifacts at import time, so it is set before the services load
+os.environ.setdefault("ARTIFACT_DISK_SINK", "1")
+
+from services.invoice_batch_service import run_invoice_batch
+from services.pdf_render_pool import shutdown_render_pool
+from services.outbox_service import drain_outbox
 from repositories.companies_repo import get_all_companies
 from datetime import datetime
 
@@ -22,7 +30,15 @@ if __name__ == "__main__":
     else:
         print(f"Starting scheduled invoice generation for {len(companies)} companies for {last_month}/{year}...")
         try:
-            generate_invoices_for_all(companies=companies, month=last_month, year=year)
-            print("✅ Job completed successfully.")
+            # Worker counts come from BATCH_IO_WORKERS / BATCH_RENDER_WORKERS
+            report = run_invoice_batch(companies=companies, month=last_month, year=year)
+            for result in report["results"]:
+                if result["status"] != "sent":
+                    print(f"⚠️ {result['company']}/{result['tenant']} failed at {result['stage']}: {result['error']}")
+            print(f"✅ Job completed: {report['sent']} sent, {report['failed']} failed in {report['duration_seconds']}s.")
         except Exception as e:
-            print(f"❌ Job failed unexpectedly during processing: {e}")
\ No newline at end of file
+            print(f"❌ Job failed unexpectedly during processing: {e}")
+        finally:
+            shutdown_render_pool()
+            # Send anything queued in the outbox during the run before exiting
+            drain_outbox()
\ No newline at end of file
@@ -1,5 +1,5 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 import os
 from dotenv import load_dotenv
 
@@ -22,9 +22,12 @@ try:
 
     # Get Firestore client
     firestore_client = firestore.client()
+    # Async client for the async routes/repository functions (binds to the event loop that first uses it)
+    firestore_async_client = firestore_async.client()
     print("✅ Connected to Firestore successfully!")
 
 except Exception as e:
     print(f"❌ Error connecting to Firebase: {e}")
     firestore_client = None
+    firestore_async_client = None
     print("   Database connection failed. Check your service account path and file integrity.")
\ No newline at end of file
@@ -0,0 +1,51 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local durable state (email outbox, ...) that must survive restarts but doesn't belong in Firestore
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", os.path.join(os.path.dirname(__file__), "../local_state.db"))
+
+_schemas = []
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def register_schema(ddl: str):
+    """Registers CREATE TABLE/INDEX statements applied when the first connection is opened."""
+    global _initialized
+    with _init_lock:
+        _schemas.append(ddl)
+        # Schemas registered after initialization are applied on the next connection
+        _initialized = False
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(LOCAL_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL lets the dispatcher read while request handlers enqueue
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def local_db():
+    """
+    Opens a connection to the local SQLite database (autocommit mode; use
+    "BEGIN IMMEDIATE" for multi-statement transactions).
+    """
+    global _initialized
+    conn = _connect()
+    try:
+        if not _initialized:
+            with _init_lock:
+                for ddl in _schemas:
+                    conn.executescript(ddl)
+                _initialized = True
+        yield conn
+    finally:
+        conn.close()
@@ -14,6 +14,22 @@ async def lifespan(app: FastAPI):
     # 🔥 run_on_startup=True: Updates DB immediately when server starts (for testing)
     # 💡 Later, change to run_on_startup=False to only run at midnight
     start_scheduler(run_on_startup=False)
+
+    # Send queued emails in the background
+    from services.outbox_service import start_outbox_dispatcher
+    start_outbox_dispatcher()
+
+    # Process stored payment webhooks in the background
+    from services.webhook_inbox_service import start_webhook_dispatcher
+    start_webhook_dispatcher()
+
+    # Render and email payment receipts in the background
+    from services.receipt_job_service import start_receipt_dispatcher
+    start_receipt_dispatcher()
+
+    # Compile all email/PDF templates once, before the first request needs them
+    from services.template_registry import precompile_templates
+    print(f"📄 Precompiled templates: {precompile_templates()}")
     
     yield  # Application runs here
     
@@ -22,6 +38,22 @@ async def lifespan(app: FastAPI):
     from services.scheduler_service import stop_scheduler
     stop_scheduler()
 
+    # Let in-flight webhook events finish; queued ones are processed on next start
+    from services.webhook_inbox_service import stop_webhook_dispatcher
+    await stop_webhook_dispatcher()
+
+    # Let in-flight receipts finish; queued ones are produced on next start
+    from services.receipt_job_service import stop_receipt_dispatcher
+    await stop_receipt_dispatcher()
+
+    # Let in-flight email sends finish; anything still queued is sent on next start
+    from services.outbox_service import stop_outbox_dispatcher
+    await stop_outbox_dispatcher()
+
+    # Stop the PDF render worker processes (no-op if no PDF was rendered)
+    from services.pdf_render_pool import shutdown_render_pool
+    shutdown_render_pool()
+
 
 app = FastAPI(
     title="Billing & Payments Service",
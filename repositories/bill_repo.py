@@ -1,27 +1,174 @@
-from db_configs.firebase_db import firestore_client
-from datetime import datetime, timezone
+from db_configs.firebase_db import firestore_client, firestore_async_client
+from datetime import datetime, timezone, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import os
 from reqResVal_models.billing_models import InvoiceModel, PaymentStatus
+from repositories.invoice_repo import invalidate_invoice
 from pydantic import ValidationError
+from google.api_core.exceptions import FailedPrecondition
+
+# Firestore caps a write batch at 500 operations
+MAX_BATCH_WRITES = 500
+# Number of write batches committed concurrently by bulk updates
+BULK_WRITE_PARALLELISM = int(os.getenv("BULK_WRITE_PARALLELISM", "8"))
+# First payment reminder goes out this many days after the invoice date; the final one on the due date
+FIRST_REMINDER_DAYS_AFTER_INVOICE = 3
+# Commits tried by commit_payment() while the invoice keeps changing under it
+PAYMENT_COMMIT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_COMMIT_MAX_ATTEMPTS", "3"))
+
+
+def _invoices_ref(company_id: str, tenant_id: str | None, client=None):
+    """Invoices collection of a company, or of a tenant under it."""
+    client = client or firestore_client
+    if tenant_id is None:
+        return client.collection("companies").document(company_id).collection("invoices")
+    return client.collection("companies").document(company_id).collection("tenants").document(tenant_id).collection("invoices")
+
+
+def invoice_doc_id(company_id: str, tenant_id: str | None, start_date: str) -> str:
+    """
+    Deterministic invoice document ID: first three letters of the billed entity
+    (tenant, or company for direct clients) + MM + YYYY of the billing period start.
+
+    Args:
+        company_id: Company ID
+        tenant_id: Tenant ID, or None for a company invoice
+        start_date: Billing period start as an ISO string (e.g. '2025-09-01T...')
+    """
+    try:
+        start_date_obj = datetime.strptime(start_date.split('T')[0], "%Y-%m-%d")
+    except (ValueError, AttributeError):
+        raise ValueError("The 'startDate' format is incorrect for ID generation. Expected YYYY-MM-DDT...")
+
+    month = start_date_obj.strftime("%m")
+    year = start_date_obj.strftime("%Y")
+    
+    if not month or not year:
+        # This check is now redundant but kept as a safeguard
+        raise ValueError("The month and year not parsed correctly")
+    if tenant_id is None:
+        return f"{company_id[:3].upper()}{month}{year}"
+    return f"{tenant_id[:3].upper()}{month}{year}"
+
+
+def get_invoices_for_periods(keys: list[tuple[str, str | None, str, str]]) -> dict[tuple, dict | None]:
+    """
+    Fetch the invoices of several (company, tenant, billing period) keys with a single
+    batched point read: the document refs are derived from the deterministic invoice ID
+    (see invoice_doc_id), so no query is needed.
+
+    Args:
+        keys: (company, tenant or None, start_date, end_date) tuples, dates as stored in billingPeriod
+
+    Returns:
+        dict: key -> invoice ({"id", **data}), or None when no invoice exists for that period
+    """
+    invoices, refs = _period_invoice_refs(keys)
+    if refs:
+        for doc in firestore_client.get_all([entries[0][1] for entries in refs.values()]):
+            _match_period_invoice(doc, refs, invoices)
+    return invoices
+
+
+async def get_invoices_for_periods_async(keys: list[tuple[str, str | None, str, str]]) -> dict[tuple, dict | None]:
+    """Async variant of get_invoices_for_periods (one get_all through the async client)."""
+    invoices, refs = _period_invoice_refs(keys, firestore_async_client)
+    if refs:
+        async for doc in firestore_async_client.get_all([entries[0][1] for entries in refs.values()]):
+            _match_period_invoice(doc, refs, invoices)
+    return invoices
+
+
+def _period_invoice_refs(keys: list[tuple], client=None) -> tuple[dict, dict]:
+    """Result dict (all None) and document path -> [(key, ref)] for get_invoices_for_periods."""
+    invoices = {key: None for key in keys}
+    refs = {}
+    for key in invoices:
+        company, tenant, start_date, _ = key
+        ref = _invoices_ref(company, tenant, client).document(invoice_doc_id(company, tenant, start_date))
+        refs.setdefault(ref.path, []).append((key, ref))
+    return invoices, refs
+
+
+def _match_period_invoice(doc, refs: dict, invoices: dict):
+    if not doc.exists:
+        return
+    data = doc.to_dict()
+    billing_period = data.get("billingPeriod", {})
+    for key, _ in refs[doc.reference.path]:
+        # Same month but a different period is not the requested invoice
+        if billing_period.get("startDate") == key[2] and billing_period.get("endDate") == key[3]:
+            invoices[key] = {"id": doc.id, **data}
 
 
 def get_invoice(company: str, tenant: str | None, start_date: str, end_date: str):
     """
     Fetch invoice for a given company and billing period if it exists.
     """
-    if tenant is None:
-        invoices_ref = firestore_client.collection("companies").document(company).collection("invoices")
-    else:
-        invoices_ref = firestore_client.collection("companies").document(company).collection("tenants").document(tenant).collection("invoices")
-    query = (
-        invoices_ref
-        .where("billingPeriod.startDate", "==", start_date)
-        .where("billingPeriod.endDate", "==", end_date)
-        .limit(1)
+    key = (company, tenant, start_date, end_date)
+    return get_invoices_for_periods([key])[key]
+
+
+async def get_invoice_async(company: str, tenant: str | None, start_date: str, end_date: str):
+    """Async variant of get_invoice."""
+    key = (company, tenant, start_date, end_date)
+    return (await get_invoices_for_periods_async([key]))[key]
+
+
+def next_payment_reminder(invoice_date: str, due_date: str, on_or_after: date) -> tuple[str | None, str | None]:
+    """
+    Next payment reminder of an invoice falling on or after a given day.
+
+    Args:
+        invoice_date: Invoice date (ISO string)
+        due_date: Due date (ISO string)
+        on_or_after: Earliest day to consider
+
+    Returns:
+        tuple: (reminder date as YYYY-MM-DD, "first" or "final"), or (None, None) when
+               no reminder is left or the dates can't be parsed
+    """
+    try:
+        invoice_day = datetime.strptime(invoice_date[:10], "%Y-%m-%d").date()
+        due_day = datetime.strptime(due_date[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None, None
+
+    schedule = sorted(
+        [(invoice_day + timedelta(days=FIRST_REMINDER_DAYS_AFTER_INVOICE), "first"), (due_day, "final")],
+        key=lambda reminder: reminder[0],
     )
-    results = query.stream()
-    for doc in results:
-        return {"id": doc.id, **doc.to_dict()}
-    return None
+    for reminder_day, reminder_type in schedule:
+        if reminder_day >= on_or_after:
+            return reminder_day.isoformat(), reminder_type
+    return None, None
+
+
+def due_payment_reminder(invoice_date: str, due_date: str, scheduled: str, day: date) -> str | None:
+    """
+    Reminder to send for an invoice whose next reminder was scheduled on or before a day.
+
+    Reminders whose day was missed (scheduler down, failed send) are still owed; when
+    several are, only the latest one is sent, e.g. just the final reminder once the due
+    date has passed.
+
+    Args:
+        invoice_date: Invoice date (ISO string)
+        due_date: Due date (ISO string)
+        scheduled: The invoice's nextReminderDate (YYYY-MM-DD)
+        day: Day the reminders are sent
+
+    Returns:
+        str: "first" or "final", or None when no reminder falls between scheduled and day
+    """
+    reminder_type = None
+    on_or_after = datetime.strptime(scheduled, "%Y-%m-%d").date()
+    while True:
+        reminder_day, next_type = next_payment_reminder(invoice_date, due_date, on_or_after)
+        if reminder_day is None or reminder_day > day.isoformat():
+            return reminder_type
+        reminder_type = next_type
+        on_or_after = datetime.strptime(reminder_day, "%Y-%m-%d").date() + timedelta(days=1)
 
 
 def save_invoice(company_id: str, tenant_id: str | None, invoice_data: dict):
@@ -35,40 +182,22 @@ def save_invoice(company_id: str, tenant_id: str | None, invoice_data: dict):
     except ValidationError as e:
         raise ValueError(f"Invoice data validation failed for company {company_id}: {e}")
 
-    if tenant_id is None:
-        invoices_ref = (firestore_client.collection("companies").document(company_id).collection("invoices"))
-    else:
-        invoices_ref = (firestore_client.collection("companies").document(company_id).collection("tenants").document(tenant_id).collection("invoices"))
-
     # 2. Deterministic ID generation from billing period
-    billing_period = invoice_data.get("billingPeriod", {})
-    start = billing_period.get("startDate")
-    end = billing_period.get("endDate")
-    
-    # Fix: Convert the ISO string (e.g., '2025-09-01T...') to a datetime object
-    try:
-        start_date_obj = datetime.strptime(start.split('T')[0], "%Y-%m-%d")
-    except (ValueError, AttributeError):
-        raise ValueError("The 'startDate' format is incorrect for ID generation. Expected YYYY-MM-DDT...")
+    doc_id = invoice_doc_id(company_id, tenant_id, invoice_data.get("billingPeriod", {}).get("startDate"))
 
-    month = start_date_obj.strftime("%m")
-    year = start_date_obj.strftime("%Y")
-    
-    if not month or not year:
-        # This check is now redundant but kept as a safeguard
-        raise ValueError("The month and year not parsed correctly")
-    if tenant_id is None:
-        doc_id = f"{company_id[:3].upper()}{month}{year}"
-    else:
-        doc_id = f"{tenant_id[:3].upper()}{month}{year}"
-
-    doc_ref = invoices_ref.document(doc_id)
+    doc_ref = _invoices_ref(company_id, tenant_id).document(doc_id)
 
     # Add server timestamp
     invoice_data["createdAt"] = datetime.now(timezone.utc).isoformat()
 
+    # Reminder index: the daily reminder job queries invoices by this date
+    invoice_data["nextReminderDate"], invoice_data["nextReminderType"] = next_payment_reminder(
+        invoice_data["invoiceDate"], invoice_data["dueDate"], datetime.now().date()
+    )
+
     # Upsert → if doc exists, overwrite with latest data
     doc_ref.set(invoice_data)
+    invalidate_invoice(company_id, tenant_id, doc_id)
 
     return {"id": doc_ref.id, **invoice_data}
 
@@ -76,9 +205,153 @@ def save_invoice(company_id: str, tenant_id: str | None, invoice_data: dict):
 
 
 
+def _payments_ref(company_id: str, tenant_id: str | None, client=None):
+    """Payments collection of a company, or of a tenant under it."""
+    client = client or firestore_client
+    if tenant_id is None:
+        return client.collection("companies").document(company_id).collection("payments")
+    return client.collection("companies").document(company_id).collection("tenants").document(tenant_id).collection("payments")
+
+
+def _payment_record(payment_data: dict) -> tuple[str, dict]:
+    """
+    Validates payment data and builds the stored payment record.
+
+    Returns:
+        tuple: (document ID "REC_{invoice_number}", payment record)
+    """
+    payment_id = payment_data.get("payment_id")
+    invoice_number = payment_data.get("invoice_number")
+
+    if not payment_id:
+        raise ValueError("payment_id is missing in payment_data")
+    if not invoice_number:
+        raise ValueError("invoice_number is missing in payment_data")
+
+    # Complete payment record - NO receipt_pdf field
+    payment_record = {
+        "payment_id": payment_id,
+        "invoice_number": invoice_number,
+        "amount_paid": payment_data.get("amount_paid"),
+        "currency": payment_data.get("currency"),
+        "payment_date": payment_data.get("payment_date"),
+        "payment_mode": payment_data.get("payment_mode"),
+        "razorpay_order_id": payment_data.get("razorpay_order_id"),
+        "razorpay_signature": payment_data.get("razorpay_signature"),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    return f"REC_{invoice_number}", payment_record
+
+
+def paid_status_for(invoice_number: str, due_date_str: str | None) -> PaymentStatus:
+    """
+    Status of an invoice paid today.
+    - If paid before or on due date: PAID
+    - If paid after due date: DUE_PAID
+
+    Args:
+        invoice_number: Invoice ID/number (for error messages)
+        due_date_str: The invoice's dueDate (ISO string)
+    """
+    if not due_date_str:
+        raise ValueError(f"Invoice {invoice_number} has no due date")
+
+    # Parse due date (ISO format string)
+    try:
+        due_date = datetime.fromisoformat(due_date_str.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        # Try parsing just the date part
+        due_date = datetime.strptime(due_date_str.split('T')[0], "%Y-%m-%d")
+        due_date = due_date.replace(tzinfo=timezone.utc)
+
+    if datetime.now(timezone.utc).date() <= due_date.date():
+        return PaymentStatus.PAID
+    return PaymentStatus.DUE_PAID
+
+
+def commit_payment(company_id: str, payment_data: dict, tenant_id: str | None = None,
+                   invoice: dict | None = None, update_time=None) -> str | None:
+    """
+    Records a payment in one atomic write: the REC_{invoice_number} payment record and
+    the invoice's payment_status change are committed in the same batch, so they can't
+    end up out of sync.
+
+    The invoice the caller already loaded (e.g. from get_invoice_with_update_time) decides
+    "paid" vs "due_paid", so a payment normally costs a single commit. The batch is
+    conditioned on that invoice's update time: if the invoice changed since (a stale cached
+    copy, or a payment recorded by another request or worker), the commit fails, the
+    invoice is read again and the decision is made again, at most
+    PAYMENT_COMMIT_MAX_ATTEMPTS times in all.
+
+    Paths:
+    - Top-level: companies/{company_id}/payments/REC_{invoice_number} + companies/{company_id}/invoices/{invoice_number}
+    - Tenant: the same under companies/{company_id}/tenants/{tenant_id}
+
+    Args:
+        company_id: Company ID
+        payment_data: Payment data (payment_id, invoice_number, amount_paid, ...)
+        tenant_id: Optional tenant ID for nested structure
+        invoice: The invoice as loaded by the caller; read here when not given
+        update_time: Update time of the document `invoice` was read from
+
+    Returns:
+        str | None: The invoice's new payment_status ("paid" or "due_paid"), or None if
+        the invoice was already paid (nothing is written)
+
+    Raises:
+        ValueError: The invoice doesn't exist
+        FailedPrecondition: The invoice kept changing for PAYMENT_COMMIT_MAX_ATTEMPTS attempts
+    """
+    try:
+        doc_id, payment_record = _payment_record(payment_data)
+        invoice_number = payment_record["invoice_number"]
+        invoice_ref = _invoices_ref(company_id, tenant_id).document(invoice_number)
+        if update_time is None:
+            invoice = None
+
+        for attempt in range(1, PAYMENT_COMMIT_MAX_ATTEMPTS + 1):
+            if invoice is None:
+                snapshot = invoice_ref.get()
+                if not snapshot.exists:
+                    raise ValueError(f"Invoice {invoice_number} not found for company {company_id}")
+                invoice, update_time = snapshot.to_dict(), snapshot.update_time
+            if invoice.get("payment_status") in (PaymentStatus.PAID.value, PaymentStatus.DUE_PAID.value):
+                print(f"⚠️ Invoice {invoice_number} is already '{invoice['payment_status']}'; payment {payment_record['payment_id']} not recorded")
+                return None
+            payment_status = paid_status_for(invoice_number, invoice.get("dueDate")).value
+
+            batch = firestore_client.batch()
+            batch.set(_payments_ref(company_id, tenant_id).document(doc_id), payment_record)
+            batch.update(
+                invoice_ref, {"payment_status": payment_status},
+                option=firestore_client.write_option(last_update_time=update_time),
+            )
+            try:
+                batch.commit()
+                break
+            except FailedPrecondition:
+                if attempt == PAYMENT_COMMIT_MAX_ATTEMPTS:
+                    raise
+                # The invoice changed since it was read (possibly paid); read it and decide again
+                print(f"🔁 Invoice {invoice_number} changed while recording payment {payment_record['payment_id']}; re-reading")
+                invalidate_invoice(company_id, tenant_id, invoice_number)
+                invoice = None
+
+        invalidate_invoice(company_id, tenant_id, invoice_number)
+
+        owner = f"companies/{company_id}" if tenant_id is None else f"companies/{company_id}/tenants/{tenant_id}"
+        print(f"✅ Payment {doc_id} committed under {owner}; invoice {invoice_number} is now '{payment_status}'")
+        return payment_status
+
+    except Exception as e:
+        print(f"❌ Failed to commit payment for {company_id}: {e}")
+        raise
+
+
 def save_payment_record(company_id: str, payment_data: dict, tenant_id: str | None = None):
     """
     Saves complete payment record under the company's 'payments' subcollection.
+    Use commit_payment() to also update the invoice in the same write.
     
     Paths:
     - Top-level: companies/{company_id}/payments/REC_{invoice_number}
@@ -90,53 +363,14 @@ def save_payment_record(company_id: str, payment_data: dict, tenant_id: str | No
         tenant_id: Optional tenant ID for nested structure
     """
     try:
-        # Validate required data
-        payment_id = payment_data.get("payment_id")
-        invoice_number = payment_data.get("invoice_number")
-        
-        if not payment_id:
-            raise ValueError("payment_id is missing in payment_data")
-        if not invoice_number:
-            raise ValueError("invoice_number is missing in payment_data")
+        doc_id, payment_record = _payment_record(payment_data)
 
-        # 🔧 FIX: Handle both top-level and tenant payment records
         if tenant_id is None:
-            # Top-level payment record
-            payments_ref = (
-                firestore_client
-                .collection("companies")
-                .document(company_id)
-                .collection("payments")
-            )
-            print(f"📍 Saving top-level payment: companies/{company_id}/payments/REC_{invoice_number}")
+            print(f"📍 Saving top-level payment: companies/{company_id}/payments/{doc_id}")
         else:
-            # Tenant payment record
-            payments_ref = (
-                firestore_client
-                .collection("companies")
-                .document(company_id)
-                .collection("tenants")
-                .document(tenant_id)
-                .collection("payments")
-            )
-            print(f"📍 Saving tenant payment: companies/{company_id}/tenants/{tenant_id}/payments/REC_{invoice_number}")
-
-        # Complete payment record - NO receipt_pdf field
-        payment_record = {
-            "payment_id": payment_id,
-            "invoice_number": invoice_number,
-            "amount_paid": payment_data.get("amount_paid"),
-            "currency": payment_data.get("currency"),
-            "payment_date": payment_data.get("payment_date"),
-            "payment_mode": payment_data.get("payment_mode"),
-            "razorpay_order_id": payment_data.get("razorpay_order_id"),
-            "razorpay_signature": payment_data.get("razorpay_signature"),
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        }
+            print(f"📍 Saving tenant payment: companies/{company_id}/tenants/{tenant_id}/payments/{doc_id}")
 
-        # Use REC_{invoice_number} as document ID
-        doc_id = f"REC_{invoice_number}"
-        payments_ref.document(doc_id).set(payment_record)
+        _payments_ref(company_id, tenant_id).document(doc_id).set(payment_record)
 
         if tenant_id is None:
             print(f"✅ Payment record saved under companies/{company_id}/payments/{doc_id}")
@@ -154,6 +388,8 @@ def mark_invoice_as_paid(company_id: str, invoice_number: str, payment_data: dic
     Marks an invoice as paid - updates payment_status based on due date.
     - If paid before or on due date: status = "paid"
     - If paid after due date: status = "due_paid"
+
+    commit_payment() records the payment and the status in one write instead.
     
     Paths:
     - Top-level: companies/{company_id}/invoices/{invoice_number}
@@ -166,26 +402,10 @@ def mark_invoice_as_paid(company_id: str, invoice_number: str, payment_data: dic
         tenant_id: Optional tenant ID for nested invoices
     """
     try:
-        # 🔧 FIX: Handle both top-level and nested tenant invoices
+        invoice_ref = _invoices_ref(company_id, tenant_id).document(invoice_number)
         if tenant_id is None:
-            invoice_ref = (
-                firestore_client
-                .collection("companies")
-                .document(company_id)
-                .collection("invoices")
-                .document(invoice_number)
-            )
             print(f"📍 Updating top-level invoice: companies/{company_id}/invoices/{invoice_number}")
         else:
-            invoice_ref = (
-                firestore_client
-                .collection("companies")
-                .document(company_id)
-                .collection("tenants")
-                .document(tenant_id)
-                .collection("invoices")
-                .document(invoice_number)
-            )
             print(f"📍 Updating tenant invoice: companies/{company_id}/tenants/{tenant_id}/invoices/{invoice_number}")
 
         # Fetch the invoice to get the due date
@@ -193,37 +413,15 @@ def mark_invoice_as_paid(company_id: str, invoice_number: str, payment_data: dic
         if not invoice_doc.exists:
             raise ValueError(f"Invoice {invoice_number} not found at the expected path")
         
-        invoice_data = invoice_doc.to_dict()
-        due_date_str = invoice_data.get("dueDate")
-        
-        if not due_date_str:
-            raise ValueError(f"Invoice {invoice_number} has no due date")
-        
-        # Parse due date (ISO format string)
-        try:
-            due_date = datetime.fromisoformat(due_date_str.replace('Z', '+00:00'))
-        except (ValueError, AttributeError):
-            # Try parsing just the date part
-            due_date = datetime.strptime(due_date_str.split('T')[0], "%Y-%m-%d")
-            due_date = due_date.replace(tzinfo=timezone.utc)
-        
-        # Get current date
-        current_date = datetime.now(timezone.utc)
-        
-        # Determine payment status based on due date
-        if current_date.date() <= due_date.date():
-            payment_status = PaymentStatus.PAID.value
+        status = paid_status_for(invoice_number, invoice_doc.to_dict().get("dueDate"))
+        if status is PaymentStatus.PAID:
             status_msg = "paid (on time)"
         else:
-            payment_status = PaymentStatus.DUE_PAID.value
             status_msg = "due_paid (paid after due date)"
 
         # Update only payment_status
-        update_data = {
-            "payment_status": payment_status,
-        }
-
-        invoice_ref.update(update_data)
+        invoice_ref.update({"payment_status": status.value})
+        invalidate_invoice(company_id, tenant_id, invoice_number)
         print(f"✅ Invoice {invoice_number} payment_status updated to '{status_msg}'")
 
     except Exception as e:
@@ -231,6 +429,163 @@ def mark_invoice_as_paid(company_id: str, invoice_number: str, payment_data: dic
         raise
 
 
+def get_payment_intent(company_id: str, tenant_id: str | None, invoice_number: str, provider: str) -> tuple[dict | None, object]:
+    """
+    Reads the invoice's stored order/session for provider straight from Firestore
+    (not the invoice cache), for a conditional save_payment_intent().
+
+    Args:
+        company_id: Company ID
+        tenant_id: Optional tenant ID for nested invoices
+        invoice_number: Invoice ID/number
+        provider: "razorpay" or "stripe"
+
+    Returns:
+        tuple: (paymentIntents.{provider} or None, the invoice's update time)
+
+    Raises:
+        ValueError: If the invoice doesn't exist
+    """
+    snapshot = _invoices_ref(company_id, tenant_id).document(invoice_number).get()
+    if not snapshot.exists:
+        raise ValueError(f"Invoice {invoice_number} not found for company {company_id}")
+    return ((snapshot.to_dict() or {}).get("paymentIntents") or {}).get(provider), snapshot.update_time
+
+
+def save_payment_intent(
+    company_id: str,
+    tenant_id: str | None,
+    invoice_number: str,
+    provider: str,
+    intent: dict | None,
+    update_time=None,
+) -> bool:
+    """
+    Stores the open payment order/session of an invoice (or a claim on creating one)
+    under paymentIntents.{provider}, so payment retries can reuse it instead of
+    creating a new one.
+
+    Args:
+        company_id: Company ID
+        tenant_id: Optional tenant ID for nested invoices
+        invoice_number: Invoice ID/number
+        provider: "razorpay" or "stripe"
+        intent: Order/session summary (id, amount, currency, expires_at, response),
+            a creation claim, or None to clear the slot
+        update_time: From get_payment_intent(); the write only happens if the invoice
+            hasn't changed since then
+
+    Returns:
+        bool: False if the invoice changed since update_time (another request wrote first)
+    """
+    ref = _invoices_ref(company_id, tenant_id).document(invoice_number)
+    try:
+        if update_time is None:
+            ref.update({f"paymentIntents.{provider}": intent})
+        else:
+            ref.update({f"paymentIntents.{provider}": intent}, option=firestore_client.write_option(last_update_time=update_time))
+    except FailedPrecondition:
+        return False
+    invalidate_invoice(company_id, tenant_id, invoice_number)
+    return True
+
+
+def _commit_update_batch(updates: list[dict]) -> tuple[list[str], list[dict]]:
+    """
+    Commits one write batch. A batch is all-or-nothing, so when it fails the documents
+    are retried one by one to find out which of them actually failed.
+
+    Returns:
+        tuple: (updated document paths, [{"path", "error"}] failures)
+    """
+    def _option(update: dict):
+        if update.get("update_time") is None:
+            return None
+        return firestore_client.write_option(last_update_time=update["update_time"])
+
+    batch = firestore_client.batch()
+    for update in updates:
+        option = _option(update)
+        if option is None:
+            batch.update(update["ref"], update["data"])
+        else:
+            batch.update(update["ref"], update["data"], option=option)
+    try:
+        batch.commit()
+        return [u["ref"].path for u in updates], []
+    except Exception as batch_error:
+        print(f"⚠️ Write batch of {len(updates)} failed ({batch_error}); retrying documents individually")
+
+    updated, failed = [], []
+    for update in updates:
+        option = _option(update)
+        try:
+            if option is None:
+                update["ref"].update(update["data"])
+            else:
+                update["ref"].update(update["data"], option=option)
+            updated.append(update["ref"].path)
+        except Exception as e:
+            failed.append({"path": update["ref"].path, "error": str(e)})
+    return updated, failed
+
+
+def bulk_update_invoices(updates: list[dict], max_parallel: int = BULK_WRITE_PARALLELISM) -> dict:
+    """
+    Applies many invoice updates using write batches of up to 500 documents,
+    committing up to max_parallel batches at a time.
+
+    Args:
+        updates: {"ref": DocumentReference, "data": dict of fields to update,
+                  "update_time": optional last-update precondition (skips the write if the
+                  document changed since it was read, e.g. paid in the meantime)}
+        max_parallel: Number of batches committed concurrently
+
+    Returns:
+        dict: {"updated": [document paths], "failed": [{"path", "error"}]}
+    """
+    chunks = [updates[i:i + MAX_BATCH_WRITES] for i in range(0, len(updates), MAX_BATCH_WRITES)]
+    updated, failed = [], []
+    if not chunks:
+        return {"updated": updated, "failed": failed}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(chunks))), thread_name_prefix="bulk-write") as pool:
+        for chunk_updated, chunk_failed in pool.map(_commit_update_batch, chunks):
+            updated.extend(chunk_updated)
+            failed.extend(chunk_failed)
+
+    for path in updated:
+        owner = _invoice_owner_from_path(path)
+        if owner is not None:
+            invalidate_invoice(*owner, path.rsplit("/", 1)[1])
+
+    for failure in failed:
+        print(f"⚠️ Failed to update invoice {failure['path']}: {failure['error']}")
+    print(f"📊 Bulk invoice update: {len(updated)} updated, {len(failed)} failed ({len(chunks)} batches)")
+    return {"updated": updated, "failed": failed}
+
+
+def bulk_transition_invoice_status(invoice_docs: list, new_status: PaymentStatus, extra_fields: dict | None = None) -> dict:
+    """
+    Moves invoices to a new payment status in bulk (see bulk_update_invoices).
+
+    Args:
+        invoice_docs: Invoice document snapshots read by the caller. Each write is
+                      conditioned on the snapshot's update time, so an invoice that
+                      changed after it was read (e.g. got paid) is not overwritten.
+        new_status: Target payment status
+        extra_fields: Additional fields written with the status
+
+    Returns:
+        dict: {"updated": [document paths], "failed": [{"path", "error"}]}
+    """
+    data = {"payment_status": PaymentStatus(new_status).value, **(extra_fields or {})}
+    return bulk_update_invoices([
+        {"ref": doc.reference, "data": data, "update_time": getattr(doc, "update_time", None)}
+        for doc in invoice_docs
+    ])
+
+
 def update_overdue_invoices(company_id: str, tenant_id: str | None = None):
     """
     Updates all pending invoices past their due date to 'due' status.
@@ -270,7 +625,7 @@ def update_overdue_invoices(company_id: str, tenant_id: str | None = None):
         )
         
         current_date = datetime.now(timezone.utc)
-        updated_count = 0
+        overdue_docs = []
         skipped_count = 0
         
         for invoice_doc in pending_invoices:
@@ -297,12 +652,12 @@ def update_overdue_invoices(company_id: str, tenant_id: str | None = None):
             
             # Check if past due
             if current_date.date() > due_date.date():
-                # Update to 'due' status
-                invoice_doc.reference.update({
-                    "payment_status": PaymentStatus.DUE.value
-                })
-                print(f"✅ Invoice {invoice_id} updated from 'pending' to 'due'")
-                updated_count += 1
+                overdue_docs.append(invoice_doc)
+
+        # Update to 'due' status
+        result = bulk_transition_invoice_status(overdue_docs, PaymentStatus.DUE)
+        updated_count = len(result["updated"])
+        skipped_count += len(result["failed"])
         
         summary = {
             "updated": updated_count,
@@ -317,123 +672,208 @@ def update_overdue_invoices(company_id: str, tenant_id: str | None = None):
         raise
 
 
+def _invoice_owner_from_path(path: str) -> tuple[str, str | None] | None:
+    """
+    Company and tenant of an invoice document, parsed from its path:
+    - companies/{company_id}/invoices/{invoice_id} -> (company_id, None)
+    - companies/{company_id}/tenants/{tenant_id}/invoices/{invoice_id} -> (company_id, tenant_id)
+    Returns None for any other 'invoices' collection.
+    """
+    parts = path.split("/")
+    if len(parts) == 4 and parts[0] == "companies" and parts[2] == "invoices":
+        return parts[1], None
+    if len(parts) == 6 and parts[0] == "companies" and parts[2] == "tenants" and parts[4] == "invoices":
+        return parts[1], parts[3]
+    return None
+
+
 def update_all_overdue_invoices():
     """
-    Updates overdue invoices across all companies.
+    Updates overdue invoices across all companies and tenants.
     This function can be called by a scheduled task or endpoint.
-    
+
+    Uses a single collection-group query over every 'invoices' collection for pending
+    invoices whose due date is before today (UTC), so the cost grows with the number of
+    overdue invoices rather than with the number of companies and tenants.
+    Requires the (payment_status, dueDate) collection-group index in firestore.indexes.json.
+
     Returns:
         dict: Summary of all updates
     """
     try:
-        total_updated = 0
         total_skipped = 0
-        companies_processed = 0
-        
-        # Get all companies
-        companies_ref = firestore_client.collection("companies")
-        companies = companies_ref.stream()
-        
-        for company_doc in companies:
-            company_id = company_doc.id
-            print(f"🔍 Processing company: {company_id}")
-            
-            # Update top-level invoices
-            try:
-                result = update_overdue_invoices(company_id, tenant_id=None)
-                total_updated += result["updated"]
-                total_skipped += result["skipped"]
-            except Exception as e:
-                print(f"⚠️ Error processing company {company_id}: {e}")
-            
-            # Check for tenants
-            tenants_ref = company_doc.reference.collection("tenants")
-            tenants = tenants_ref.stream()
-            
-            for tenant_doc in tenants:
-                tenant_id = tenant_doc.id
-                print(f"🔍 Processing tenant: {company_id}/{tenant_id}")
-                try:
-                    result = update_overdue_invoices(company_id, tenant_id)
-                    total_updated += result["updated"]
-                    total_skipped += result["skipped"]
-                except Exception as e:
-                    print(f"⚠️ Error processing tenant {company_id}/{tenant_id}: {e}")
-            
-            companies_processed += 1
-        
+        overdue_docs = []
+
+        # dueDate is an ISO-8601 string, so a string range compares by date: anything
+        # due before today's date sorts below "YYYY-MM-DD" of today
+        today = datetime.now(timezone.utc).date().isoformat()
+        overdue_query = (
+            firestore_client.collection_group("invoices")
+            .where("payment_status", "==", PaymentStatus.PENDING.value)
+            .where("dueDate", "<", today)
+        )
+
+        for invoice_doc in overdue_query.stream():
+            if _invoice_owner_from_path(invoice_doc.reference.path) is None:
+                print(f"⚠️ Skipping invoice outside companies/: {invoice_doc.reference.path}")
+                total_skipped += 1
+                continue
+            overdue_docs.append(invoice_doc)
+
+        result = bulk_transition_invoice_status(overdue_docs, PaymentStatus.DUE)
+        total_updated = len(result["updated"])
+        total_skipped += len(result["failed"])
+        companies = {_invoice_owner_from_path(path)[0] for path in result["updated"]}
+
         summary = {
-            "companies_processed": companies_processed,
+            "companies_processed": len(companies),
             "total_updated": total_updated,
             "total_skipped": total_skipped,
-            "message": f"Processed {companies_processed} companies, updated {total_updated} overdue invoices"
+            "message": f"Updated {total_updated} overdue invoices across {len(companies)} companies"
         }
         print(f"✅ {summary['message']}")
         return summary
-        
+
     except Exception as e:
         print(f"❌ Failed to update all overdue invoices: {e}")
         raise
 
 
-def get_all_pending_invoices():
+def get_invoices_due_for_reminder(day: str) -> list[dict]:
     """
-    Fetches all invoices with payment_status='pending' across all companies and tenants.
-    
+    Pending invoices whose next payment reminder falls on or before the given day, across
+    all companies and tenants. Reminders are only moved on once sent, so one missed on an
+    earlier day (scheduler down, failed send) is picked up by the next run; the reminder
+    type is the latest one due (see due_payment_reminder).
+
+    One collection-group query on the reminder index (nextReminderDate), projected so
+    matches cost no document payload; full documents are then fetched in one batched
+    read only for the invoices that will get an email.
+    Requires the (payment_status, nextReminderDate) collection-group index in
+    firestore.indexes.json.
+
+    Args:
+        day: Date as YYYY-MM-DD
+
     Returns:
-        list: List of dictionaries containing invoice data with metadata
-              Each dict contains: invoice_data, company_id, tenant_id (or None)
+        list: Dicts with invoice_data (incl. invoice_id / invoice_number), company_id, tenant_id (or None),
+              reminder_type and snapshot (for conditional follow-up writes)
     """
     try:
-        pending_invoices = []
-        
-        # Get all companies
-        companies_ref = firestore_client.collection("companies")
-        companies = companies_ref.stream()
-        
-        for company_doc in companies:
-            company_id = company_doc.id
-            
-            # Query top-level invoices for this company
-            try:
-                invoices_ref = company_doc.reference.collection("invoices")
-                pending_query = invoices_ref.where("payment_status", "==", PaymentStatus.PENDING.value)
-                
-                for invoice_doc in pending_query.stream():
-                    invoice_data = invoice_doc.to_dict()
-                    invoice_data["invoice_id"] = invoice_doc.id
-                    pending_invoices.append({
-                        "invoice_data": invoice_data,
-                        "company_id": company_id,
-                        "tenant_id": None
-                    })
-            except Exception as e:
-                print(f"⚠️ Error fetching invoices for company {company_id}: {e}")
-            
-            # Query tenant invoices
-            tenants_ref = company_doc.reference.collection("tenants")
-            tenants = tenants_ref.stream()
-            
-            for tenant_doc in tenants:
-                tenant_id = tenant_doc.id
-                try:
-                    tenant_invoices_ref = tenant_doc.reference.collection("invoices")
-                    tenant_pending_query = tenant_invoices_ref.where("payment_status", "==", PaymentStatus.PENDING.value)
-                    
-                    for invoice_doc in tenant_pending_query.stream():
-                        invoice_data = invoice_doc.to_dict()
-                        invoice_data["invoice_id"] = invoice_doc.id
-                        pending_invoices.append({
-                            "invoice_data": invoice_data,
-                            "company_id": company_id,
-                            "tenant_id": tenant_id
-                        })
-                except Exception as e:
-                    print(f"⚠️ Error fetching invoices for tenant {company_id}/{tenant_id}: {e}")
-        
-        print(f"📋 Found {len(pending_invoices)} pending invoices")
-        return pending_invoices
-        
+        reminder_query = (
+            firestore_client.collection_group("invoices")
+            .where("payment_status", "==", PaymentStatus.PENDING.value)
+            .where("nextReminderDate", "<=", day)
+            .select(["nextReminderDate"])
+        )
+
+        refs = []
+        for match in reminder_query.stream():
+            if _invoice_owner_from_path(match.reference.path) is None:
+                print(f"⚠️ Skipping invoice outside companies/: {match.reference.path}")
+                continue
+            refs.append(match.reference)
+
+        due_invoices = []
+        reminder_day = datetime.strptime(day, "%Y-%m-%d").date()
+        if refs:
+            for invoice_doc in firestore_client.get_all(refs):
+                invoice_data = invoice_doc.to_dict() if invoice_doc.exists else None
+                # Re-check: the invoice may have been paid or reminded since the query
+                if not invoice_data or invoice_data.get("payment_status") != PaymentStatus.PENDING.value:
+                    continue
+                scheduled = invoice_data.get("nextReminderDate")
+                if not scheduled or scheduled > day:
+                    continue
+                reminder_type = due_payment_reminder(
+                    invoice_data.get("invoiceDate"), invoice_data.get("dueDate"), scheduled, reminder_day
+                )
+                if reminder_type is None:
+                    print(f"⚠️ Skipping invoice with no reminder due: {invoice_doc.reference.path}")
+                    continue
+                company_id, tenant_id = _invoice_owner_from_path(invoice_doc.reference.path)
+                invoice_data["invoice_id"] = invoice_doc.id
+                invoice_data["invoice_number"] = invoice_doc.id
+                due_invoices.append({
+                    "invoice_data": invoice_data,
+                    "company_id": company_id,
+                    "tenant_id": tenant_id,
+                    "reminder_type": reminder_type,
+                    "snapshot": invoice_doc,
+                })
+
+        print(f"📋 Found {len(due_invoices)} invoices due for a reminder on {day}")
+        return due_invoices
+
     except Exception as e:
-        print(f"❌ Failed to fetch pending invoices: {e}")
-        raise
\ No newline at end of file
+        print(f"❌ Failed to fetch invoices due for a reminder: {e}")
+        raise
+
+
+def advance_reminder_index(snapshots: list, after: date) -> dict:
+    """
+    Moves each invoice's nextReminderDate to its next reminder after the given day
+    (cleared once the final reminder has gone out). Writes are conditioned on the
+    snapshot's update time, so an invoice changed in the meantime is left alone.
+
+    Returns:
+        dict: {"updated": [document paths], "failed": [{"path", "error"}]}
+    """
+    updates = []
+    for snapshot in snapshots:
+        invoice_data = snapshot.to_dict() or {}
+        next_date, next_type = next_payment_reminder(
+            invoice_data.get("invoiceDate"), invoice_data.get("dueDate"), after + timedelta(days=1)
+        )
+        updates.append({
+            "ref": snapshot.reference,
+            "data": {"nextReminderDate": next_date, "nextReminderType": next_type},
+            "update_time": getattr(snapshot, "update_time", None),
+        })
+    return bulk_update_invoices(updates)
+
+
+def backfill_reminder_index() -> dict:
+    """
+    One-off migration: sets nextReminderDate/nextReminderType on pending invoices saved
+    before the reminder index existed. Reminders already in the past are not scheduled.
+
+    Returns:
+        dict: Summary of the backfill
+    """
+    try:
+        today = datetime.now().date()
+        pending_query = (
+            firestore_client.collection_group("invoices")
+            .where("payment_status", "==", PaymentStatus.PENDING.value)
+            .select(["invoiceDate", "dueDate", "nextReminderDate"])
+        )
+
+        updates = []
+        for invoice_doc in pending_query.stream():
+            if _invoice_owner_from_path(invoice_doc.reference.path) is None:
+                continue
+            invoice_data = invoice_doc.to_dict() or {}
+            if "nextReminderDate" in invoice_data:
+                continue
+            next_date, next_type = next_payment_reminder(
+                invoice_data.get("invoiceDate"), invoice_data.get("dueDate"), today
+            )
+            updates.append({
+                "ref": invoice_doc.reference,
+                "data": {"nextReminderDate": next_date, "nextReminderType": next_type},
+                "update_time": getattr(invoice_doc, "update_time", None),
+            })
+
+        result = bulk_update_invoices(updates)
+        summary = {
+            "total_updated": len(result["updated"]),
+            "total_failed": len(result["failed"]),
+            "message": f"Reminder index set on {len(result['updated'])} pending invoices"
+        }
+        print(f"✅ {summary['message']}")
+        return summary
+
+    except Exception as e:
+        print(f"❌ Failed to backfill reminder index: {e}")
+        raise
@@ -1,26 +1,244 @@
-from db_configs.firebase_db import firestore_client
-from datetime import datetime
+from db_configs.firebase_db import firestore_client, firestore_async_client
+from repositories.usage_rollup_repo import get_rollups_for_period
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator
 from google.cloud.firestore import Query
+import math
+import os
+import threading
+import time
 
-def get_calls_from_top_level(company_id: str, start_date: datetime, end_date: datetime):
-    """Fetch calls from top-level `calls` collection."""
-    calls_ref = firestore_client.collection("calls")
-    query = (calls_ref
-            .where("companyId", "==", company_id)
-            .where("receivedAt", ">=", start_date)
-            .where("receivedAt", "<=", end_date)
-            .order_by("receivedAt", direction=Query.DESCENDING)
-            .order_by(firestore_client.field_path('__name__'), direction=Query.DESCENDING))
-    
-    return [doc.to_dict() for doc in query.stream()]
-
-def get_calls_from_company_doc(company_id: str, start_date: datetime, end_date: datetime):
-    """Fetch calls from nested `companies/{company}/calls` collection."""
-    calls_ref = firestore_client.collection("companies").document(company_id).collection("calls")
-    query = (calls_ref
-            .where("receivedAt", ">=", start_date)
-            .where("receivedAt", "<=", end_date)
-            .order_by("receivedAt", direction=Query.DESCENDING)
-            .order_by(firestore_client.field_path('__name__'), direction=Query.DESCENDING))
-    
-    return [doc.to_dict() for doc in query.stream()]
+# Large ranges are split into receivedAt slices streamed concurrently (one gRPC stream each)
+CALL_SCAN_PARALLELISM = int(os.getenv("CALL_SCAN_PARALLELISM", "8"))
+CALL_SCAN_MAX_SLICES = int(os.getenv("CALL_SCAN_MAX_SLICES", "32"))
+# Target number of calls per slice; the slice count follows the range's call density
+CALL_SCAN_CALLS_PER_SLICE = int(os.getenv("CALL_SCAN_CALLS_PER_SLICE", "2000"))
+# Ranges are never cut into slices shorter than this
+CALL_SCAN_MIN_SLICE_SECONDS = 3600
+# Days of stored rollups an entity's call density is estimated from before its first scan
+CALL_SCAN_DENSITY_DAYS = int(os.getenv("CALL_SCAN_DENSITY_DAYS", "7"))
+# Call density assumed for an entity that has neither been scanned nor rolled up
+CALL_SCAN_DEFAULT_CALLS_PER_HOUR = float(os.getenv("CALL_SCAN_DEFAULT_CALLS_PER_HOUR", "20"))
+
+# Call fields read by usage aggregation (billed minutes, per-day histogram, tenant split)
+BILLING_CALL_FIELDS = ["duration", "receivedAt", "tenantId"]
+# Call fields read when billing also writes the detailed call log CSV
+CSV_CALL_FIELDS = BILLING_CALL_FIELDS + ["id", "customer_phone", "assistant_phone", "finished_at", "created_at"]
+
+_scan_pool = ThreadPoolExecutor(max_workers=CALL_SCAN_PARALLELISM, thread_name_prefix="call-scan")
+# (source, company_id, tenant_id) -> calls per second seen by the last full scan (or estimated from rollups)
+_observed_density = {}
+_density_lock = threading.Lock()
+
+def _range_query(query, start_date: datetime, end_date: datetime, fields: list[str] | None, tenant_id: str | None,
+                 end_inclusive: bool = True):
+    """
+    Adds the receivedAt range and ordering to a call query, plus the optional server-side options:
+    - tenant_id: only calls of that tenant (tenantId equality filter)
+    - fields: projection, so documents come back without transcripts and other unused fields
+    Tenant-filtered queries need the composite indexes in firestore.indexes.json.
+    """
+    if tenant_id is not None:
+        query = query.where("tenantId", "==", tenant_id)
+    query = (query
+             .where("receivedAt", ">=", start_date)
+             .where("receivedAt", "<=" if end_inclusive else "<", end_date)
+             .order_by("receivedAt", direction=Query.DESCENDING)
+             .order_by(firestore_client.field_path('__name__'), direction=Query.DESCENDING))
+    if fields is not None:
+        query = query.select(fields)
+    return query
+
+def _top_level_query(company_id: str, start_date: datetime, end_date: datetime,
+                     fields: list[str] | None = None, tenant_id: str | None = None, end_inclusive: bool = True,
+                     client=None):
+    calls_ref = (client or firestore_client).collection("calls")
+    return _range_query(calls_ref.where("companyId", "==", company_id), start_date, end_date, fields, tenant_id, end_inclusive)
+
+def _company_doc_query(company_id: str, start_date: datetime, end_date: datetime,
+                       fields: list[str] | None = None, tenant_id: str | None = None, end_inclusive: bool = True,
+                       client=None):
+    calls_ref = (client or firestore_client).collection("companies").document(company_id).collection("calls")
+    return _range_query(calls_ref, start_date, end_date, fields, tenant_id, end_inclusive)
+
+def _max_slices(start_date: datetime, end_date: datetime) -> int:
+    """Most slices a range may be cut into (CALL_SCAN_MAX_SLICES, minimum slice length)."""
+    seconds = (end_date - start_date).total_seconds()
+    return min(CALL_SCAN_MAX_SLICES, int(seconds // CALL_SCAN_MIN_SLICE_SECONDS))
+
+def _known_density(density_key: tuple) -> float | None:
+    """Calls per second seen by the previous scan of the same source and entity, if any."""
+    with _density_lock:
+        return _observed_density.get(density_key)
+
+def _rollup_density(density_key: tuple, end_date: datetime) -> float:
+    """
+    Estimates an entity's call density from its daily rollups of the CALL_SCAN_DENSITY_DAYS
+    days up to end_date (one small query, whose call counts seed every source), falling back
+    to CALL_SCAN_DEFAULT_CALLS_PER_HOUR when it has none.
+    """
+    _, company_id, tenant_id = density_key
+    default = CALL_SCAN_DEFAULT_CALLS_PER_HOUR / 3600
+    last_day = end_date.date()
+    try:
+        rollups = get_rollups_for_period(company_id, tenant_id, last_day - timedelta(days=CALL_SCAN_DENSITY_DAYS - 1), last_day)
+    except Exception as e:
+        print(f"⚠️ Could not read rollups to size the call scan of {company_id}: {e}")
+        return default
+    if not rollups:
+        return default
+
+    seconds = len(rollups) * 86400
+    with _density_lock:
+        for source in ("top", "nested"):
+            calls = sum(rollup.get("sources", {}).get(source, {}).get("callCount", 0) for rollup in rollups.values())
+            _observed_density.setdefault((source, company_id, tenant_id), calls / seconds)
+        return _observed_density.get(density_key, default)
+
+def _slice_plan(density: float, start_date: datetime, end_date: datetime, max_slices: int) -> list[tuple]:
+    return _slice_ranges(start_date, end_date, max_slices, density * (end_date - start_date).total_seconds())
+
+def _record_density(density_key: tuple, total: int, start_date: datetime, end_date: datetime):
+    seconds = (end_date - start_date).total_seconds()
+    if seconds > 0:
+        with _density_lock:
+            _observed_density[density_key] = total / seconds
+
+def _slice_ranges(start_date: datetime, end_date: datetime, max_slices: int, expected_calls: float) -> list[tuple]:
+    """
+    Splits a range into expected_calls / CALL_SCAN_CALLS_PER_SLICE equal receivedAt slices
+    (at most max_slices), newest first: [(lo, hi, hi_inclusive)], only the newest one closed at end_date.
+    """
+    slices = max(1, min(max_slices, math.ceil(expected_calls / CALL_SCAN_CALLS_PER_SLICE)))
+    step = (end_date - start_date) / slices
+    bounds = [start_date + step * i for i in range(slices)] + [end_date]
+    return [(bounds[i], bounds[i + 1], i == slices - 1) for i in reversed(range(slices))]
+
+def _log_sliced_scan(source: str, company_id: str, tenant_id: str | None, total: int, slices: int, started: float):
+    print(f"🔀 Scanned {total} {source} calls of {company_id}{'/' + tenant_id if tenant_id else ''} "
+          f"in {slices} slices ({time.perf_counter() - started:.2f}s)")
+
+def _scan_calls(query_fn, source: str, company_id: str, start_date: datetime, end_date: datetime,
+                fields: list[str] | None, tenant_id: str | None) -> Iterator[dict]:
+    """
+    Streams calls of a range in descending receivedAt order. Dense ranges are split into
+    equal receivedAt slices ([lo, hi), the newest one closed at end_date) fetched concurrently
+    on the scan pool, at most CALL_SCAN_PARALLELISM ahead of the consumer, and yielded newest
+    slice first, so the output is identical to a single ordered stream.
+
+    The slice count follows the expected number of calls: the density seen by the previous
+    scan of the same source and entity, or else estimated from its rollups (_rollup_density).
+    One slice always stays unsubmitted until the consumer has taken the newest one, so a
+    range whose density was underestimated is never buffered whole.
+    """
+    density_key = (source, company_id, tenant_id)
+    max_slices = _max_slices(start_date, end_date)
+    ranges = [(start_date, end_date, True)]
+    if max_slices > 1:
+        density = _known_density(density_key)
+        if density is None:
+            density = _rollup_density(density_key, end_date)
+        ranges = _slice_plan(density, start_date, end_date, max_slices)
+
+    started = time.perf_counter()
+    total = 0
+
+    if len(ranges) == 1:
+        for doc in query_fn(company_id, start_date, end_date, fields, tenant_id).stream():
+            total += 1
+            yield doc.to_dict()
+    else:
+        def fetch(lo: datetime, hi: datetime, inclusive: bool) -> list[dict]:
+            return [doc.to_dict() for doc in query_fn(company_id, lo, hi, fields, tenant_id, inclusive).stream()]
+
+        pending_ranges = iter(ranges)
+        max_in_flight = min(CALL_SCAN_PARALLELISM, len(ranges) - 1)
+        in_flight = deque(_scan_pool.submit(fetch, *r) for r in islice(pending_ranges, max_in_flight))
+        while in_flight:
+            calls = in_flight.popleft().result()
+            next_range = next(pending_ranges, None)
+            if next_range is not None:
+                in_flight.append(_scan_pool.submit(fetch, *next_range))
+            total += len(calls)
+            yield from calls
+
+        _log_sliced_scan(source, company_id, tenant_id, total, len(ranges), started)
+
+    _record_density(density_key, total, start_date, end_date)
+
+async def _scan_calls_async(query_fn, source: str, company_id: str, start_date: datetime, end_date: datetime,
+                            fields: list[str] | None, tenant_id: str | None) -> list[dict]:
+    """Async variant of _scan_calls on the async client; slices are fetched with asyncio.gather."""
+    client = firestore_async_client
+    density_key = (source, company_id, tenant_id)
+    max_slices = _max_slices(start_date, end_date)
+    ranges = [(start_date, end_date, True)]
+    if max_slices > 1:
+        density = _known_density(density_key)
+        if density is None:
+            density = await asyncio.to_thread(_rollup_density, density_key, end_date)
+        ranges = _slice_plan(density, start_date, end_date, max_slices)
+
+    started = time.perf_counter()
+    slots = asyncio.Semaphore(CALL_SCAN_PARALLELISM)
+
+    async def fetch(lo: datetime, hi: datetime, inclusive: bool) -> list[dict]:
+        async with slots:
+            query = query_fn(company_id, lo, hi, fields, tenant_id, inclusive, client=client)
+            return [doc.to_dict() async for doc in query.stream()]
+
+    calls = [call for part in await asyncio.gather(*(fetch(*r) for r in ranges)) for call in part]
+    if len(ranges) > 1:
+        _log_sliced_scan(source, company_id, tenant_id, len(calls), len(ranges), started)
+    _record_density(density_key, len(calls), start_date, end_date)
+    return calls
+
+def stream_calls_from_top_level(company_id: str, start_date: datetime, end_date: datetime,
+                                fields: list[str] | None = None, tenant_id: str | None = None) -> Iterator[dict]:
+    """
+    Lazily yield calls from top-level `calls` collection without materializing the result.
+    Dense ranges are scanned as concurrent time slices (see _scan_calls).
+    `fields` projects the returned documents; `tenant_id` filters by tenant server-side.
+    """
+    yield from _scan_calls(_top_level_query, "top", company_id, start_date, end_date, fields, tenant_id)
+
+def stream_calls_from_company_doc(company_id: str, start_date: datetime, end_date: datetime,
+                                  fields: list[str] | None = None, tenant_id: str | None = None) -> Iterator[dict]:
+    """
+    Lazily yield calls from nested `companies/{company}/calls` collection without materializing the result.
+    Dense ranges are scanned as concurrent time slices (see _scan_calls).
+    `fields` projects the returned documents; `tenant_id` filters by tenant server-side.
+    """
+    yield from _scan_calls(_company_doc_query, "nested", company_id, start_date, end_date, fields, tenant_id)
+
+def count_calls_from_top_level(company_id: str, start_date: datetime, end_date: datetime) -> int:
+    """Number of calls of a company in the top-level `calls` collection for a range (count() aggregation)."""
+    return _top_level_query(company_id, start_date, end_date).count().get()[0][0].value
+
+def count_calls_from_company_doc(company_id: str, start_date: datetime, end_date: datetime) -> int:
+    """Number of calls in the nested `companies/{company}/calls` collection for a range (count() aggregation)."""
+    return _company_doc_query(company_id, start_date, end_date).count().get()[0][0].value
+
+def get_calls_from_top_level(company_id: str, start_date: datetime, end_date: datetime,
+                             fields: list[str] | None = None, tenant_id: str | None = None):
+    """Fetch calls from top-level `calls` collection (see stream_calls_from_top_level)."""
+    return list(stream_calls_from_top_level(company_id, start_date, end_date, fields, tenant_id))
+
+def get_calls_from_company_doc(company_id: str, start_date: datetime, end_date: datetime,
+                               fields: list[str] | None = None, tenant_id: str | None = None):
+    """Fetch calls from nested `companies/{company}/calls` collection (see stream_calls_from_company_doc)."""
+    return list(stream_calls_from_company_doc(company_id, start_date, end_date, fields, tenant_id))
+
+async def get_calls_from_top_level_async(company_id: str, start_date: datetime, end_date: datetime,
+                                         fields: list[str] | None = None, tenant_id: str | None = None):
+    """Async variant of get_calls_from_top_level (async client, concurrent slices)."""
+    return await _scan_calls_async(_top_level_query, "top", company_id, start_date, end_date, fields, tenant_id)
+
+async def get_calls_from_company_doc_async(company_id: str, start_date: datetime, end_date: datetime,
+                                           fields: list[str] | None = None, tenant_id: str | None = None):
+    """Async variant of get_calls_from_company_doc (async client, concurrent slices)."""
+    return await _scan_calls_async(_company_doc_query, "nested", company_id, start_date, end_date, fields, tenant_id)
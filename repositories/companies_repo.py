@@ -1,12 +1,56 @@
-from db_configs.firebase_db import firestore_client
+from db_configs.firebase_db import firestore_client, firestore_async_client
+from utils.ttl_cache import TTLCache
+import copy
+import os
+
+# Billing profiles change rarely; cache them per process so a batch reads each one once.
+# They are edited outside this service, so the TTL is the only consistency guarantee:
+# a change is picked up within COMPANY_CACHE_TTL_SECONDS (COMPANY_CACHE_NEGATIVE_TTL_SECONDS
+# for a profile that did not exist yet).
+_billing_details_cache = TTLCache(
+    "company_billing_details",
+    ttl_seconds=float(os.getenv("COMPANY_CACHE_TTL_SECONDS", "300")),
+    max_entries=int(os.getenv("COMPANY_CACHE_MAX_ENTRIES", "2048")),
+    negative_ttl_seconds=float(os.getenv("COMPANY_CACHE_NEGATIVE_TTL_SECONDS", "60")),
+)
 
 def get_company_billing_details( company_id: str, tenant_id: str | None ):
+    """
+    Billing profile of a company, or of a tenant under it (None if the document doesn't exist).
+    Served from an in-process TTL cache; missing documents are cached briefly as well.
+    Callers get their own copy and may modify it.
+    """
+    details = _billing_details_cache.get_or_load(
+        (company_id, tenant_id), lambda: _load_company_billing_details(company_id, tenant_id)
+    )
+    return copy.deepcopy(details)
+
+
+async def get_company_billing_details_async( company_id: str, tenant_id: str | None ):
+    """Async variant of get_company_billing_details (same cache, read through the async client)."""
+    async def _load():
+        return _billing_details_from_doc(await _company_doc_ref(firestore_async_client, company_id, tenant_id).get())
+
+    details = await _billing_details_cache.get_or_load_async((company_id, tenant_id), _load)
+    return copy.deepcopy(details)
+
+
+def get_billing_details_cache_stats() -> dict:
+    """Hit/miss counters of the billing profile cache."""
+    return _billing_details_cache.stats()
+
+
+def _company_doc_ref(client, company_id: str, tenant_id: str | None):
     if tenant_id is None:
-        doc_ref = firestore_client.collection("companies").document(company_id)
-    else:
-        doc_ref = firestore_client.collection("companies").document(company_id).collection("tenants").document(tenant_id)
-    doc = doc_ref.get()
-    
+        return client.collection("companies").document(company_id)
+    return client.collection("companies").document(company_id).collection("tenants").document(tenant_id)
+
+
+def _load_company_billing_details( company_id: str, tenant_id: str | None ):
+    return _billing_details_from_doc(_company_doc_ref(firestore_client, company_id, tenant_id).get())
+
+
+def _billing_details_from_doc(doc):
     if not doc.exists:
         return None
     
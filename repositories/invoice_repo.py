@@ -1,15 +1,77 @@
-from db_configs.firebase_db import firestore_client
+from db_configs.firebase_db import firestore_client, firestore_async_client
+from utils.ttl_cache import TTLCache
+import copy
+import os
 
-def get_invoice_by_id(company_id: str, tenant_id: str | None, invoice_id: str):
+# Short-lived read-through cache: one payment flow reads the same invoice from several routes.
+# Invoice writes in this process invalidate it (invalidate_invoice); other processes see
+# changes after at most the TTL.
+_invoice_cache = TTLCache(
+    "invoices",
+    ttl_seconds=float(os.getenv("INVOICE_CACHE_TTL_SECONDS", "30")),
+    max_entries=int(os.getenv("INVOICE_CACHE_MAX_ENTRIES", "4096")),
+    negative_ttl_seconds=float(os.getenv("INVOICE_CACHE_NEGATIVE_TTL_SECONDS", "5")),
+)
+
+def _invoice_doc_ref(client, company_id: str, tenant_id: str | None, invoice_id: str):
+    if tenant_id is None:
+        return client.collection("companies").document(company_id).collection("invoices").document(invoice_id)
+    return client.collection("companies").document(company_id).collection("tenants").document(tenant_id).collection("invoices").document(invoice_id)
+
+def _cache_entry(doc):
+    # Cached with the document's update time, so writers can condition on what was read
+    return {"invoice": doc.to_dict(), "update_time": doc.update_time} if doc.exists else None
+
+def _load_invoice(company_id: str, tenant_id: str | None, invoice_id: str):
+    return _cache_entry(_invoice_doc_ref(firestore_client, company_id, tenant_id, invoice_id).get())
+
+def get_invoice_with_update_time(company_id: str, tenant_id: str | None, invoice_id: str):
+    """
+    Invoice document data and the update time of the document it was read from, or
+    (None, None) if it doesn't exist or can't be read. Served through the invoice cache:
+    pass the update time as a write precondition (see bill_repo.commit_payment) so a
+    stale cached copy is caught instead of acted upon.
+    """
     try:
-        if tenant_id is None:
-            doc_ref = firestore_client.collection("companies").document(company_id).collection("invoices").document(invoice_id)
-        else:
-            doc_ref = firestore_client.collection("companies").document(company_id).collection("tenants").document(tenant_id).collection("invoices").document(invoice_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            return None
-        return doc.to_dict()
+        entry = _invoice_cache.get_or_load(
+            (company_id, tenant_id, invoice_id), lambda: _load_invoice(company_id, tenant_id, invoice_id)
+        )
     except Exception as e:
         print(f"Error fetching invoice: {e}")
-        return None
\ No newline at end of file
+        return None, None
+    if entry is None:
+        return None, None
+    return copy.deepcopy(entry["invoice"]), entry["update_time"]
+
+async def get_invoice_with_update_time_async(company_id: str, tenant_id: str | None, invoice_id: str):
+    """Async variant of get_invoice_with_update_time (same cache, read through the async client)."""
+    try:
+        async def _load():
+            return _cache_entry(await _invoice_doc_ref(firestore_async_client, company_id, tenant_id, invoice_id).get())
+
+        entry = await _invoice_cache.get_or_load_async((company_id, tenant_id, invoice_id), _load)
+    except Exception as e:
+        print(f"Error fetching invoice: {e}")
+        return None, None
+    if entry is None:
+        return None, None
+    return copy.deepcopy(entry["invoice"]), entry["update_time"]
+
+def get_invoice_by_id(company_id: str, tenant_id: str | None, invoice_id: str):
+    """
+    Invoice document data, or None if it doesn't exist or can't be read.
+    Served through the invoice cache; callers get their own copy and may modify it.
+    """
+    return get_invoice_with_update_time(company_id, tenant_id, invoice_id)[0]
+
+async def get_invoice_by_id_async(company_id: str, tenant_id: str | None, invoice_id: str):
+    """Async variant of get_invoice_by_id (same cache, read through the async client)."""
+    return (await get_invoice_with_update_time_async(company_id, tenant_id, invoice_id))[0]
+
+def invalidate_invoice(company_id: str, tenant_id: str | None, invoice_id: str):
+    """Drops a cached invoice; called whenever the invoice document is written."""
+    _invoice_cache.invalidate((company_id, tenant_id, invoice_id))
+
+def get_invoice_cache_stats() -> dict:
+    """Hit/miss counters of the invoice cache."""
+    return _invoice_cache.stats()
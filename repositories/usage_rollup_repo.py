@@ -0,0 +1,171 @@
+import zlib
+
+from db_configs.firebase_db import firestore_client
+from datetime import date, datetime, timedelta, timezone
+
+MAX_BATCH_WRITES = 500
+# Firestore caps a commit request at 10 MiB; leave headroom for field names and framing
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+# Firestore caps a document at 1 MiB; fragments are split into chunk documents of this size
+FRAGMENT_CHUNK_BYTES = 900 * 1024
+
+
+def _rollups_ref(company_id: str, tenant_id: str | None):
+    """
+    Daily usage rollups live next to the invoices of the billed entity:
+    - Company: companies/{company_id}/usageRollups/{YYYY-MM-DD}
+    - Tenant: companies/{company_id}/tenants/{tenant_id}/usageRollups/{YYYY-MM-DD}
+
+    A rollup's CSV fragments are stored under it, in
+    usageRollups/{YYYY-MM-DD}/fragments/{fragmentVersion}.{source}.{chunk}.
+    """
+    if tenant_id is None:
+        return firestore_client.collection("companies").document(company_id).collection("usageRollups")
+    return (firestore_client.collection("companies").document(company_id)
+            .collection("tenants").document(tenant_id).collection("usageRollups"))
+
+
+def _fragment_chunk_refs(rollup_ref, version: str, source: str, chunks: int) -> list:
+    fragments_ref = rollup_ref.collection("fragments")
+    return [fragments_ref.document(f"{version}.{source}.{i}") for i in range(chunks)]
+
+
+def _stored_fragment_refs(rollup_ref, rollup: dict) -> list:
+    """Chunk documents of every fragment of a stored rollup."""
+    version = rollup.get("fragmentVersion")
+    if not version:
+        return []
+    return [
+        ref
+        for source, totals in rollup.get("sources", {}).items()
+        for ref in _fragment_chunk_refs(rollup_ref, version, source, totals.get("fragmentChunks", 0))
+    ]
+
+
+def save_daily_rollups(entries: list[tuple[str, str | None, date, dict]]):
+    """
+    Upserts several daily rollups, with their CSV fragments, using write batches.
+
+    A rollup's fragment chunks are written before (or with) the rollup document, so a
+    rollup is never visible without its fragments. The fragments of the rollup being
+    replaced are deleted afterwards.
+
+    Args:
+        entries: (company_id, tenant_id, day, rollup) tuples. The rollup is stored under
+                 the day's ISO date as document ID. Its "fragments" (source -> CSV bytes)
+                 are compressed and stored as chunk documents under a new fragmentVersion;
+                 rollup["sources"][source]["fragmentChunks"] records how many.
+    """
+    created_at = datetime.now(timezone.utc)
+    version = created_at.strftime("%Y%m%dT%H%M%S%f")
+
+    writes = []  # (ref, data, size in bytes)
+    rollup_refs = []
+    for company_id, tenant_id, day, rollup in entries:
+        rollup_ref = _rollups_ref(company_id, tenant_id).document(day.isoformat())
+        rollup_refs.append(rollup_ref)
+        rollup = {**rollup, "sources": {source: dict(totals) for source, totals in rollup["sources"].items()}}
+        for source, content in rollup.pop("fragments").items():
+            content = zlib.compress(content)
+            chunks = [content[i:i + FRAGMENT_CHUNK_BYTES] for i in range(0, len(content), FRAGMENT_CHUNK_BYTES)]
+            rollup["sources"][source]["fragmentChunks"] = len(chunks)
+            for ref, chunk in zip(_fragment_chunk_refs(rollup_ref, version, source, len(chunks)), chunks):
+                writes.append((ref, {"data": chunk}, len(chunk)))
+        writes.append((rollup_ref, {
+            **rollup, "date": day.isoformat(), "fragmentVersion": version, "createdAt": created_at.isoformat(),
+        }, 0))
+
+    # Fragments of the rollups about to be replaced
+    replaced = [
+        ref
+        for snapshot in firestore_client.get_all(rollup_refs)
+        if snapshot.exists
+        for ref in _stored_fragment_refs(snapshot.reference, snapshot.to_dict())
+    ]
+
+    batch, batch_ops, batch_bytes = firestore_client.batch(), 0, 0
+    for ref, data, size in writes:
+        if batch_ops and (batch_ops == MAX_BATCH_WRITES or batch_bytes + size > MAX_BATCH_BYTES):
+            batch.commit()
+            batch, batch_ops, batch_bytes = firestore_client.batch(), 0, 0
+        batch.set(ref, data)
+        batch_ops += 1
+        batch_bytes += size
+    if batch_ops:
+        batch.commit()
+
+    for i in range(0, len(replaced), MAX_BATCH_WRITES):
+        batch = firestore_client.batch()
+        for ref in replaced[i:i + MAX_BATCH_WRITES]:
+            batch.delete(ref)
+        batch.commit()
+
+
+def get_rollups_for_period(company_id: str, tenant_id: str | None, start_day: date, end_day: date) -> dict[str, dict]:
+    """
+    Fetch the stored daily rollups of an entity for [start_day, end_day].
+
+    Returns:
+        dict: ISO date -> rollup document (days without a rollup are absent)
+    """
+    query = (
+        _rollups_ref(company_id, tenant_id)
+        .where("date", ">=", start_day.isoformat())
+        .where("date", "<=", end_day.isoformat())
+    )
+    return {doc.id: doc.to_dict() for doc in query.stream()}
+
+
+def get_rollups_for_tenants(company_id: str, tenant_ids: list[str], start_day: date, end_day: date) -> dict[str, dict[str, dict]]:
+    """
+    Fetch the stored daily rollups of several tenants of a company for [start_day, end_day]
+    in one batched point read (one document per tenant and day).
+
+    Returns:
+        dict: tenant_id -> ISO date -> rollup document (days without a rollup are absent)
+    """
+    keys = {}
+    for tenant_id in tenant_ids:
+        day = start_day
+        while day <= end_day:
+            ref = _rollups_ref(company_id, tenant_id).document(day.isoformat())
+            keys[ref.path] = (tenant_id, day.isoformat(), ref)
+            day += timedelta(days=1)
+
+    rollups = {tenant_id: {} for tenant_id in tenant_ids}
+    for snapshot in firestore_client.get_all([ref for _, _, ref in keys.values()]) if keys else []:
+        if snapshot.exists:
+            tenant_id, iso_day, _ = keys[snapshot.reference.path]
+            rollups[tenant_id][iso_day] = snapshot.to_dict()
+    return rollups
+
+
+def get_rollup_fragments(company_id: str, tenant_id: str | None, wanted: list[tuple[dict, str]]) -> dict[tuple[str, str], bytes]:
+    """
+    Reads CSV fragments of an entity's rollups in one batched read.
+
+    Args:
+        wanted: (rollup document, source) pairs
+
+    Returns:
+        dict: (ISO date, source) -> fragment bytes, as passed to save_daily_rollups()
+    """
+    refs, parts = [], []
+    for rollup, source in wanted:
+        rollup_ref = _rollups_ref(company_id, tenant_id).document(rollup["date"])
+        chunks = rollup["sources"][source].get("fragmentChunks", 0)
+        refs.extend(_fragment_chunk_refs(rollup_ref, rollup["fragmentVersion"], source, chunks))
+        parts.append(((rollup["date"], source), chunks))
+
+    chunks_by_path = {}
+    for snapshot in firestore_client.get_all(refs) if refs else []:
+        if not snapshot.exists:
+            raise ValueError(f"Rollup fragment {snapshot.reference.path} is missing")
+        chunks_by_path[snapshot.reference.path] = snapshot.to_dict()["data"]
+
+    fragments = {}
+    position = 0
+    for key, chunks in parts:
+        fragments[key] = zlib.decompress(b"".join(chunks_by_path[ref.path] for ref in refs[position:position + chunks]))
+        position += chunks
+    return fragments
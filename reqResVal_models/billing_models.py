@@ -47,4 +47,9 @@ class InvoiceModel(BaseModel):
     billingRates: Dict[str, Any]  # full billing map
     billingPeriod: Dict[str, str]  # startDate, endDate
     authorizedSignatory: AuthorizedSignatory  # NEW: Signatory details
-    payment_status: str
\ No newline at end of file
+    payment_status: str
+    nextReminderDate: Optional[str] = None  # YYYY-MM-DD of the next payment reminder (reminder index)
+    nextReminderType: Optional[str] = None  # "first" or "final"
+    paymentIntents: Optional[Dict[str, Any]] = None  # provider -> open Razorpay order / Stripe session (reused on retries)
+    tzone: Optional[str] = None  # Timezone the invoice dates are rendered in
+    vendorInfo: Optional[Dict[str, Any]] = None  # Issuing vendor (id, legalName, billingEmail, billingAddress)
\ No newline at end of file
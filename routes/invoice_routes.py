@@ -1,11 +1,11 @@
 from fastapi import APIRouter, HTTPException, Query
 from utils.invoice_token import verify_invoice_token
-from repositories.invoice_repo import get_invoice_by_id
+from repositories.invoice_repo import get_invoice_by_id_async
 
 router = APIRouter()
 
 @router.get("/invoices/token")
-def get_invoice_by_token(token: str = Query(...)):
+async def get_invoice_by_token(token: str = Query(...)):
     try:
         payload = verify_invoice_token(token)
     except Exception as e:
@@ -16,7 +16,7 @@ def get_invoice_by_token(token: str = Query(...)):
     invoice_id = payload["invoice_id"]
 
     
-    invoice_data = get_invoice_by_id(company_id, tenant_id, invoice_id)
+    invoice_data = await get_invoice_by_id_async(company_id, tenant_id, invoice_id)
     
     if not invoice_data:
         raise HTTPException(status_code=404, detail="Invoice not found")
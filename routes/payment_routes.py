@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends, Query, Body
 from auth.firebase_auth import verify_firebase_token
-from repositories.invoice_repo import get_invoice_by_id
+from fastapi.concurrency import run_in_threadpool
+from repositories.invoice_repo import get_invoice_by_id_async, get_invoice_with_update_time_async
 from services.payment_service import create_stripe_checkout_session, create_razorpay_order, verify_razorpay_payment
+from services.receipt_job_service import get_receipt_status
 from utils.invoice_token import verify_invoice_token, generate_invoice_token
 from pydantic import BaseModel
 
@@ -14,23 +16,32 @@ class PaymentVerificationRequest(BaseModel):
     razorpay_signature: str
 
 @router.post("/create-session/stripe")
-def create_stripe_session( token: str = Query(...) ):
+async def create_stripe_session( token: str = Query(...) ):
     try:
         payload = verify_invoice_token(token)
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
     company_id = payload["company_id"]
-    tenant_id = payload["tenant_id"]
+    tenant_id = payload.get("tenant_id")
     invoice_id = payload["invoice_id"]
-    invoice = get_invoice_by_id(company_id, tenant_id, invoice_id)
+
+    if tenant_id == "default":
+        tenant_id = None
+
+    invoice = await get_invoice_by_id_async(company_id, tenant_id, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
 
-    return create_stripe_checkout_session(invoice)
+    # The session metadata carries these back in the checkout.session.completed webhook
+    invoice["invoice_number"] = invoice_id
+    invoice["tenant_id"] = tenant_id
+
+    # Provider SDK calls are blocking; keep them off the event loop
+    return await run_in_threadpool(create_stripe_checkout_session, invoice)
 
 @router.post("/create-order/razorpay")
-def create_razorpay_order_route( token: str = Query(...) ):
+async def create_razorpay_order_route( token: str = Query(...) ):
     print("=" * 50)
     print("🔵 CREATE RAZORPAY ORDER REQUEST")
     
@@ -50,7 +61,7 @@ def create_razorpay_order_route( token: str = Query(...) ):
     
     print(f"Fetching invoice: company_id={company_id}, tenant_id={tenant_id}, invoice_id={invoice_id}")
     
-    invoice = get_invoice_by_id(company_id, tenant_id, invoice_id)
+    invoice = await get_invoice_by_id_async(company_id, tenant_id, invoice_id)
     
     if not invoice:
         print(f"❌ Invoice NOT FOUND in Firestore")
@@ -58,15 +69,16 @@ def create_razorpay_order_route( token: str = Query(...) ):
     
     print(f"✅ Invoice found")
     
-    # Add the invoice_id to the invoice data
+    # Add the invoice_id and tenant to the invoice data (sent back in the payment.captured webhook)
     invoice["invoice_number"] = invoice_id
+    invoice["tenant_id"] = tenant_id
     
     print("=" * 50)
     
-    return create_razorpay_order(invoice)
+    return await run_in_threadpool(create_razorpay_order, invoice)
 
 @router.post("/generate-token")
-def generate_payment_token(
+async def generate_payment_token(
     company_id: str = Query(...),
     tenant_id: str = Query(None),
     invoice_id: str = Query(...),
@@ -99,13 +111,15 @@ def generate_payment_token(
 
 # ================== NEW ENDPOINT: VERIFY PAYMENT ==================
 @router.post("/verify-payment")
-def verify_payment_endpoint(
+async def verify_payment_endpoint(
     payment_data: PaymentVerificationRequest = Body(...),
     token: str = Query(...)
 ):
     """
-    Verifies Razorpay payment signature and processes the payment.
+    Verifies Razorpay payment signature and records the payment.
     This is the main endpoint called by the frontend after successful payment.
+    The receipt is generated and emailed in the background; poll
+    /receipt-status/{receipt_job_id} for its progress.
     """
     print("=" * 50)
     print("🔵 PAYMENT VERIFICATION REQUEST")
@@ -133,7 +147,7 @@ def verify_payment_endpoint(
     
     try:
         # 2️⃣ Fetch invoice from Firestore
-        invoice = get_invoice_by_id(company_id, tenant_id, invoice_id)
+        invoice, invoice_update_time = await get_invoice_with_update_time_async(company_id, tenant_id, invoice_id)
         
         if not invoice:
             print(f"❌ Invoice {invoice_id} not found")
@@ -141,7 +155,8 @@ def verify_payment_endpoint(
         
         print(f"✅ Invoice found")
         
-        # 3️⃣ Check if already paid
+        # 3️⃣ Check if already paid (the cached invoice may be stale; recording the
+        # payment only succeeds if the stored invoice is unchanged since it was read)
         if invoice.get("payment_status") in ["paid", "due_paid"]:
             print(f"⚠️ Invoice {invoice_id} already marked as paid")
             return {
@@ -151,11 +166,13 @@ def verify_payment_endpoint(
             }
         
         # 4️⃣ Verify Razorpay signature and process payment
-        result = verify_razorpay_payment(
+        result = await run_in_threadpool(
+            verify_razorpay_payment,
             razorpay_payment_id=payment_data.razorpay_payment_id,
             razorpay_order_id=payment_data.razorpay_order_id,
             razorpay_signature=payment_data.razorpay_signature,
             invoice_data=invoice,
+            invoice_update_time=invoice_update_time,
             company_id=company_id,
             tenant_id=tenant_id,
             invoice_id=invoice_id
@@ -172,4 +189,28 @@ def verify_payment_endpoint(
         print(f"❌ Payment verification failed: {e}")
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Payment verification failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Payment verification failed: {str(e)}")
+
+
+@router.get("/receipt-status/{job_id}")
+async def receipt_status_endpoint(job_id: int, token: str = Query(...)):
+    """
+    Status of the receipt job returned by /verify-payment: "queued", "processing",
+    "completed" (receipt emailed) or "failed".
+    """
+    try:
+        payload = verify_invoice_token(token)
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
+
+    tenant_id = payload.get("tenant_id")
+    if tenant_id == "default":
+        tenant_id = None
+
+    status = await run_in_threadpool(get_receipt_status, job_id)
+    # Only the invoice the token was issued for
+    if status is None or (status["company_id"], status["tenant_id"], status["invoice_id"]) != (
+        payload["company_id"], tenant_id, payload["invoice_id"]
+    ):
+        raise HTTPException(status_code=404, detail="Receipt job not found")
+    return status
@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Request, HTTPException
-import os, hmac, hashlib, stripe
+import os, hmac, hashlib, json, stripe
 from dotenv import load_dotenv
-from datetime import datetime
-from services.payment_service import generate_payment_receipt
-from repositories.invoice_repo import get_invoice_by_id
+from services.webhook_inbox_service import accept_webhook_event, HANDLED_EVENTS
+from fastapi.concurrency import run_in_threadpool
 
 load_dotenv()
 router = APIRouter()
 
+# Webhooks are only verified and stored here; the webhook inbox dispatcher processes
+# them in the background, so the provider gets its 200 without waiting on Firestore,
+# PDF rendering or email.
+
 # -------------------- STRIPE --------------------
 @router.post("/stripe")
 async def stripe_webhook(request: Request):
@@ -16,19 +19,22 @@ async def stripe_webhook(request: Request):
     webhook_secret = os.getenv("STRIPE_WEBHOOK_SECRET")
 
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
+        # The tolerance rejects replays of old signed events
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"), sig_header, webhook_secret, tolerance=stripe.Webhook.DEFAULT_TOLERANCE
+        )
+        event = json.loads(payload)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid Stripe payload: {e}")
 
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        invoice_id = session["metadata"].get("invoice_id")
-        print(f"✅ Stripe payment successful for invoice {invoice_id}")
+    if ("stripe", event.get("type")) not in HANDLED_EVENTS:
+        return {"status": "ignored", "event": event.get("type")}
 
-        # 🔹 Call your unified service
-        generate_payment_receipt(invoice_id, payment_data=session)
+    session = event["data"]["object"]
+    print(f"✅ Stripe {event['type']} for invoice {(session.get('metadata') or {}).get('invoice_id')}")
 
-    return {"status": "success"}
+    # Stripe event IDs are stable across redeliveries
+    return await run_in_threadpool(accept_webhook_event, "stripe", event["id"], event["type"], event)
 
 
 # -------------------- RAZORPAY --------------------
@@ -51,67 +57,14 @@ async def razorpay_webhook(request: Request):
         print("❌ Webhook signature mismatch")
         raise HTTPException(status_code=400, detail="Signature mismatch")
 
-    event = await request.json()
-    
-    if event.get("event") == "payment.captured":
-        print("✅ Payment captured event detected!")
-        
-        payment_data = event["payload"]["payment"]["entity"]
-        
-        # Extract invoice details from notes
-        invoice_id = payment_data["notes"].get("invoice_id")
-        company_id = payment_data["notes"].get("company_id")
-        tenant_id = payment_data["notes"].get("tenant_id")
-        
-        # Handle "default" tenant
-        if tenant_id == "default":
-            tenant_id = None
-        
-        print(f"📋 Invoice ID from webhook: {invoice_id}")
-        print(f"   Company: {company_id}")
-        print(f"   Tenant: {tenant_id}")
-        
-        # Fetch full invoice data
-        invoice = get_invoice_by_id(company_id, tenant_id, invoice_id)
-        
-        if not invoice:
-            print(f"❌ Invoice {invoice_id} not found")
-            raise HTTPException(status_code=404, detail="Invoice not found")
-        
-        print(f"✅ Invoice found")
-        
-        # Check if already paid (to avoid duplicate processing)
-        if invoice.get("payment_status") in ["paid", "due_paid"]:
-            print(f"⚠️ Invoice {invoice_id} already marked as paid - skipping webhook processing")
-            return {"status": "already_processed", "message": "Invoice already paid"}
-        
-        # Prepare payment data for receipt generation
-        payment_info = {
-            **invoice,  # Spread invoice data
-            "invoice_number": invoice_id,
-            "companyId": company_id,
-            "tenant_id": tenant_id,
-            "payment_id": payment_data["id"],
-            "order_id": payment_data.get("order_id"),
-            "payment_date": datetime.utcnow().isoformat(),
-            "payment_mode": "Razorpay",
-        }
-        
-        print(f"📧 Processing payment via webhook...")
-        
-        # Generate receipt and update database
-        result = generate_payment_receipt(payment_info)
-        
-        if result.get("status") == "success":
-            print(f"✅ Webhook payment processing completed successfully")
-        else:
-            print(f"⚠️ Webhook processing encountered issues: {result.get('message')}")
-        
-        print("=" * 50)
-        return {"status": "success", "result": result}
-    
-    else:
+    event = json.loads(payload)
+
+    if ("razorpay", event.get("event")) not in HANDLED_EVENTS:
         print(f"ℹ️ Unhandled webhook event: {event.get('event')}")
         return {"status": "ignored", "event": event.get("event")}
 
-    return {"status": "success"}
\ No newline at end of file
+    print("✅ Payment captured event detected!")
+
+    # Keyed by payment ID: a payment is recorded once however often it is delivered
+    payment_id = event["payload"]["payment"]["entity"]["id"]
+    return await run_in_threadpool(accept_webhook_event, "razorpay", payment_id, event["event"], event)
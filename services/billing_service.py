@@ -1,9 +1,10 @@
 from datetime import datetime, timedelta, timezone
-from repositories.callLogs_repo import get_calls_from_top_level, get_calls_from_company_doc
 from repositories.companies_repo import get_company_billing_details
-from repositories.bill_repo import save_invoice, get_invoice
-import math
-from services.csv_service import generate_call_log_csv
+from repositories.bill_repo import save_invoice, get_invoice, get_invoices_for_periods
+from services.csv_service import CallLogCsvBuilder, SPOOL_MAX_BYTES, build_call_log_csv
+from services.usage_rollup_service import plan_call_log_segments, plan_tenant_call_logs
+from repositories.usage_rollup_repo import get_rollups_for_period
+from services.billing_prefetch import prefetch, gather, prefetch_stream
 
 # Use the current time for reference
 NOW = datetime.now(timezone.utc)
@@ -137,34 +138,6 @@ def _serialize_dates(obj):
         return obj
 
 
-def _fetch_billing_and_vendor_details(company: str, tenant: str, isSubEntity: bool):
-    """
-    Fetch billing details and vendor details based on entity type.
-    
-    Args:
-        company: Parent company ID
-        tenant: Tenant/client ID
-        isSubEntity: Whether this is a sub-entity relationship
-    
-    Returns:
-        tuple: (billing_details, vendor_details)
-    
-    Raises:
-        ValueError: If billing details cannot be found
-    """
-    if isSubEntity:
-        billing_details = get_company_billing_details(company_id=company, tenant_id=tenant)
-    else:
-        billing_details = get_company_billing_details(company_id=tenant, tenant_id=None)
-    
-    vendor_details = get_company_billing_details(company_id=company, tenant_id=None)
-    
-    if not billing_details or not vendor_details:
-        raise ValueError(f"No billing details found for company {company} and for tenant {tenant}")
-    
-    return billing_details, vendor_details
-
-
 def _build_vendor_info(vendor_details: dict) -> dict:
     """
     Build vendor info dictionary from vendor details.
@@ -203,16 +176,24 @@ def _enrich_invoice_with_metadata(invoice_data: dict, invoice_id: str, tzone: st
         dict: Invoice data enriched with metadata
     """
     invoice_data["invoice_number"] = invoice_id
-    invoice_data["tzone"] = tzone
-    invoice_data["vendorInfo"] = vendor_info
+    # Saved invoices keep the timezone and vendor they were issued with, so every later
+    # render (re-send, reminder) gets the same data and the same PDF
+    invoice_data["tzone"] = invoice_data.get("tzone") or tzone
+    invoice_data["vendorInfo"] = invoice_data.get("vendorInfo") or vendor_info
     return invoice_data
 
 
 
-def generate_monthly_bill( company: str, tenant: str, isSubEntity: bool, month: int | None = None, year: int | None = None ):
+def _resolve_billing_period(month: int | None, year: int | None) -> tuple[datetime, datetime]:
     """
-    Generate structured monthly bill for a company. 
+    Resolve the billing period for a month/year.
     Handles fallbacks to the last completed month and checks for future dates.
+
+    Returns:
+        tuple: (start_date, end_date) as timezone-aware UTC datetimes
+
+    Raises:
+        ValueError: If the requested period is the current month or in the future
     """
 
     # --- 1. Determine Target Month (with Fallback) ---
@@ -246,61 +227,49 @@ def generate_monthly_bill( company: str, tenant: str, isSubEntity: bool, month:
     
     end_date = datetime(next_year, next_month, 1, tzinfo=timezone.utc) - timedelta(seconds=1)
 
-    start_date_str = start_date.isoformat()
-    end_date_str = end_date.isoformat()
+    return start_date, end_date
 
-    # --- 4. Fetch billing and vendor details (used by both existing and new invoices) ---
-    billing_details, vendor_details = _fetch_billing_and_vendor_details(company, tenant, isSubEntity)
-    
+
+def _build_and_save_invoice(
+    company: str,
+    tenant: str,
+    isSubEntity: bool,
+    billing_details: dict,
+    vendor_info: dict,
+    usage: dict,
+    start_date: datetime,
+    end_date: datetime,
+) -> dict:
+    """
+    Compute charges from the usage totals of the call log CSV, persist the invoice and
+    return it enriched with metadata.
+
+    Args:
+        company: Parent company ID
+        tenant: Tenant/client ID
+        isSubEntity: Whether this is a sub-entity relationship
+        billing_details: Billing details of the billed entity
+        vendor_info: Vendor info built by _build_vendor_info()
+        usage: The billed entity's call log CSV with its usage totals (see csv_service.build_call_log_csv)
+        start_date: Start of the billing period
+        end_date: End of the billing period
+
+    Returns:
+        dict: Saved invoice data with metadata, plus the call log CSV artifact under "csvAttachment"
+    """
     tzone = billing_details.get("tzone")
-    vendor_info = _build_vendor_info(vendor_details)
 
-    # --- 5. Check if invoice already exists ---
-    if isSubEntity:
-        existing_invoice = get_invoice(company=company, tenant=tenant, start_date=start_date_str, end_date=end_date_str)
-    else:
-        existing_invoice = get_invoice(company=tenant, tenant=None, start_date=start_date_str, end_date=end_date_str)
-    
-    if existing_invoice:
-        print("Returning existing invoice:", existing_invoice["id"])
-        return _enrich_invoice_with_metadata(existing_invoice, existing_invoice["id"], tzone, vendor_info)
-    
-    # --- 6. Generate new invoice ---
-    
-    # Extract billing configuration (billing_details and vendor_details already fetched above)
+    # Extract billing configuration
     billing = billing_details.get("billing", {})
     billingInfo = billing_details.get("billingInfo", {})
-    # vendor_billingInfo = vendor_details.get("billingInfo", {})
 
     # Shorthand usage
     ratePerMin = billing_details.get("ratePerMinute") or 0
     gstRate = billing_details.get("gstRate") or 0
     maintenanceFee = billing_details.get("maintenanceFee") or 0
 
-    # Fetch calls from both sources
-    if isSubEntity:
-        calls_top = get_calls_from_top_level(company, start_date, end_date)
-        calls_nested = get_calls_from_company_doc(company, start_date, end_date)
-        calls_top = [c for c in calls_top if c.get("tenantId") == tenant]
-        calls_nested = [c for c in calls_nested if c.get("tenantId") == tenant]
-    else: 
-        calls_top = get_calls_from_top_level(company_id=tenant, start_date=start_date, end_date=end_date)
-        calls_nested = get_calls_from_company_doc(company_id=tenant, start_date=start_date, end_date=end_date)
-
-
-    if billing.get("billingPolicy") == "per-call":
-        total_duration_mins_top = sum(math.ceil(c.get("duration", 0) / 60) for c in calls_top)
-        total_duration_mins_nested = sum(math.ceil(c.get("duration", 0) / 60) for c in calls_nested)
-    else:
-        pass
-
-
-    total_calls_top = len(calls_top)
-    total_calls_nested = len(calls_nested)
-
-    total_minutes = total_duration_mins_top + total_duration_mins_nested
-
-    generate_call_log_csv(tenant, calls_top, calls_nested, start_date, end_date, total_minutes, total_calls_top + total_calls_nested, tzone)
+    total_minutes = usage["total_minutes"]
+    total_calls = usage["total_calls"]
     
     # --- Billing calculation ---
     rawAmt = total_minutes * ratePerMin
@@ -352,7 +321,7 @@ def generate_monthly_bill( company: str, tenant: str, isSubEntity: bool, month:
         "usageData": {
             "billingPolicy": billing.get("billingPolicy"),
             "totalBilledMinutes": total_minutes,
-            "totalCalls": total_calls_top + total_calls_nested,
+            "totalCalls": total_calls,
         },
         "lineItems": line_items,
         "subtotal": round(subtotal, 2),
@@ -373,7 +342,9 @@ def generate_monthly_bill( company: str, tenant: str, isSubEntity: bool, month:
             "designation": "Finance Department",
             "company": vendor_info.get("legalName")
         },
-        "payment_status": "pending"
+        "payment_status": "pending",
+        "tzone": tzone,
+        "vendorInfo": vendor_info,
     }
 
     invoice_data = _serialize_dates(invoice_data)  
@@ -385,5 +356,188 @@ def generate_monthly_bill( company: str, tenant: str, isSubEntity: bool, month:
 
     print("the saved invoice details are: ",saved_invoice.get("id"))
     
-    # Add metadata fields using the same helper function
-    return _enrich_invoice_with_metadata(invoice_data, saved_invoice.get("id"), tzone, vendor_info)
\ No newline at end of file
+    # Continue from the saved (validated) document, exactly as a later read of the invoice
+    # would, so the original send and later renders share one PDF cache entry
+    invoice = _enrich_invoice_with_metadata(saved_invoice, saved_invoice.get("id"), tzone, vendor_info)
+
+    # In-memory call log CSV for the invoice email; pop it before returning the invoice from an API
+    invoice["csvAttachment"] = usage["attachment"]
+    return invoice
+
+
+def generate_monthly_bill( company: str, tenant: str, isSubEntity: bool, month: int | None = None, year: int | None = None ):
+    """
+    Generate structured monthly bill for a company. 
+    Handles fallbacks to the last completed month and checks for future dates.
+    """
+
+    # --- 1-3. Resolve the billing period ---
+    start_date, end_date = _resolve_billing_period(month, year)
+
+    start_date_str = start_date.isoformat()
+    end_date_str = end_date.isoformat()
+
+    # Billed entity: the tenant under the company, or the client company itself
+    billed_company, billed_tenant = (company, tenant) if isSubEntity else (tenant, None)
+
+    # --- 4. Prefetch billing/vendor details, the existing invoice and daily rollups concurrently ---
+    inputs = gather(prefetch({
+        "billing_details": (get_company_billing_details, billed_company, billed_tenant),
+        "vendor_details": (get_company_billing_details, company, None),
+        "existing_invoice": (get_invoice, billed_company, billed_tenant, start_date_str, end_date_str),
+        "rollups": (get_rollups_for_period, billed_company, billed_tenant, start_date.date(), end_date.date()),
+    }))
+    billing_details, vendor_details = inputs["billing_details"], inputs["vendor_details"]
+    if not billing_details or not vendor_details:
+        raise ValueError(f"No billing details found for company {company} and for tenant {tenant}")
+    
+    tzone = billing_details.get("tzone")
+    vendor_info = _build_vendor_info(vendor_details)
+
+    # --- 5. Check if invoice already exists ---
+    existing_invoice = inputs["existing_invoice"]
+    
+    if existing_invoice:
+        print("Returning existing invoice:", existing_invoice["id"])
+        return _enrich_invoice_with_metadata(existing_invoice, existing_invoice["id"], tzone, vendor_info)
+    
+    # --- 6. Generate new invoice ---
+
+    # Use daily rollups where available; stream raw calls (lazily, with a bounded read-ahead)
+    # only for the days that have none
+    segments, missing_days = plan_call_log_segments(
+        billed_company, billed_tenant, start_date, end_date, tzone, rollups=inputs["rollups"]
+    )
+    print(f"📦 Billing {tenant} from rollups with {missing_days} day(s) falling back to raw calls")
+
+    # Both call sources download at the same time instead of one after the other
+    streams = []
+    for segment in segments:
+        if "calls" in segment:
+            segment["calls"] = prefetch_stream("raw_calls", segment["calls"])
+            streams.append(segment["calls"])
+
+    try:
+        # Single pass over the calls/rollups: running totals (per-call rounding) + CSV rows
+        usage = build_call_log_csv(tenant, segments, start_date, end_date, tzone)
+        return _build_and_save_invoice(
+            company, tenant, isSubEntity, billing_details, vendor_info,
+            usage, start_date, end_date
+        )
+    finally:
+        # Streams that weren't read to the end (the build failed first) stop downloading
+        for stream in streams:
+            stream.close()
+
+
+def generate_monthly_bills_for_tenants(
+    company: str,
+    tenants: list[str],
+    month: int | None = None,
+    year: int | None = None,
+    errors: dict | None = None,
+):
+    """
+    Generate monthly bills for every tenant (sub-entity) of a company from their
+    daily rollups and a single scan of the company's calls.
+
+    The rollups of all tenants are read in one batched point read. The company's
+    calls are then scanned once from each source, over only the days some tenant
+    has no usable rollup for, and partitioned by `tenantId` a day at a time while
+    streaming into each tenant's CSV. Firestore reads grow with the number of
+    uncovered calls instead of tenants × calls, and no scan is held in memory.
+    Tenants that already have an invoice for the period are never planned.
+
+    Args:
+        company: Parent company ID
+        tenants: Tenant IDs under the company
+        month: Month (1-12). Defaults to last completed month
+        year: Year. Defaults to the year of the last completed month
+        errors: Optional dict that receives tenant_id -> error message for skipped tenants
+
+    Returns:
+        dict: tenant_id -> invoice data (tenants without billing details are skipped)
+    """
+    start_date, end_date = _resolve_billing_period(month, year)
+
+    if not tenants:
+        return {}
+
+    start_date_str = start_date.isoformat()
+    end_date_str = end_date.isoformat()
+
+    vendor_details = get_company_billing_details(company_id=company, tenant_id=None)
+    if not vendor_details:
+        raise ValueError(f"No billing details found for company {company}")
+    vendor_info = _build_vendor_info(vendor_details)
+
+    invoices = {}
+    pending_tenants = {}
+
+    # Existing invoices of all tenants in one batched point read
+    existing_invoices = get_invoices_for_periods([(company, tenant, start_date_str, end_date_str) for tenant in tenants])
+
+    for tenant in tenants:
+        billing_details = get_company_billing_details(company_id=company, tenant_id=tenant)
+        if not billing_details:
+            print(f"⚠️ No billing details found for tenant {company}/{tenant}, skipping")
+            if errors is not None:
+                errors[tenant] = f"No billing details found for tenant {company}/{tenant}"
+            continue
+
+        existing_invoice = existing_invoices[(company, tenant, start_date_str, end_date_str)]
+        if existing_invoice:
+            print("Returning existing invoice:", existing_invoice["id"])
+            invoices[tenant] = _enrich_invoice_with_metadata(
+                existing_invoice, existing_invoice["id"], billing_details.get("tzone"), vendor_info
+            )
+        else:
+            pending_tenants[tenant] = billing_details
+
+    if not pending_tenants:
+        return invoices
+
+    # Every tenant's CSV is built at once from their rollups plus one company-wide scan of
+    # the days some tenant lacks a rollup for, split by tenant a day at a time
+    segments, missing_days = plan_tenant_call_logs(
+        company, {tenant: details.get("tzone") for tenant, details in pending_tenants.items()}, start_date, end_date,
+        open_stream=lambda calls: prefetch_stream("raw_calls", calls),
+    )
+    raw_days = max(missing_days.values())
+    print(f"📦 Billing {len(pending_tenants)} tenants of {company} from rollups with {raw_days} day(s) falling back to raw calls")
+
+    # Concurrent builders share the in-memory spool budget of a single CSV
+    spool_max_bytes = max(SPOOL_MAX_BYTES // len(pending_tenants), 256 * 1024)
+    builders = {
+        tenant: CallLogCsvBuilder(tenant, start_date, end_date, details.get("tzone"), spool_max_bytes=spool_max_bytes)
+        for tenant, details in pending_tenants.items()
+    }
+    failed = {}
+    try:
+        for tenant, segment in segments:
+            if tenant in failed:
+                continue
+            try:
+                builders[tenant].add_segment(segment)
+            except Exception as e:
+                failed[tenant] = e
+
+        for tenant, billing_details in pending_tenants.items():
+            try:
+                if tenant in failed:
+                    raise failed[tenant]
+                invoices[tenant] = _build_and_save_invoice(
+                    company, tenant, True, billing_details, vendor_info,
+                    builders[tenant].finish(), start_date, end_date
+                )
+            except Exception as e:
+                print(f"❌ Failed to bill tenant {company}/{tenant}: {e}")
+                if errors is not None:
+                    errors[tenant] = str(e)
+    finally:
+        # Stops the raw scans if the walk was cut short
+        segments.close()
+        for builder in builders.values():
+            builder.close()
+
+    return invoices
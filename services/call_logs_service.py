@@ -1,9 +1,18 @@
+import asyncio
 from datetime import datetime
 from repositories.callLogs_repo import (
     get_calls_from_top_level,
-    get_calls_from_company_doc
+    get_calls_from_company_doc,
+    get_calls_from_top_level_async,
+    get_calls_from_company_doc_async,
 )
 
+def _call_logs_response(company_id: str, calls_top: list, calls_nested: list) -> dict:
+    all_calls = calls_top + calls_nested
+    all_calls.sort(key=lambda x: x.get("receivedAt"), reverse=True)
+
+    return {"company_id": company_id, "total_calls": len(all_calls), "calls": all_calls}
+
 def get_call_logs_for_company(company_id: str, start_date: str, end_date: str):
     """
     Fetch call logs for a given company between start_date and end_date.
@@ -21,10 +30,24 @@ def get_call_logs_for_company(company_id: str, start_date: str, end_date: str):
         calls_top = get_calls_from_top_level(company_id, start_dt, end_dt)
         calls_nested = get_calls_from_company_doc(company_id, start_dt, end_dt)
 
-        all_calls = calls_top + calls_nested
-        all_calls.sort(key=lambda x: x.get("receivedAt"), reverse=True)
+        return _call_logs_response(company_id, calls_top, calls_nested)
+
+    except Exception as e:
+        print(f"❌ Error fetching call logs for {company_id}: {e}")
+        return {"company_id": company_id, "error": str(e)}
+
+async def get_call_logs_for_company_async(company_id: str, start_date: str, end_date: str):
+    """Async variant of get_call_logs_for_company; both call sources are read concurrently."""
+    try:
+        start_dt = datetime.fromisoformat(start_date)
+        end_dt = datetime.fromisoformat(end_date)
+
+        calls_top, calls_nested = await asyncio.gather(
+            get_calls_from_top_level_async(company_id, start_dt, end_dt),
+            get_calls_from_company_doc_async(company_id, start_dt, end_dt),
+        )
 
-        return {"company_id": company_id, "total_calls": len(all_calls), "calls": all_calls}
+        return _call_logs_response(company_id, calls_top, calls_nested)
 
     except Exception as e:
         print(f"❌ Error fetching call logs for {company_id}: {e}")
@@ -1,51 +1,44 @@
 import csv
-from datetime import datetime
+from datetime import datetime, date
+import io
 import os
-import math
-from typing import List, Dict, Any
+import shutil
+import tempfile
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator
+import numpy as np
 from utils.date_utils import _get_date_format_for_tz
+from services.usage_aggregation import UsageAccumulator, load_durations, call_day_index
+from utils.artifacts import make_artifact, persist_artifact
 import pendulum # Import pendulum for parsing and formatting
 
-def generate_call_log_csv(
-    company_id: str, 
-    calls_top: List[Dict[str, Any]], 
-    calls_nested: List[Dict[str, Any]], 
-    start_date: datetime, 
-    end_date: datetime,
-    total_minutes: int, # New parameter: Total billed minutes
-    total_calls: int, # New parameter: Total number of calls
-    target_timezone: str # New parameter: Timezone for date formatting
-) -> str:
-    """
-    Generates a multi-section CSV file containing:
-    1. A header row.
-    2. A summary row of total calls and total billed minutes, including the Assistant Phone Number.
-    3. Detailed call logs with calculated billed minutes (rounded up), with dates formatted 
-       according to the target_timezone's regional convention (without applying timezone offset).
+# Define the field names for the detailed call log section
+DETAIL_FIELDNAMES = [
+    "id", 
+    "Customer_Phone", 
+    "Duration [in secs]", 
+    "In mins [rounded-off]", 
+    "Received_At", 
+    "Finished_At", 
+    "Created_At"
+]
 
-    Args:
-        company_id: The ID of the company.
-        calls_top: List of call log dictionaries from the top-level collection.
-        calls_nested: List of call log dictionaries from the nested collection.
-        start_date: Start date of the billing period (used for file naming).
-        end_date: End date of the billing period (used for file naming).
-        total_minutes: The total billed minutes for the period.
-        total_calls: The total number of calls for the period.
-        target_timezone: The timezone string (e.g., 'Asia/Kolkata') to determine date format.
+OUTPUT_DIR = "invoices"
 
-    Returns:
-        The file path of the generated CSV file. Returns an empty string on failure.
-    """
+# Number of calls aggregated per vectorized step while streaming
+STREAM_CHUNK_SIZE = 5000
 
+# Detail rows stay in memory up to this size before the spool rolls over to a temp file
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
 
-    print("************ Calling the GENERATE CSV Function **********")
 
-    all_calls = calls_top + calls_nested
-    
-    # Extract the Assistant Phone No. from the first call (assuming it's consistent)
-    assistant_phone = all_calls[0].get("assistant_phone", "N/A") if all_calls else "N/A"
-    assistant_phone = f"'{assistant_phone}" if assistant_phone else ""
+def _make_log_datetime_formatter(target_timezone: str):
+    """
+    Builds the date formatter used for the CSV, based on the target timezone's regional convention.
 
+    Returns:
+        tuple: (DATE_ONLY_FORMAT, format_log_datetime function)
+    """
     # --- DATE FORMATTING SETUP ---
     # Determine the date format string (e.g., '%d-%m-%Y') based on the target timezone
     # We will append time formatting to this date format.
@@ -72,91 +65,252 @@ def generate_call_log_csv(
             return dt_iso_string
     # --- END DATE FORMATTING SETUP ---
 
+    return DATE_ONLY_FORMAT, format_log_datetime
+
+
+def _build_detail_row(call: Dict[str, Any], billed_mins: int, format_log_datetime) -> Dict[str, Any]:
+    """Builds one detailed call log row for the CSV."""
+    duration_secs = call.get("duration", 0)
 
-    # Define the field names for the detailed call log section
-    detail_fieldnames = [
-        "id", 
-        "Customer_Phone", 
-        "Duration [in secs]", 
-        "In mins [rounded-off]", 
-        "Received_At", 
-        "Finished_At", 
-        "Created_At"
-    ]
+    # Prepend phone number with a single quote to prevent Excel scientific notation/truncation
+    customer_phone_str = str(call.get("customer_phone", ""))
+    safe_customer_phone = f"'{customer_phone_str}" if customer_phone_str else "" 
+
+    # Extract raw date values
+    received_at_raw = call.get("receivedAt", call.get("received_at", ""))
+    finished_at_raw = call.get("finished_at", "")
+    created_at_raw = call.get("created_at", "")
     
-    # Prepare the output directory (invoices/)
-    output_dir = "invoices"
-    os.makedirs(output_dir, exist_ok=True)
+    # Convert any remaining datetime objects to ISO strings first for consistency
+    # and then format the ISO string
+    if isinstance(received_at_raw, datetime): received_at_raw = received_at_raw.isoformat()
+    if isinstance(finished_at_raw, datetime): finished_at_raw = finished_at_raw.isoformat()
+    if isinstance(created_at_raw, datetime): created_at_raw = created_at_raw.isoformat()
+
+    # --- APPLY FORMATTING HERE ---
+    return {
+        "id": call.get("id"), 
+        "Customer_Phone": safe_customer_phone,
+        "Duration [in secs]": duration_secs,
+        "In mins [rounded-off]": billed_mins,
+        "Received_At": format_log_datetime(received_at_raw),
+        "Finished_At": format_log_datetime(finished_at_raw),
+        "Created_At": format_log_datetime(created_at_raw),
+    }
+
 
-    # Create a descriptive filename using the billing period (using YYYY-MM-DD for file name consistency)
+def _csv_filepath(company_id: str, start_date: datetime, end_date: datetime) -> str:
+    """Builds the CSV path from the billing period (using YYYY-MM-DD for file name consistency)."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     start_str = start_date.strftime("%Y-%m-%d")
     end_str = end_date.strftime("%Y-%m-%d")
     filename = f"{company_id}_call_logs_{start_str}_to_{end_str}.csv"
-    filepath = os.path.join(output_dir, filename)
+    return os.path.join(OUTPUT_DIR, filename)
 
-    print(f"Attempting to generate call log CSV at: {filepath}")
 
-    try:
-        with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            
-            # 1. Write the Heading Row
-            writer.writerow([f"Call Logs Details for {company_id} from {start_date.strftime(DATE_ONLY_FORMAT)} to {end_date.strftime(DATE_ONLY_FORMAT)}"])
-            writer.writerow([]) 
+def _write_csv_preamble(csvfile, company_id: str, start_date: datetime, end_date: datetime, DATE_ONLY_FORMAT: str,
+                        total_calls: int, total_minutes: int, assistant_phone: str):
+    """Writes the heading, the summary section and the detailed log header."""
+    writer = csv.writer(csvfile)
+    
+    # 1. Write the Heading Row
+    writer.writerow([f"Call Logs Details for {company_id} from {start_date.strftime(DATE_ONLY_FORMAT)} to {end_date.strftime(DATE_ONLY_FORMAT)}"])
+    writer.writerow([]) 
 
-            # 2. Write the Summary Header and Values
-            summary_headers = ["Total_Calls", "Total Billed Minutes", "Assistant_Phone_No"]
-            summary_values = [total_calls, total_minutes, assistant_phone]
-            
-            padding_count = len(detail_fieldnames) - len(summary_headers)
-            writer.writerow(summary_headers + [""] * padding_count)
-            writer.writerow(summary_values + [""] * padding_count)
-            writer.writerow([]) 
-            
-            # Now, use DictWriter for the detailed log section
-            detail_writer = csv.DictWriter(csvfile, fieldnames=detail_fieldnames)
-            
-            # 3. Write the detailed log header
-            detail_writer.writeheader()
-            
-            # 4. Write the detailed log rows
-            for call in all_calls:
-                duration_secs = call.get("duration", 0)
-                
-                # Calculate billed minutes: ceiling of duration / 60
-                billed_mins = math.ceil(duration_secs / 60)
-                
-                # Prepend phone number with a single quote to prevent Excel scientific notation/truncation
-                customer_phone_str = str(call.get("customer_phone", ""))
-                safe_customer_phone = f"'{customer_phone_str}" if customer_phone_str else "" 
-
-                # Extract raw date values
-                received_at_raw = call.get("receivedAt", call.get("received_at", ""))
-                finished_at_raw = call.get("finished_at", "")
-                created_at_raw = call.get("created_at", "")
-                
-                # Convert any remaining datetime objects to ISO strings first for consistency
-                # and then format the ISO string
-                if isinstance(received_at_raw, datetime): received_at_raw = received_at_raw.isoformat()
-                if isinstance(finished_at_raw, datetime): finished_at_raw = finished_at_raw.isoformat()
-                if isinstance(created_at_raw, datetime): created_at_raw = created_at_raw.isoformat()
-
-                # --- APPLY FORMATTING HERE ---
-                row = {
-                    "id": call.get("id"), 
-                    "Customer_Phone": safe_customer_phone,
-                    "Duration [in secs]": duration_secs,
-                    "In mins [rounded-off]": billed_mins,
-                    "Received_At": format_log_datetime(received_at_raw),
-                    "Finished_At": format_log_datetime(finished_at_raw),
-                    "Created_At": format_log_datetime(created_at_raw),
-                }
-
-                detail_writer.writerow(row)
-        
-        print(f"Successfully generated CSV for {company_id}: {filepath}")
-        return filepath
+    # 2. Write the Summary Header and Values
+    summary_headers = ["Total_Calls", "Total Billed Minutes", "Assistant_Phone_No"]
+    summary_values = [total_calls, total_minutes, assistant_phone]
+    
+    padding_count = len(DETAIL_FIELDNAMES) - len(summary_headers)
+    writer.writerow(summary_headers + [""] * padding_count)
+    writer.writerow(summary_values + [""] * padding_count)
+    writer.writerow([]) 
+    
+    # 3. Write the detailed log header
+    csv.DictWriter(csvfile, fieldnames=DETAIL_FIELDNAMES).writeheader()
+
+
+def _format_assistant_phone(call: Dict[str, Any] | None) -> str:
+    assistant_phone = call.get("assistant_phone", "N/A") if call else "N/A"
+    return f"'{assistant_phone}" if assistant_phone else ""
+
+
+class CallLogCsvBuilder:
+    """
+    Call log CSV of one billed entity, fed segment by segment (see build_call_log_csv).
+
+    Builders are independent, so one scan of a company's calls can feed the CSVs of all
+    of its tenants at once. Call close() when done (finish() does not), so an abandoned
+    build drops its spool.
+    """
+
+    def __init__(self, company_id: str, start_date: datetime, end_date: datetime, target_timezone: str,
+                 spool_max_bytes: int = SPOOL_MAX_BYTES):
+        self.company_id = company_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.date_only_format, self.format_log_datetime = _make_log_datetime_formatter(target_timezone)
+        self.period_start = start_date.date()
+        self.usage = UsageAccumulator(self.period_start, (end_date.date() - self.period_start).days + 1)
+        self.assistant_phone = None
+        self.spool = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes, mode='w+', newline='', encoding='utf-8')
+
+    def add_segment(self, segment: Dict[str, Any]):
+        """Appends the detail rows and totals of one segment."""
+        if "fragment" in segment:
+            rollup = segment["rollup"]
+            self.usage.add_totals(
+                (segment["day"] - self.period_start).days,
+                rollup["callCount"], rollup["totalSeconds"], rollup["billedMinutes"], rollup["durationHistogram"]
+            )
+            if self.assistant_phone is None and rollup["callCount"]:
+                self.assistant_phone = rollup["assistantPhone"]
+            self.spool.write(segment["fragment"]())
+        else:
+            first_call = _write_call_rows(self.spool, segment["calls"], self.usage, self.period_start, self.format_log_datetime)
+            if self.assistant_phone is None and first_call is not None:
+                self.assistant_phone = _format_assistant_phone(first_call)
+
+    def finish(self) -> Dict[str, Any]:
+        """Writes the heading and summary above the spooled rows; returns the CSV (see build_call_log_csv)."""
+        filepath = _csv_filepath(self.company_id, self.start_date, self.end_date)
+        totals = self.usage.result()
+
+        buffer = io.BytesIO()
+        csvfile = io.TextIOWrapper(buffer, newline='', encoding='utf-8', write_through=True)
+        _write_csv_preamble(csvfile, self.company_id, self.start_date, self.end_date, self.date_only_format,
+                            totals["total_calls"], totals["total_minutes"],
+                            self.assistant_phone if self.assistant_phone is not None else _format_assistant_phone(None))
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, csvfile)
+        csvfile.detach()
+
+        attachment = persist_artifact(
+            make_artifact(os.path.basename(filepath), buffer.getvalue(), "text/csv"), filepath
+        )
+        print(f"Successfully generated CSV for {self.company_id}: {attachment['name']} ({totals['total_calls']} calls)")
+        return {"filepath": attachment["path"], "attachment": attachment, **totals}
+
+    def close(self):
+        self.spool.close()
+
+
+def build_call_log_csv(
+    company_id: str,
+    segments: Iterable[Dict[str, Any]],
+    start_date: datetime,
+    end_date: datetime,
+    target_timezone: str
+) -> Dict[str, Any]:
+    """
+    Single-pass billing pipeline: builds the call log CSV from ordered segments, each of which is either:
+    - {"calls": iterable}: raw calls, streamed and aggregated chunk by chunk
+    - {"fragment": loader, "day": date, "rollup": dict}: detail rows already written by the
+      daily rollup job (see write_call_log_fragment), returned by loader() and copied as-is,
+      with its totals taken from the stored rollup instead of being recomputed
+
+    Raw calls are taken in chunks so that billed minutes, totals, per-day sums and the
+    duration histogram are computed with vectorized ops, and the chunk's billed-minute
+    column is reused for the rows. Detail rows are spooled (in memory, rolling over to a
+    temporary file for very large months) because the summary section at the top of the
+    CSV is only known once every segment is consumed. The finished CSV is returned as an
+    in-memory artifact ready to attach to the invoice email, and written to /invoices only
+    if the disk sink is enabled.
+
+    Args:
+        company_id: The ID of the company.
+        segments: Ordered segments making up the detailed log section.
+        start_date: Start date of the billing period (used for file naming).
+        end_date: End date of the billing period (used for file naming).
+        target_timezone: The timezone string (e.g., 'Asia/Kolkata') to determine date format.
+
+    Returns:
+        dict: {"filepath", "attachment", "total_calls", "total_minutes", "total_seconds", "daily",
+               "duration_histogram"}; filepath is None when the disk sink is disabled
+
+    Raises:
+        Exception: Any error while consuming the segments or writing the CSV, since the
+                   totals would otherwise be incomplete.
+    """
+    print(f"📝 Streaming call log CSV for {company_id}")
+
+    builder = CallLogCsvBuilder(company_id, start_date, end_date, target_timezone)
+    try:
+        for segment in segments:
+            builder.add_segment(segment)
+        return builder.finish()
 
     except Exception as e:
-        print(f"Error generating CSV for {company_id}: {e}")
-        return ""
\ No newline at end of file
+        print(f"Error streaming CSV for {company_id}: {e}")
+        raise
+    finally:
+        builder.close()
+
+
+def write_call_log_fragment(
+    calls: Iterable[Dict[str, Any]],
+    out,
+    day: date,
+    target_timezone: str
+) -> Dict[str, Any]:
+    """
+    Writes the detailed CSV rows (no heading or summary) for one day of calls, so that
+    month-end billing can splice them into the final CSV without re-reading the calls.
+
+    Args:
+        calls: The day's calls, in the same order the billing stream would yield them.
+        out: Text stream the rows are written to.
+        day: The day the calls belong to.
+        target_timezone: The timezone string used to format dates in the rows.
+
+    Returns:
+        dict: The fragment's rollup totals ("callCount", "totalSeconds", "billedMinutes",
+              "durationHistogram", "assistantPhone", "dateFormat")
+    """
+    DATE_ONLY_FORMAT, format_log_datetime = _make_log_datetime_formatter(target_timezone)
+    usage = UsageAccumulator(day, 1)
+
+    first_call = _write_call_rows(out, calls, usage, day, format_log_datetime)
+
+    totals = usage.result()
+    return {
+        "callCount": totals["total_calls"],
+        "totalSeconds": totals["total_seconds"],
+        "billedMinutes": totals["total_minutes"],
+        "durationHistogram": usage.histogram.tolist(),
+        "assistantPhone": _format_assistant_phone(first_call) if first_call is not None else None,
+        "dateFormat": DATE_ONLY_FORMAT,
+    }
+
+
+def _write_call_rows(out, calls: Iterable[Dict[str, Any]], usage: UsageAccumulator, period_start: date,
+                     format_log_datetime) -> Dict[str, Any] | None:
+    """
+    Streams calls chunk by chunk into `usage` and writes their detail rows to `out`.
+
+    Returns:
+        dict | None: The first call seen (used for the assistant phone), or None if there were no calls
+    """
+    detail_writer = csv.DictWriter(out, fieldnames=DETAIL_FIELDNAMES)
+    first_call = None
+
+    for chunk in _chunked(calls, STREAM_CHUNK_SIZE):
+        if first_call is None:
+            first_call = chunk[0]
+
+        day_index = np.fromiter((call_day_index(c, period_start) for c in chunk), dtype=np.int64, count=len(chunk))
+        billed_column = usage.add(load_durations(chunk), day_index).tolist()
+
+        detail_writer.writerows(
+            _build_detail_row(call, billed_mins, format_log_datetime)
+            for call, billed_mins in zip(chunk, billed_column)
+        )
+
+    return first_call
+
+
+def _chunked(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Yields lists of up to `size` items from an iterable without materializing it."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,260 @@
+# services/invoice_batch_service.py
+"""
+Concurrent batch engine for the monthly invoice run.
+
+Each company is billed on a bounded I/O thread pool (its own invoice plus all of
+its tenants from a single call scan). Every resulting invoice then goes through
+its own pipeline: PDF rendering on a separate, CPU-sized render pool (whose
+threads hand the layout work to the warm process pool in pdf_render_pool),
+followed by the email. By default emails are built on the I/O pool and sent in
+Postmark batches of up to 500 messages / 45 MB (one HTTP request per batch); per-message results
+are mapped back to their invoices. Billing, delivery and email batches are driven
+from one completion loop, so the first companies' emails go out while later
+companies are still being billed. Failures are isolated per invoice and reported
+with the stage they happened in.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from repositories.companies_repo import get_tenants, get_billing_details_cache_stats
+from services.billing_service import generate_monthly_bill, generate_monthly_bills_for_tenants
+from services.invoice_service import render_invoice_pdf, build_invoice_email
+from services.mailer_service import (
+    send_email, build_email, send_email_batch, message_size, POSTMARK_BATCH_SIZE, POSTMARK_BATCH_MAX_BYTES,
+)
+from services.template_registry import get_render_stats
+from services.billing_prefetch import get_prefetch_stats
+
+PARENT_COMPANY = "vysedeck"
+
+DEFAULT_IO_WORKERS = int(os.getenv("BATCH_IO_WORKERS", "8"))
+DEFAULT_RENDER_WORKERS = int(os.getenv("BATCH_RENDER_WORKERS", str(os.cpu_count() or 2)))
+# Collect rendered emails and send them through Postmark's batch endpoint
+DEFAULT_BATCH_EMAILS = os.getenv("BATCH_EMAILS", "1") == "1"
+
+
+def _result(company: str, tenant: str, isSubEntity: bool) -> dict:
+    return {
+        "company": company,
+        "tenant": tenant,
+        "isSubEntity": isSubEntity,
+        "invoice_number": None,
+        "status": "pending",
+        "stage": None,
+        "error": None,
+        "pdf": None,
+        "timings": {},
+    }
+
+
+def _bill_company(company: str, month: int, year: int) -> list[tuple[dict, dict | None]]:
+    """
+    Billing stage for one company: its own invoice (billed by the parent company)
+    and the invoices of all of its tenants.
+
+    Returns:
+        list: (result, invoice) pairs; invoice is None when billing failed
+    """
+    billed = []
+
+    result = _result(PARENT_COMPANY, company, False)
+    start = time.perf_counter()
+    try:
+        invoice = generate_monthly_bill(company=PARENT_COMPANY, tenant=company, isSubEntity=False, month=month, year=year)
+        billed.append((result, invoice))
+    except Exception as e:
+        result.update(status="failed", stage="billing", error=str(e))
+        billed.append((result, None))
+    result["timings"]["billing"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    try:
+        tenants = get_tenants(company)
+        print(f"🏢 Tenants under {company}: {tenants}")
+        errors = {}
+        tenant_invoices = generate_monthly_bills_for_tenants(company=company, tenants=tenants, month=month, year=year, errors=errors)
+        elapsed = round(time.perf_counter() - start, 3)
+
+        for tenant in tenants:
+            result = _result(company, tenant, True)
+            result["timings"]["billing"] = elapsed
+            if tenant in tenant_invoices:
+                billed.append((result, tenant_invoices[tenant]))
+            else:
+                result.update(status="failed", stage="billing", error=errors.get(tenant, "No invoice generated"))
+                billed.append((result, None))
+    except Exception as e:
+        result = _result(company, None, True)
+        result.update(status="failed", stage="billing", error=f"Tenant billing failed: {e}")
+        billed.append((result, None))
+
+    return billed
+
+
+def _deliver_invoice(result: dict, invoice: dict, render_pool: ThreadPoolExecutor, batch_emails: bool = False) -> tuple[dict, dict | None]:
+    """
+    Render (on the render pool) and email one invoice, recording the failing stage.
+    In batch mode the email is only built; the caller sends it with send_email_batch().
+
+    Returns:
+        tuple: (result, Postmark message waiting to be batched, or None)
+    """
+    result["invoice_number"] = invoice.get("invoice_number")
+    billing_period = invoice.get("billingPeriod", {})
+    # Keeps the CSV bytes out of the report (and out of the render job's payload)
+    csv_attachment = invoice.pop("csvAttachment", None)
+
+    stage = "render"
+    try:
+        start = time.perf_counter()
+        prepared, pdf = render_pool.submit(render_invoice_pdf, invoice).result()
+        result["timings"]["render"] = round(time.perf_counter() - start, 3)
+        result["pdf"] = pdf["path"] or pdf["name"]
+
+        stage = "email"
+        email = build_invoice_email(prepared, result["isSubEntity"], pdf, billing_period, csv_attachment)
+        if batch_emails:
+            return result, build_email(**email, metadata={"invoice_number": result["invoice_number"]})
+
+        start = time.perf_counter()
+        send_email(**email)
+        result["timings"]["email"] = round(time.perf_counter() - start, 3)
+
+        result["status"] = "sent"
+    except Exception as e:
+        print(f"❌ Invoice {result['invoice_number']} failed at {stage}: {e}")
+        result.update(status="failed", stage=stage, error=str(e))
+    return result, None
+
+
+def _flush_email_batch(batch: list[tuple[dict, dict]]) -> list[dict]:
+    """Sends a batch of built invoice emails and records each message's outcome on its result."""
+    start = time.perf_counter()
+    try:
+        outcomes = send_email_batch([message for _, message in batch])
+    except Exception as e:
+        outcomes = [{"status": "failed", "error": str(e)}] * len(batch)
+    elapsed = round(time.perf_counter() - start, 3)
+
+    # send_email_batch() returns one outcome per message, in order
+    results = []
+    for (result, _), outcome in zip(batch, outcomes):
+        result["timings"]["email"] = elapsed
+        if outcome["status"] == "sent":
+            result["status"] = "sent"
+        else:
+            print(f"❌ Invoice {result['invoice_number']} failed at email: {outcome['error']}")
+            result.update(status="failed", stage="email", error=outcome["error"])
+        results.append(result)
+    return results
+
+
+def run_invoice_batch(
+    companies: list[str],
+    month: int,
+    year: int,
+    io_workers: int = DEFAULT_IO_WORKERS,
+    render_workers: int = DEFAULT_RENDER_WORKERS,
+    batch_emails: bool = DEFAULT_BATCH_EMAILS,
+) -> dict:
+    """
+    Generates, renders and emails the invoices of all companies and their tenants concurrently.
+
+    Args:
+        companies: Company IDs to bill
+        month: Billing month (1-12)
+        year: Billing year
+        io_workers: Size of the thread pool for Firestore and Postmark work
+        render_workers: Size of the pool dedicated to PDF rendering
+        batch_emails: Send emails in Postmark batches (up to 500 messages / 45 MB) instead of one request each
+
+    Returns:
+        dict: Report with per-tenant results, counts, the invoice number and PDF of each generated
+              invoice, the total duration and the template render timings of this process
+    """
+    started = time.perf_counter()
+    print(f"🚀 Invoice batch for {month}/{year}: {len(companies)} companies, "
+          f"{io_workers} I/O workers, {render_workers} render workers, "
+          f"{'batched' if batch_emails else 'per-message'} email")
+
+    results = []
+
+    with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="invoice-io") as io_pool, \
+            ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="invoice-render") as render_pool:
+
+        billing_futures = {io_pool.submit(_bill_company, company, month, year): company for company in companies}
+        delivery_futures = set()
+        flush_futures = set()
+        waiting = set(billing_futures)
+
+        # A batch is flushed at Postmark's per-request message count or size limit,
+        # whichever comes first (invoice emails carry PDF and CSV attachments)
+        pending_emails = []
+        pending_bytes = 0
+
+        def flush():
+            nonlocal pending_emails, pending_bytes
+            future = io_pool.submit(_flush_email_batch, pending_emails)
+            flush_futures.add(future)
+            waiting.add(future)
+            pending_emails, pending_bytes = [], 0
+
+        while waiting:
+            done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in flush_futures:
+                    results.extend(future.result())
+                elif future in delivery_futures:
+                    delivery_futures.discard(future)
+                    result, message = future.result()
+                    if message is None:
+                        results.append(result)
+                        continue
+                    size = message_size(message)
+                    if pending_emails and pending_bytes + size > POSTMARK_BATCH_MAX_BYTES:
+                        flush()
+                    pending_emails.append((result, message))
+                    pending_bytes += size
+                    if len(pending_emails) == POSTMARK_BATCH_SIZE:
+                        flush()
+                else:
+                    company = billing_futures.pop(future)
+                    try:
+                        billed = future.result()
+                    except Exception as e:
+                        result = _result(PARENT_COMPANY, company, False)
+                        result.update(status="failed", stage="billing", error=str(e))
+                        results.append(result)
+                        continue
+
+                    for result, invoice in billed:
+                        if invoice is None:
+                            results.append(result)
+                            continue
+                        delivery = io_pool.submit(_deliver_invoice, result, invoice, render_pool, batch_emails)
+                        delivery_futures.add(delivery)
+                        waiting.add(delivery)
+
+            # Nothing left that could add to the partial batch
+            if pending_emails and not billing_futures and not delivery_futures:
+                flush()
+
+    sent = sum(1 for r in results if r["status"] == "sent")
+    report = {
+        "month": month,
+        "year": year,
+        "total": len(results),
+        "sent": sent,
+        "failed": len(results) - sent,
+        "duration_seconds": round(time.perf_counter() - started, 3),
+        "results": results,
+        "invoices": [
+            {"invoice_number": r["invoice_number"], "pdf": r["pdf"]} for r in results if r["invoice_number"]
+        ],
+        "template_render_stats": get_render_stats(),
+        "billing_prefetch_stats": get_prefetch_stats(),
+        "billing_details_cache_stats": get_billing_details_cache_stats(),
+    }
+    print(f"📊 Invoice batch finished in {report['duration_seconds']}s: {sent} sent, {report['failed']} failed")
+    return report
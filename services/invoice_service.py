@@ -1,9 +1,7 @@
 # services/invoice_service.py
-from repositories.companies_repo import get_tenants
-from services.billing_service import generate_monthly_bill
-from services.pdf_service import generate_pdf
-from services.mailer_service import send_email
-from datetime import datetime, timedelta
+from services.pdf_service import render_pdf
+from services.outbox_service import enqueue_email
+from datetime import datetime
 from utils.date_utils import localize_datetime_fields
 from utils.invoice_token import generate_invoice_token
 import os
@@ -21,188 +19,209 @@ def _construct_csv_filepath(company_id: str, start_date_str: str, end_date_str:
         print(f"⚠ Error constructing CSV path for {company_id}: {e}")
         return ""
 
-def send_invoice_to_client(invoice_data: dict, isSubEntity: bool):
-    """Generates PDF, attaches CSV (if exists), and sends invoice email."""
+def _prepare_invoice_for_sending(invoice_data: dict) -> dict:
+    """Localizes dates to the company timezone and adds the currency symbol."""
+    # Convert to company timezone for email readability
+    tzone = invoice_data.get("tzone")
+    invoice_data = localize_datetime_fields(invoice_data, tzone)
 
-    try:
-        billing_period = invoice_data.get("billingPeriod", {})
-        start_date = billing_period.get("startDate")
-        end_date = billing_period.get("endDate")
+    #Generate Currency Symbol and adding it to invoice data
+    currency = invoice_data.get("billingRates", {}).get("currency", "INR").upper()
+    symbol_map = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£", "SGD": "S$", "JPY": "¥"}
+    currency_symbol = symbol_map.get(currency, currency)
 
-        # Convert to company timezone for email readability
-        tzone = invoice_data.get("tzone")
-        invoice_data = localize_datetime_fields(invoice_data, tzone)
+    invoice_data["currency_symbol"] = currency_symbol
+    return invoice_data
 
-        #Generate Currency Symbol and adding it to invoice data
-        currency = invoice_data.get("billingRates", {}).get("currency", "INR").upper()
-        symbol_map = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£", "SGD": "S$", "JPY": "¥"}
-        currency_symbol = symbol_map.get(currency, currency)
 
-        invoice_data["currency_symbol"] = currency_symbol
+def render_invoice_pdf(invoice_data: dict) -> tuple[dict, dict]:
+    """
+    Rendering stage: prepares the invoice data and renders its PDF in memory.
 
-        # --- Generate PDF ---
-        pdf_path = generate_pdf("invoice_template.html", invoice_data, prefix="invoice")
+    Returns:
+        tuple: (prepared invoice data, PDF artifact)
+    """
+    prepared = _prepare_invoice_for_sending(invoice_data)
+    pdf = render_pdf("invoice_template.html", prepared, prefix="invoice")
+    return prepared, pdf
 
-        # --- Construct CSV path ---
-        csv_path = None
-        if start_date and end_date:
-            csv_path = _construct_csv_filepath(invoice_data["companyId"], start_date, end_date)
 
-        # --- Prepare email context ---
-        company_info = invoice_data.get("companyInfo", {})
-        # recipient_email = company_info.get("billingEmail", "support@vysedeck.com")
-        recipient_email = "vishruth.ramesh@vysedeck.com"
-        # company_name = company_info.get("legalName", invoice_data["companyId"])
-        invoice_number = invoice_data.get("invoice_number")
+def build_invoice_email(
+    invoice_data: dict,
+    isSubEntity: bool,
+    pdf: dict,
+    billing_period: dict,
+    csv_attachment: dict | None = None
+) -> dict:
+    """
+    Builds the send_email()/enqueue_email() arguments for an invoice.
 
-        vendor_info = invoice_data.get("vendorInfo", {})
-        sender_email = vendor_info.get("billingEmail", {})
+    Args:
+        invoice_data: Invoice data prepared by render_invoice_pdf()
+        isSubEntity: Whether this is a sub-entity invoice
+        pdf: PDF artifact returned by render_invoice_pdf()
+        billing_period: Billing period with the original (non-localized) ISO dates
+        csv_attachment: In-memory call log CSV produced by billing; when missing (e.g. an
+                        existing invoice was returned) the CSV is looked up on disk
 
+    Returns:
+        dict: Keyword arguments for send_email()/enqueue_email()
+    """
+    start_date = billing_period.get("startDate")
+    end_date = billing_period.get("endDate")
 
-        subject = (
-            f"Tax Invoice {invoice_number} - Voice Agent Services for "
-            f"{start_date[:10]} to {end_date[:10]}"
-        )
-        if isSubEntity:
-            token = generate_invoice_token( invoice_data["vendorInfo"].get("id"), invoice_data["companyId"], invoice_data["invoice_number"], expires_in_hours=72 )
-        else:
-            token = generate_invoice_token( invoice_data["companyId"], None, invoice_data["invoice_number"], expires_in_hours=72 )
-
-        # NOTE: token generation is left in place but we use the hardcoded payment URL
-        # per request (no token appended).
-        # Using provided hardcoded URL now:
-        payment_url = "https://billai.vysedeck.com/login"
+    # --- Construct CSV path ---
+    csv_path = None
+    if csv_attachment is None and start_date and end_date:
+        csv_path = _construct_csv_filepath(invoice_data["companyId"], start_date, end_date)
 
-        context = {
-            "legalName": vendor_info.get("legalName"),
-            "invoice_number": invoice_number,
-            "start_date": start_date[:10],
-            "end_date": end_date[:10],
-            "total_calls": f"{invoice_data['usageData'].get('totalCalls', 0):,}",
-            "total_billed_minutes": f"{invoice_data['usageData'].get('totalBilledMinutes', 0):,}",
-            "rate_per_minute": f"{invoice_data['billingRates'].get('ratePerMinute', 0):.2f}",
-            "call_charges": f"{invoice_data['subtotal'] - invoice_data['billingRates'].get('maintenanceFee', 0):,.2f}",
-            "maintenance_fee": f"{invoice_data['billingRates'].get('maintenanceFee', 0):,.2f}",
-            "subtotal": f"{invoice_data['subtotal']:,.2f}",
-            "gst_rate": invoice_data['billingRates'].get('gstRate', 0),
-            "gst_amount": f"{invoice_data['gstAmount']:,.2f}",
-            "total_amount": f"{invoice_data['totalAmount']:,.2f}",
-            "currency_symbol": currency_symbol,
-            "due_date": invoice_data.get('dueDate', '')[:10],
-            "sender_email": sender_email,
-            "payment_url": payment_url
-        }
+    # --- Prepare email context ---
+    company_info = invoice_data.get("companyInfo", {})
+    # recipient_email = company_info.get("billingEmail", "support@vysedeck.com")
+    recipient_email = "vishruth.ramesh@vysedeck.com"
+    # company_name = company_info.get("legalName", invoice_data["companyId"])
+    invoice_number = invoice_data.get("invoice_number")
 
-        # --- Attachments ---
-        attachments = [pdf_path]
-        if csv_path and os.path.exists(csv_path):
-            attachments.append(csv_path)
+    vendor_info = invoice_data.get("vendorInfo", {})
+    sender_email = vendor_info.get("billingEmail", {})
+
+
+    subject = (
+        f"Tax Invoice {invoice_number} - Voice Agent Services for "
+        f"{start_date[:10]} to {end_date[:10]}"
+    )
+    if isSubEntity:
+        token = generate_invoice_token( invoice_data["vendorInfo"].get("id"), invoice_data["companyId"], invoice_data["invoice_number"], expires_in_hours=72 )
+    else:
+        token = generate_invoice_token( invoice_data["companyId"], None, invoice_data["invoice_number"], expires_in_hours=72 )
+
+    # NOTE: token generation is left in place but we use the hardcoded payment URL
+    # per request (no token appended).
+    # Using provided hardcoded URL now:
+    payment_url = "https://billai.vysedeck.com/login"
+
+    context = {
+        "legalName": vendor_info.get("legalName"),
+        "invoice_number": invoice_number,
+        "start_date": start_date[:10],
+        "end_date": end_date[:10],
+        "total_calls": f"{invoice_data['usageData'].get('totalCalls', 0):,}",
+        "total_billed_minutes": f"{invoice_data['usageData'].get('totalBilledMinutes', 0):,}",
+        "rate_per_minute": f"{invoice_data['billingRates'].get('ratePerMinute', 0):.2f}",
+        "call_charges": f"{invoice_data['subtotal'] - invoice_data['billingRates'].get('maintenanceFee', 0):,.2f}",
+        "maintenance_fee": f"{invoice_data['billingRates'].get('maintenanceFee', 0):,.2f}",
+        "subtotal": f"{invoice_data['subtotal']:,.2f}",
+        "gst_rate": invoice_data['billingRates'].get('gstRate', 0),
+        "gst_amount": f"{invoice_data['gstAmount']:,.2f}",
+        "total_amount": f"{invoice_data['totalAmount']:,.2f}",
+        "currency_symbol": invoice_data["currency_symbol"],
+        "due_date": invoice_data.get('dueDate', '')[:10],
+        "sender_email": sender_email,
+        "payment_url": payment_url
+    }
+
+    # --- Attachments ---
+    attachments = [pdf]
+    if csv_attachment is not None:
+        attachments.append(csv_attachment)
+    elif csv_path and os.path.exists(csv_path):
+        attachments.append(csv_path)
+
+    return {
+        "recipient_email": recipient_email,
+        "subject": subject,
+        "html_template": "invoice_email_template.html",
+        "context": context,
+        "attachments": attachments,
+    }
 
-        # --- Send email ---
-        send_email(
-            recipient_email=recipient_email,
-            subject=subject,
-            html_template="invoice_email_template.html",
-            context=context,
-            attachments=attachments
-        )
 
-        print(f"✅ Invoice {invoice_number} sent to {recipient_email}")
-        return {"invoice_number": invoice_number, "email": recipient_email, "pdf": pdf_path}
+def send_invoice_to_client(invoice_data: dict, isSubEntity: bool):
+    """Generates PDF, attaches CSV (if exists), and queues the invoice email in the outbox."""
+
+    try:
+        billing_period = invoice_data.get("billingPeriod", {})
+        csv_attachment = invoice_data.pop("csvAttachment", None)
+
+        # --- Generate PDF ---
+        invoice_data, pdf = render_invoice_pdf(invoice_data)
+
+        email = build_invoice_email(invoice_data, isSubEntity, pdf, billing_period, csv_attachment)
+
+        # --- Queue email (sent by the outbox dispatcher) ---
+        invoice_number = invoice_data.get("invoice_number")
+        outbox_id = enqueue_email(**email, metadata={"invoice_number": invoice_number})
+
+        print(f"✅ Invoice {invoice_number} queued for {email['recipient_email']}")
+        return {"invoice_number": invoice_number, "email": email["recipient_email"], "pdf": pdf["path"] or pdf["name"], "outbox_id": outbox_id}
 
     except Exception as e:
         print(f"❌ Failed to send invoice email: {e}")
         return None
 
-def generate_invoices_for_all(companies: list[str], month: int, year: int):
-    """Generate invoices for all companies & tenants, then email them."""
-    parent_company = "vysedeck"
-    all_invoices = []
-    for company in companies:
-        try:
-            # 1️⃣ Generate company’s own invoice
-            invoice_company = generate_monthly_bill(
-                company=parent_company, tenant=company, isSubEntity=False, month=month, year=year
-            )
-            all_invoices.append(invoice_company)
-            send_invoice_to_client(invoice_company, isSubEntity = False)
-
-            # 2️⃣ Generate invoices for all tenants under this company
-            tenants = get_tenants(company)
-            print(f"🏢 Tenants under {company}: {tenants}")
-            for tenant in tenants:
-                invoice_tenant = generate_monthly_bill(
-                    company=company, tenant=tenant, isSubEntity = True, month=month, year=year
-                )
-                all_invoices.append(invoice_tenant)
-                send_invoice_to_client(invoice_tenant, isSubEntity = True)
-
-        except Exception as e:
-            print(f"❌ Failed for {company}: {e}")
-
-    return all_invoices
+def generate_invoices_for_all(companies: list[str], month: int, year: int, max_workers: int | None = None):
+    """
+    Generate invoices for all companies & tenants, then email them.
+    Runs on the concurrent batch engine (see services/invoice_batch_service.py).
+
+    Returns:
+        list: {"invoice_number", "pdf"} of each generated invoice
+    """
+    from services.invoice_batch_service import run_invoice_batch, DEFAULT_IO_WORKERS
+
+    report = run_invoice_batch(companies, month, year, io_workers=max_workers or DEFAULT_IO_WORKERS)
+    return report["invoices"]
 
 
 def check_and_send_payment_reminders():
     """
-    Checks all pending invoices and sends reminder emails based on:
+    Sends today's payment reminder emails:
     1. First reminder: 3 days after invoice_date
     2. Final reminder: On due_date
-    
+
+    Invoices are looked up through their reminder index (nextReminderDate, set when the
+    invoice is saved), so only invoices due for a reminder today, or whose reminder was
+    missed on an earlier day, are read. After sending, each invoice's index is moved on to
+    its next reminder; a failed send keeps its date and is retried by the next run.
+
     This function should be called daily by the scheduler.
     """
     try:
         print(f"\n🔔 [{datetime.now()}] Checking for payment reminders...")
         
-        from repositories.bill_repo import get_all_pending_invoices
+        from repositories.bill_repo import get_invoices_due_for_reminder, advance_reminder_index
         
-        pending_invoices = get_all_pending_invoices()
+        today = datetime.now().date()
+        due_invoices = get_invoices_due_for_reminder(today.isoformat())
         
-        if not pending_invoices:
-            print("✅ No pending invoices found")
+        if not due_invoices:
+            print("✅ No reminders due today")
             return {"first_reminders_sent": 0, "final_reminders_sent": 0}
         
-        today = datetime.now().date()
         first_reminders_sent = 0
         final_reminders_sent = 0
+        reminded = []
         
-        for invoice_entry in pending_invoices:
+        for invoice_entry in due_invoices:
             invoice_data = invoice_entry["invoice_data"]
-            company_id = invoice_entry["company_id"]
-            tenant_id = invoice_entry["tenant_id"]
+            reminder_type = invoice_entry["reminder_type"]
             
             try:
-                # Parse dates
-                invoice_date_str = invoice_data.get("invoiceDate", "")
-                due_date_str = invoice_data.get("dueDate", "")
-                
-                if not invoice_date_str or not due_date_str:
-                    print(f"⚠️ Skipping invoice {invoice_data.get('invoice_number')}: Missing dates")
-                    continue
-                
-                # Extract date part (YYYY-MM-DD)
-                invoice_date = datetime.strptime(invoice_date_str[:10], "%Y-%m-%d").date()
-                due_date = datetime.strptime(due_date_str[:10], "%Y-%m-%d").date()
-                
-                # Calculate reminder dates
-                first_reminder_date = invoice_date + timedelta(days=3)
-                
-                # Check if we need to send reminders
-                if today == first_reminder_date:
-                    # Send first reminder
-                    print(f"📧 Sending first reminder for invoice {invoice_data.get('invoice_number')}")
-                    _send_reminder_email(invoice_data, company_id, tenant_id, reminder_type="first")
+                print(f"📧 Sending {reminder_type} reminder for invoice {invoice_data.get('invoice_number')}")
+                _send_reminder_email(invoice_data, invoice_entry["company_id"], invoice_entry["tenant_id"], reminder_type=reminder_type)
+                if reminder_type == "first":
                     first_reminders_sent += 1
-                    
-                elif today == due_date:
-                    # Send final reminder
-                    print(f"📧 Sending final reminder for invoice {invoice_data.get('invoice_number')}")
-                    _send_reminder_email(invoice_data, company_id, tenant_id, reminder_type="final")
+                else:
                     final_reminders_sent += 1
+                reminded.append(invoice_entry["snapshot"])
                     
             except Exception as e:
                 print(f"❌ Error processing reminder for invoice {invoice_data.get('invoice_number')}: {e}")
         
+        index_result = advance_reminder_index(reminded, today)
+        if index_result["failed"]:
+            print(f"⚠️ Reminder index not advanced for {len(index_result['failed'])} invoices")
+        
         summary = {
             "first_reminders_sent": first_reminders_sent,
             "final_reminders_sent": final_reminders_sent,
@@ -227,18 +246,10 @@ def _send_reminder_email(invoice_data: dict, company_id: str, tenant_id: str | N
         reminder_type: "first" or "final"
     """
     try:
-        # Convert to company timezone for email readability
-        tzone = invoice_data.get("tzone")
-        invoice_data = localize_datetime_fields(invoice_data, tzone)
-        
-        # Generate Currency Symbol
-        currency = invoice_data.get("billingRates", {}).get("currency", "INR").upper()
-        symbol_map = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£", "SGD": "S$", "JPY": "¥"}
-        currency_symbol = symbol_map.get(currency, currency)
-        invoice_data["currency_symbol"] = currency_symbol
-        
-        # Generate PDF
-        pdf_path = generate_pdf("invoice_template.html", invoice_data, prefix="invoice")
+        # Localize dates and add the currency symbol exactly as for the original send,
+        # so the PDF is served from the render cache instead of being re-rendered
+        invoice_data, pdf = render_invoice_pdf(invoice_data)
+        currency_symbol = invoice_data["currency_symbol"]
         
         # Prepare email context
         company_info = invoice_data.get("companyInfo", {})
@@ -285,16 +296,17 @@ def _send_reminder_email(invoice_data: dict, company_id: str, tenant_id: str | N
             "reminder_type": reminder_type
         }
         
-        # Send email with PDF attachment
-        send_email(
+        # Queue email with PDF attachment
+        enqueue_email(
             recipient_email=recipient_email,
             subject=subject,
             html_template=template,
             context=context,
-            attachments=[pdf_path]
+            attachments=[pdf],
+            metadata={"invoice_number": invoice_number}
         )
         
-        print(f"✅ {reminder_type.capitalize()} reminder sent for invoice {invoice_number}")
+        print(f"✅ {reminder_type.capitalize()} reminder queued for invoice {invoice_number}")
         
     except Exception as e:
         print(f"❌ Failed to send {reminder_type} reminder email: {e}")
@@ -5,8 +5,8 @@ from datetime import datetime
 from typing import Dict, Any
 
 from services.billing_service import generate_monthly_bill
-from services.pdf_service import generate_pdf
-from services.mailer_service import send_email
+from services.pdf_service import render_pdf
+from services.outbox_service import enqueue_email
 from utils.date_utils import localize_datetime_fields
 from utils.invoice_token import generate_invoice_token
 
@@ -73,6 +73,10 @@ def generate_invoice_for_company(
             print(f"❌ Billing service returned no data for tenant {tenant_id}")
             return None
 
+        # In-memory call log CSV (only present when the invoice was just generated);
+        # popped so it never ends up in the API response
+        csv_attachment = invoice_data.pop("csvAttachment", None)
+
         # 2️⃣ Get billing period and timezone
         billing_period = invoice_data.get('billingPeriod', {})
         start_date = billing_period.get('startDate')
@@ -91,12 +95,12 @@ def generate_invoice_for_company(
         invoice_data["currency_symbol"] = currency_symbol
 
         # 5️⃣ Generate PDF
-        pdf_path = generate_pdf("invoice_template.html", invoice_data, prefix="invoice")
-        print(f"📑 PDF generated at: {pdf_path}")
+        pdf = render_pdf("invoice_template.html", invoice_data, prefix="invoice")
+        print(f"📑 PDF generated: {pdf['name']}")
         
-        # 6️⃣ Construct CSV path
+        # 6️⃣ Construct CSV path (fallback when no in-memory CSV was produced)
         csv_path = None
-        if start_date and end_date:
+        if csv_attachment is None and start_date and end_date:
             csv_path = _construct_csv_filepath(tenant_id, start_date, end_date)
             if not os.path.exists(csv_path):
                 print(f"⚠️ CSV file not found at {csv_path}")
@@ -160,21 +164,25 @@ def generate_invoice_for_company(
         }
 
         # 1️⃣1️⃣ Prepare attachments
-        attachments = [pdf_path]
-        if csv_path and os.path.exists(csv_path):
+        attachments = [pdf]
+        if csv_attachment is not None:
+            attachments.append(csv_attachment)
+            print(f"📎 Adding CSV attachment: {csv_attachment['name']}")
+        elif csv_path and os.path.exists(csv_path):
             attachments.append(csv_path)
             print(f"📎 Adding CSV attachment: {csv_path}")
 
-        # 1️⃣2️⃣ Send email
+        # 1️⃣2️⃣ Queue email (sent by the outbox dispatcher)
         if recipient_email and invoice_number:
-            send_email(
+            enqueue_email(
                 recipient_email=recipient_email,
                 subject=subject,
                 html_template="invoice_email_template.html",
                 context=context,
-                attachments=attachments
+                attachments=attachments,
+                metadata={"invoice_number": invoice_number}
             )
-            print(f"✅ Invoice {invoice_number} emailed to {recipient_email} with {len(attachments)} attachment(s)")
+            print(f"✅ Invoice {invoice_number} queued for {recipient_email} with {len(attachments)} attachment(s)")
         else:
             missing_fields = []
             if not recipient_email: missing_fields.append('recipient_email')
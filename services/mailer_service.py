@@ -1,21 +1,103 @@
+import json
 import os
-import base64
+import threading
 from postmarker.core import PostmarkClient
 from dotenv import load_dotenv
-from jinja2 import Template
+from services.template_registry import render_template
+from utils.artifacts import b64encode_stream
 
 load_dotenv()
 
 POSTMARK_API_TOKEN = os.getenv("POSTMARK_API_TOKEN")
 SENDER_EMAIL = os.getenv("SENDER_EMAIL")
-TEMPLATE_DIR = "templates"
+# Point at a local stand-in for Postmark when testing
+POSTMARK_API_URL = os.getenv("POSTMARK_API_URL", "https://api.postmarkapp.com")
+
+# Postmark accepts at most 500 messages per /email/batch request
+POSTMARK_BATCH_SIZE = 500
+# ... and at most 50 MB per request; the rest is headroom for the request framing
+POSTMARK_BATCH_MAX_BYTES = 45 * 1024 * 1024
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_postmark_client() -> PostmarkClient:
+    """Process-wide Postmark client, so every send reuses one pooled HTTP session."""
+    global _client
+    if not POSTMARK_API_TOKEN:
+        raise ValueError("POSTMARK_API_TOKEN missing in environment.")
+    with _client_lock:
+        if _client is None:
+            _client = PostmarkClient(server_token=POSTMARK_API_TOKEN, root_api_url=POSTMARK_API_URL)
+        return _client
+
+
+def _encode_attachments(attachments: list[str | dict] | None) -> list[dict]:
+    """Converts artifacts and file paths into Postmark attachment dicts."""
+    attachments_list = []
+    if attachments:
+        for attachment in attachments:
+            if isinstance(attachment, dict):
+                attachments_list.append({
+                    "Name": attachment["name"],
+                    "Content": b64encode_stream(attachment["content"]),
+                    "ContentType": attachment["content_type"]
+                })
+                continue
+
+            file_path = attachment
+            if not os.path.exists(file_path):
+                print(f"⚠️ Skipping missing attachment: {file_path}")
+                continue
+            mime_type = "application/pdf" if file_path.endswith(".pdf") else "text/csv"
+            with open(file_path, "rb") as f:
+                encoded = b64encode_stream(f)
+            attachments_list.append({
+                "Name": os.path.basename(file_path),
+                "Content": encoded,
+                "ContentType": mime_type
+            })
+    return attachments_list
+
+
+def build_email(
+    recipient_email: str,
+    subject: str,
+    html_template: str,
+    context: dict,
+    attachments: list[str | dict] = None,
+    metadata: dict | None = None,
+) -> dict:
+    """
+    Renders an email into a Postmark message, ready for send_email_batch().
+    Takes the same arguments as send_email(), plus Postmark metadata
+    (e.g. {"invoice_number": ...}) used to map batch results back.
+
+    Returns:
+        dict: Postmark message (From, To, Subject, HtmlBody, Attachments, Metadata)
+    """
+    # Render with the shared, precompiled template registry
+    body = render_template(html_template, context)
+
+    message = {
+        "From": SENDER_EMAIL,
+        "To": recipient_email,
+        "Subject": subject,
+        "HtmlBody": body,
+        "Attachments": _encode_attachments(attachments),
+    }
+    if metadata:
+        message["Metadata"] = metadata
+    return message
+
 
 def send_email(
     recipient_email: str,
     subject: str,
     html_template: str,
     context: dict,
-    attachments: list[str] = None,
+    attachments: list[str | dict] = None,
 ):
     """
     Generic email sender using Postmark + HTML templates.
@@ -25,42 +107,81 @@ def send_email(
         subject: Email subject.
         html_template: HTML file inside /templates.
         context: Dict of placeholders for template.
-        attachments: List of file paths (PDF, CSV, etc.)
+        attachments: In-memory artifacts ({"name", "content", "content_type"}, see
+                     utils/artifacts.py) or file paths (PDF, CSV, etc.)
     """
-    if not POSTMARK_API_TOKEN:
-        raise ValueError("POSTMARK_API_TOKEN missing in environment.")
-    postmark = PostmarkClient(server_token=POSTMARK_API_TOKEN)
+    postmark = get_postmark_client()
+    message = build_email(recipient_email, subject, html_template, context, attachments)
 
-    # Load HTML template and render with Jinja2
-    with open(os.path.join(TEMPLATE_DIR, html_template), "r", encoding="utf-8") as f:
-        template_str = f.read()
-    template = Template(template_str)
-    body = template.render(**context)
+    # Send email via Postmark
+    postmark.emails.send(**message)
+    print(f"✅ Email sent to {recipient_email} ({len(message['Attachments'])} attachment(s))")
 
-    print(context["payment_url"])
 
-    # Prepare attachments
-    attachments_list = []
-    if attachments:
-        for file_path in attachments:
-            if not os.path.exists(file_path):
-                print(f"⚠️ Skipping missing attachment: {file_path}")
-                continue
-            mime_type = "application/pdf" if file_path.endswith(".pdf") else "text/csv"
-            with open(file_path, "rb") as f:
-                encoded = base64.b64encode(f.read()).decode("utf-8")
-            attachments_list.append({
-                "Name": os.path.basename(file_path),
-                "Content": encoded,
-                "ContentType": mime_type
+def message_size(message: dict) -> int:
+    """Bytes a message built by build_email() adds to a Postmark request body (attachments included)."""
+    return len(json.dumps(message))
+
+
+def chunk_messages(messages: list[dict]) -> list[list[dict]]:
+    """
+    Splits messages into Postmark batch requests: a chunk is closed when it reaches
+    POSTMARK_BATCH_SIZE messages or when the next message would take its encoded size
+    past POSTMARK_BATCH_MAX_BYTES. A message over the byte limit on its own gets a chunk
+    of its own (Postmark then rejects just that message's request).
+    """
+    chunks = []
+    chunk, chunk_bytes = [], 0
+    for message in messages:
+        size = message_size(message)
+        if chunk and (len(chunk) == POSTMARK_BATCH_SIZE or chunk_bytes + size > POSTMARK_BATCH_MAX_BYTES):
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(message)
+        chunk_bytes += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def send_email_batch(messages: list[dict]) -> list[dict]:
+    """
+    Sends messages built by build_email() through Postmark's batch endpoint, in requests
+    of up to POSTMARK_BATCH_SIZE messages and POSTMARK_BATCH_MAX_BYTES (see chunk_messages).
+    A failed request fails only its own chunk.
+
+    Args:
+        messages: Postmark messages; Metadata["invoice_number"] identifies each result
+
+    Returns:
+        list: One result per message, in order:
+              {"invoice_number", "to", "status" ("sent" | "failed"), "message_id", "error_code", "error"}
+              (error_code is Postmark's, or -1 when the request itself failed)
+    """
+    postmark = get_postmark_client()
+    results = []
+    requests_made = 0
+
+    for chunk in chunk_messages(messages):
+        requests_made += 1
+        try:
+            responses = postmark.emails.send_batch(*chunk)
+        except Exception as e:
+            print(f"❌ Postmark batch of {len(chunk)} emails failed: {e}")
+            responses = [{"ErrorCode": -1, "Message": str(e)}] * len(chunk)
+
+        # Postmark answers with one entry per message, in request order
+        for message, response in zip(chunk, responses):
+            sent = response.get("ErrorCode") == 0
+            results.append({
+                "invoice_number": (message.get("Metadata") or {}).get("invoice_number"),
+                "to": message["To"],
+                "status": "sent" if sent else "failed",
+                "message_id": response.get("MessageID"),
+                "error_code": response.get("ErrorCode"),
+                "error": None if sent else response.get("Message"),
             })
 
-    # Send email via Postmark
-    postmark.emails.send(
-        From=SENDER_EMAIL,
-        To=recipient_email,
-        Subject=subject,
-        HtmlBody=body,
-        Attachments=attachments_list
-    )
-    print(f"✅ Email sent to {recipient_email} ({len(attachments_list)} attachment(s))")
+    sent = sum(1 for r in results if r["status"] == "sent")
+    print(f"✅ Batch sent {sent}/{len(messages)} emails in {requests_made} request(s)")
+    return results
@@ -0,0 +1,119 @@
+# services/outbox_service.py
+"""
+Durable email outbox.
+
+Call sites render their email and enqueue it (enqueue_email) instead of calling
+Postmark inline, so a slow or failing Postmark never blocks a request or a job.
+An asyncio dispatcher, started with the app, drains the queue:
+- due messages are claimed in chunks within Postmark's per-request count and size
+  limits, and sent through its batch endpoint with at most OUTBOX_CONCURRENCY
+  requests in flight
+- failed messages, including every message of a request that raised (network error,
+  missing token), are retried with exponential backoff
+- messages that keep failing (or that Postmark rejects permanently) are dead-lettered
+
+The billing CLI, which runs outside the app, drains the outbox before exiting.
+"""
+import asyncio
+import os
+
+from services.mailer_service import build_email, send_email_batch, POSTMARK_BATCH_SIZE, POSTMARK_BATCH_MAX_BYTES
+from utils.local_queue import LocalQueue, done, failed
+
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "30"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+
+# Postmark errors that retrying cannot fix (invalid address, inactive recipient, ...)
+PERMANENT_POSTMARK_ERRORS = {300, 406}
+
+# Message states: pending -> sending -> sent, or back to pending (retry) / dead (dead-lettered)
+_outbox = LocalQueue(
+    "Email outbox",
+    "email_outbox",
+    workers=OUTBOX_CONCURRENCY,
+    # One claimed chunk is one Postmark batch request
+    claim_limit=POSTMARK_BATCH_SIZE,
+    claim_max_bytes=POSTMARK_BATCH_MAX_BYTES,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    backoff_base_seconds=OUTBOX_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=OUTBOX_BACKOFF_MAX_SECONDS,
+    poll_seconds=OUTBOX_POLL_SECONDS,
+    payload_column="message",
+    result_column="message_id",
+    claimed_status="sending",
+    done_status="sent",
+)
+
+
+def enqueue_email(
+    recipient_email: str,
+    subject: str,
+    html_template: str,
+    context: dict,
+    attachments: list[str | dict] = None,
+    metadata: dict | None = None,
+) -> int:
+    """
+    Renders an email and stores it in the outbox for the dispatcher to send.
+    Takes the same arguments as mailer_service.send_email().
+
+    Returns:
+        int: Outbox ID of the queued message
+    """
+    outbox_id, _ = _outbox.enqueue(build_email(recipient_email, subject, html_template, context, attachments, metadata))
+    print(f"📮 Email to {recipient_email} queued (outbox #{outbox_id})")
+    return outbox_id
+
+
+def _deliver_chunk(chunk: list[dict]) -> list[dict]:
+    """Sends one claimed chunk (one Postmark batch request); returns each message's outcome."""
+    outcomes = send_email_batch([entry["payload"] for entry in chunk])
+    return [
+        done(outcome["message_id"]) if outcome["status"] == "sent"
+        else failed(f"{outcome['to']}: {outcome['error']}", permanent=outcome["error_code"] in PERMANENT_POSTMARK_ERRORS)
+        for outcome in outcomes
+    ]
+
+
+def start_outbox_dispatcher():
+    """Starts the dispatcher on the running event loop (called from the app lifespan)."""
+    _outbox.start(_deliver_chunk)
+
+
+async def stop_outbox_dispatcher():
+    """Stops the dispatcher after its in-flight sends finish."""
+    await _outbox.stop()
+
+
+def get_outbox_counts() -> dict:
+    """Number of messages per status."""
+    return _outbox.counts()
+
+
+def requeue_dead_messages() -> int:
+    """Puts every dead-lettered message back in the queue with a fresh attempt budget."""
+    return _outbox.requeue_dead()
+
+
+def drain_outbox(timeout_seconds: float = 300) -> dict:
+    """
+    Sends everything in the outbox, waiting for scheduled retries, for at most
+    timeout_seconds. Messages still pending afterwards stay queued for the app's dispatcher.
+
+    Returns:
+        dict: Message counts per status after draining
+    """
+    async def _drain():
+        stop = asyncio.Event()
+        try:
+            await asyncio.wait_for(_outbox.run(_deliver_chunk, stop, drain=True), timeout=timeout_seconds)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Outbox not fully drained after {timeout_seconds}s; the rest stays queued")
+
+    asyncio.run(_drain())
+    counts = get_outbox_counts()
+    print(f"📮 Outbox after drain: {counts}")
+    return counts
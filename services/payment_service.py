@@ -3,30 +3,168 @@ import razorpay
 import os
 import hmac
 import hashlib
+import time
+import uuid
 from dotenv import load_dotenv
-from datetime import datetime
-from services.pdf_service import generate_pdf
-from services.mailer_service import send_email
-from repositories.bill_repo import save_payment_record, mark_invoice_as_paid
+from datetime import datetime, timedelta, timezone
+from services.pdf_service import render_pdf
+from services.outbox_service import enqueue_email
+from services.receipt_job_service import enqueue_receipt_job
+from repositories.bill_repo import commit_payment, get_payment_intent, save_payment_intent
+from repositories.invoice_repo import get_invoice_with_update_time
 load_dotenv()
 
 #--- Stripe Setup ---
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+# API base URLs are overridable (e.g. to point at a local stand-in of the provider)
+if os.getenv("STRIPE_API_BASE"):
+    stripe.api_base = os.getenv("STRIPE_API_BASE")
 
 #--- Razorpay Setup ---
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
+RAZORPAY_API_BASE = os.getenv("RAZORPAY_API_BASE")
 
 razorpay_client = razorpay.Client(
-    auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
+    auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
+    **({"base_url": RAZORPAY_API_BASE} if RAZORPAY_API_BASE else {}),
 )
 
-def create_stripe_checkout_session(invoice_data):
+#--- Payment intent reuse ---
+# Razorpay orders don't expire; an order is reused for this long
+RAZORPAY_ORDER_REUSE_SECONDS = int(os.getenv("RAZORPAY_ORDER_REUSE_SECONDS", "86400"))
+# Lifetime requested for Stripe Checkout sessions (Stripe allows 30 minutes to 24 hours)
+STRIPE_SESSION_TTL_SECONDS = int(os.getenv("STRIPE_SESSION_TTL_SECONDS", str(23 * 3600)))
+# A stored order/session is only reused while it stays valid at least this much longer
+PAYMENT_INTENT_MIN_REMAINING_SECONDS = int(os.getenv("PAYMENT_INTENT_MIN_REMAINING_SECONDS", "900"))
+
+# A claim on creating an invoice's order/session that is older than this is abandoned
+# (its request died) and may be taken over
+PAYMENT_INTENT_CLAIM_SECONDS = float(os.getenv("PAYMENT_INTENT_CLAIM_SECONDS", "30"))
+# How often a request waiting on another request's claim re-reads the invoice
+PAYMENT_INTENT_POLL_SECONDS = float(os.getenv("PAYMENT_INTENT_POLL_SECONDS", "0.25"))
+
+
+def _reusable_intent(intent: dict | None, amount: int, currency: str) -> dict | None:
+    """The stored order/session, if it is for this amount and not about to expire."""
+    if not intent or intent.get("amount") != amount or intent.get("currency") != currency:
+        return None
+    try:
+        expires_at = datetime.fromisoformat(intent["expires_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if expires_at - datetime.now(timezone.utc) < timedelta(seconds=PAYMENT_INTENT_MIN_REMAINING_SECONDS):
+        return None
+    return intent
+
+
+def _claimed_elsewhere(intent: dict | None, claim_id: str) -> bool:
+    """Whether another request holds a live claim on creating the order/session."""
+    if not intent or "claim_id" not in intent or intent["claim_id"] == claim_id:
+        return False
+    try:
+        claimed_at = datetime.fromisoformat(intent["claimed_at"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return datetime.now(timezone.utc) - claimed_at < timedelta(seconds=PAYMENT_INTENT_CLAIM_SECONDS)
+
+
+def _get_or_create_intent(invoice_data: dict, provider: str, amount: int, currency: str, create) -> dict:
     """
-    Creates a Stripe checkout session for an invoice.
+    Returns the response of the invoice's open order/session for provider, creating one
+    (and storing it on the invoice) only if there is none, it expires soon, or the
+    amount changed.
+
+    Requests on any worker agree on one order/session: before creating one, a request
+    claims paymentIntents.{provider} with a write conditioned on the invoice's update
+    time. Requests that find a live claim wait for its order/session instead of
+    creating their own.
 
+    Args:
+        invoice_data: Invoice data (with invoice_number, companyId and tenant_id)
+        provider: "razorpay" or "stripe"
+        amount: Amount in the smallest currency unit
+        currency: Currency code as sent to the provider
+        create: Zero-argument function creating the order/session at the provider;
+            returns (intent ID, client response, expires_at datetime)
     """
+    company_id = invoice_data.get("companyId")
+    tenant_id = invoice_data.get("tenant_id")
+    invoice_number = invoice_data["invoice_number"]
+
+    intent = _reusable_intent((invoice_data.get("paymentIntents") or {}).get(provider), amount, currency)
+    claim_id = uuid.uuid4().hex
+    while intent is None:
+        # The loaded invoice may be stale; decide on the current document
+        stored, update_time = get_payment_intent(company_id, tenant_id, invoice_number, provider)
+        intent = _reusable_intent(stored, amount, currency)
+        if intent is not None:
+            break
+        if _claimed_elsewhere(stored, claim_id):
+            time.sleep(PAYMENT_INTENT_POLL_SECONDS)
+            continue
+        claim = {"claim_id": claim_id, "claimed_at": datetime.now(timezone.utc).isoformat()}
+        if save_payment_intent(company_id, tenant_id, invoice_number, provider, claim, update_time):
+            return _create_claimed_intent(invoice_data, provider, amount, currency, create, claim_id)
+        # Another request wrote the invoice in between; look again
+
+    print(f"♻️ Reusing {provider} {intent['id']} for invoice {invoice_number} (valid until {intent['expires_at']})")
+    return intent["response"]
+
+
+def _create_claimed_intent(invoice_data: dict, provider: str, amount: int, currency: str, create, claim_id: str) -> dict:
+    """Creates the order/session this request holds the claim for and stores it in place of the claim."""
+    company_id = invoice_data.get("companyId")
+    tenant_id = invoice_data.get("tenant_id")
+    invoice_number = invoice_data["invoice_number"]
+
+    def _replace_claim(value: dict | None) -> bool:
+        # Conditional writes: only while the slot still holds this request's claim
+        while True:
+            stored, update_time = get_payment_intent(company_id, tenant_id, invoice_number, provider)
+            if (stored or {}).get("claim_id") != claim_id:
+                return False
+            if save_payment_intent(company_id, tenant_id, invoice_number, provider, value, update_time):
+                return True
+
+    try:
+        intent_id, response, expires_at = create()
+    except Exception:
+        # Let the next request create it instead of waiting for the claim to go stale
+        try:
+            _replace_claim(None)
+        except Exception as e:
+            print(f"⚠️ Failed to release the {provider} claim on invoice {invoice_number}: {e}")
+        raise
+
+    intent = {
+        "id": intent_id,
+        "amount": amount,
+        "currency": currency,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "expires_at": expires_at.isoformat(),
+        "response": response,
+    }
     try:
+        if not _replace_claim(intent):
+            print(f"⚠️ The {provider} claim on invoice {invoice_number} was taken over; {intent_id} is not stored")
+    except Exception as e:
+        # The new order/session is still usable; the next attempt just won't reuse it
+        print(f"⚠️ Failed to store {provider} {intent_id} on invoice {invoice_number}: {e}")
+    print(f"✅ Created {provider} {intent_id} for invoice {invoice_number}")
+    return response
+
+
+def create_stripe_checkout_session(invoice_data):
+    """
+    Creates a Stripe checkout session for an invoice, or returns the invoice's open
+    session if it is for the same amount and not about to expire.
+
+    """
+    amount = int(invoice_data["totalAmount"] * 100)
+
+    def _create():
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=STRIPE_SESSION_TTL_SECONDS)
         session = stripe.checkout.Session.create(
             payment_method_types=["card"],
             line_items=[
@@ -34,7 +172,7 @@ def create_stripe_checkout_session(invoice_data):
                     "price_data":{
                         "currency": "inr",
                         "product_data": {"name": f"Invoice {invoice_data['invoice_number']}"},
-                        "unit_amount": int(invoice_data["totalAmount"] * 100),
+                        "unit_amount": amount,
                     },
                     "quantity": 1,
                 }
@@ -42,25 +180,43 @@ def create_stripe_checkout_session(invoice_data):
             mode="payment",
             success_url=f"{os.getenv('FRONTEND_URL')}/payment-success?session_id={{CHECKOUT_SESSION_ID}}",
             cancel_url=f"{os.getenv('FRONTEND_URL')}/payment-failed",
-            metadata={"invoice_id": invoice_data["invoice_number"]},
+            expires_at=int(expires_at.timestamp()),
+            # Read back by the checkout.session.completed webhook to locate the invoice
+            metadata={
+                "invoice_id": invoice_data["invoice_number"],
+                "company_id": invoice_data.get("companyId"),
+                "tenant_id": invoice_data.get("tenant_id") or "default",
+            },
         )
-        return {"checkout_url": session.url}
+        return session.id, {"checkout_url": session.url}, expires_at
+
+    try:
+        return _get_or_create_intent(invoice_data, "stripe", amount, "inr", _create)
     except Exception as e:
         raise Exception(f"Stripe session creation failed: {e}")
     
 def create_razorpay_order(invoice_data):
-    try:
+    """
+    Creates a Razorpay order for an invoice, or returns the invoice's open order if it
+    is for the same amount and was created less than RAZORPAY_ORDER_REUSE_SECONDS ago.
+    """
+    amount = int(invoice_data["totalAmount"] * 100)
+
+    def _create():
         order = razorpay_client.order.create({
-            "amount": int(invoice_data["totalAmount"] * 100),
+            "amount": amount,
             "currency": "INR",
             "receipt": invoice_data["invoice_number"],
             "notes": {
                 "invoice_id": invoice_data["invoice_number"],
                 "company_id": invoice_data.get("companyId"),
-                "tenant_id": invoice_data.get("tenant_id", "default"),
+                "tenant_id": invoice_data.get("tenant_id") or "default",
             }
         })
-        return order
+        return order["id"], order, datetime.now(timezone.utc) + timedelta(seconds=RAZORPAY_ORDER_REUSE_SECONDS)
+
+    try:
+        return _get_or_create_intent(invoice_data, "razorpay", amount, "INR", _create)
     except Exception as e:
         raise Exception(f"Razorpay order creation failed: {e}")
 
@@ -114,11 +270,14 @@ def verify_razorpay_payment(
     invoice_data: dict,
     company_id: str,
     tenant_id: str | None,
-    invoice_id: str
+    invoice_id: str,
+    invoice_update_time=None
 ) -> dict:
     """
-    Verifies Razorpay payment signature and processes the payment.
+    Verifies Razorpay payment signature and records the payment.
     This is the main function called after a successful Razorpay payment.
+    The receipt is rendered and emailed by a receipt job (see receipt_job_service);
+    the returned receipt_job_id can be polled for its status.
     
     Args:
         razorpay_payment_id: Payment ID from Razorpay
@@ -128,6 +287,7 @@ def verify_razorpay_payment(
         company_id: Company ID
         tenant_id: Tenant ID (optional)
         invoice_id: Invoice ID
+        invoice_update_time: Update time of the document invoice_data was read from
         
     Returns:
         dict: Result of payment processing
@@ -153,7 +313,7 @@ def verify_razorpay_payment(
         
         print("✅ Signature verified - Payment is authentic")
         
-        # 2️⃣ Prepare payment data for receipt generation
+        # 2️⃣ Prepare payment data
         payment_info = {
             **invoice_data,  # Include all invoice data
             "invoice_number": invoice_id,
@@ -166,27 +326,27 @@ def verify_razorpay_payment(
             "payment_mode": "Razorpay",
         }
         
-        print("📧 Generating and sending payment receipt...")
-        
-        # 3️⃣ Generate receipt, email it, and update database
-        result = generate_payment_receipt(payment_info)
-        
-        if result.get("status") == "success":
-            print("✅ Payment processed successfully!")
-            print("=" * 50)
+        # 3️⃣ Record the payment; the receipt PDF and email are produced by a background job
+        receipt = record_payment(payment_info, invoice_update_time)
+        if receipt is None:
             return {
-                "status": "success",
-                "message": "Payment verified and processed successfully",
+                "status": "already_paid",
+                "message": "This invoice has already been paid",
                 "invoice_id": invoice_id,
-                "payment_id": razorpay_payment_id,
-                "receipt_pdf": result.get("receipt_pdf")
-            }
-        else:
-            print(f"⚠️ Receipt generation failed: {result.get('message')}")
-            return {
-                "status": "error",
-                "message": f"Payment verified but receipt generation failed: {result.get('message')}"
             }
+        receipt_job_id = enqueue_receipt_job(receipt)
+
+        print("✅ Payment processed successfully!")
+        print("=" * 50)
+        return {
+            "status": "success",
+            "message": "Payment verified and recorded. The receipt will be emailed shortly.",
+            "invoice_id": invoice_id,
+            "payment_id": razorpay_payment_id,
+            "payment_status": receipt["payment_status"],
+            "receipt_job_id": receipt_job_id,
+            "receipt_status": "queued",
+        }
             
     except Exception as e:
         print(f"❌ Error processing payment: {e}")
@@ -198,98 +358,183 @@ def verify_razorpay_payment(
         }
 
 
-def generate_payment_receipt(payment_data: dict):
+def record_payment(payment_data: dict, invoice_update_time=None) -> dict:
     """
-    Generates a payment receipt PDF and emails it to the client.
-    Reuses the generic PDF and mailer services.
+    Records the payment (payment record + invoice status, committed together).
+
+    payment_data is the loaded invoice plus the payment fields. Given the update time of
+    the document the invoice was read from, whether it is still unpaid and its dueDate
+    ("paid" vs "due_paid") are decided on that copy, and the commit only succeeds if the
+    stored invoice is unchanged (see bill_repo.commit_payment); otherwise the stored
+    invoice is read when committing.
+
+    Returns:
+        dict | None: Receipt details for send_payment_receipt(), including the new
+        payment_status, or None if the invoice was already paid (nothing recorded)
     """
-    try:
-        company_info = payment_data.get("companyInfo", {})
-        recipient_email = company_info.get("billingEmail")
-        company_name = company_info.get("legalName", "Valued Client")
-        invoice_number = payment_data.get("invoice_number")
-        payment_id = payment_data.get("payment_id")
-        payment_date = payment_data.get("payment_date", datetime.utcnow().isoformat())
-        total_amount = payment_data.get("totalAmount", 0)
-        payment_mode = payment_data.get("payment_mode", "Online")
-        currency = payment_data.get("currency", "INR")
-        companyId = payment_data.get("companyId")
-        tenant_id = payment_data.get("tenant_id")  # 🔧 FIX: Extract tenant_id
-
-        print(f"📄 Generating receipt for invoice {invoice_number}")
-        print(f"   Company: {company_name}")
-        print(f"   Company ID: {companyId}")
-        print(f"   Tenant ID: {tenant_id}")  # 🔧 FIX: Log tenant_id
-        print(f"   Amount: {total_amount} {currency}")
-        print(f"   Payment ID: {payment_id}")
-
-        # --- 1️⃣ Generate PDF ---
-        receipt_data = {
-            "receipt_number": f"RCPT-{payment_id}",
-            "invoice_number": invoice_number,
-            "company_name": company_name,
-            "amount_paid": total_amount,
-            "currency_symbol": "₹" if currency == "INR" else currency,
-            "payment_mode": payment_mode,
-            "payment_date": payment_date[:10],
-            "authorized_signatory": {
-                "name": "Shashank Trivedi",
-                "designation": "Director",
-                "company": "VYSEDECK AI Ventures Pvt Ltd"
-            }
-        }
+    company_info = payment_data.get("companyInfo", {})
+    receipt = {
+        "invoice_number": payment_data.get("invoice_number"),
+        "payment_id": payment_data.get("payment_id"),
+        "payment_date": payment_data.get("payment_date", datetime.utcnow().isoformat()),
+        "total_amount": payment_data.get("totalAmount", 0),
+        "payment_mode": payment_data.get("payment_mode", "Online"),
+        "currency": payment_data.get("currency", "INR"),
+        "company_name": company_info.get("legalName", "Valued Client"),
+        "recipient_email": company_info.get("billingEmail"),
+        "companyId": payment_data.get("companyId"),
+        "tenant_id": payment_data.get("tenant_id"),
+    }
+
+    print(f"💳 Recording payment for invoice {receipt['invoice_number']}")
+    print(f"   Company ID: {receipt['companyId']}")
+    print(f"   Tenant ID: {receipt['tenant_id']}")
+    print(f"   Amount: {receipt['total_amount']} {receipt['currency']}")
+    print(f"   Payment ID: {receipt['payment_id']}")
+
+    payment_status = commit_payment(receipt["companyId"], {
+        "payment_id": receipt["payment_id"],
+        "invoice_number": receipt["invoice_number"],
+        "amount_paid": receipt["total_amount"],
+        "currency": receipt["currency"],
+        "payment_date": receipt["payment_date"],
+        "payment_mode": receipt["payment_mode"],
+        "razorpay_order_id": payment_data.get("order_id"),
+        "razorpay_signature": payment_data.get("razorpay_signature"),
+    }, tenant_id=receipt["tenant_id"], invoice=payment_data, update_time=invoice_update_time)
+    if payment_status is None:
+        return None
+
+    receipt["payment_status"] = payment_status
+    print(f"✅ Invoice {receipt['invoice_number']} marked as {payment_status}")
+    return receipt
+
+
+def send_payment_receipt(receipt: dict) -> dict:
+    """
+    Generates a payment receipt PDF and emails it to the client (run by the receipt job
+    dispatcher once the payment is recorded). Reuses the generic PDF and mailer services.
+
+    Args:
+        receipt: Receipt details from record_payment()
+
+    Returns:
+        dict: {"receipt_number", "receipt_pdf"}
+    """
+    invoice_number = receipt["invoice_number"]
+    currency = receipt["currency"]
+    print(f"📄 Generating receipt for invoice {invoice_number}")
 
-        pdf_path = generate_pdf("receipt_template.html", receipt_data, prefix="receipt")
-        print(f"✅ PDF generated: {pdf_path}")
-
-        # --- 2️⃣ Send Email ---
-        subject = f"Payment Receipt for Invoice {invoice_number}"
-        context = {
-            "company_name": company_name,
-            "invoice_number": invoice_number,
-            "receipt_number": receipt_data["receipt_number"],
-            "amount_paid": f"{total_amount:,.2f}",
-            "payment_mode": payment_mode,
-            "payment_date": receipt_data["payment_date"],
-            "currency_symbol": receipt_data["currency_symbol"],
-            "sender_email": os.getenv("SENDER_EMAIL"),
-            "payment_url": f"{os.getenv('FRONTEND_URL', 'https://billai.vysedeck.com')}/payments",
+    # --- 1️⃣ Generate PDF ---
+    receipt_data = {
+        "receipt_number": f"RCPT-{receipt['payment_id']}",
+        "invoice_number": invoice_number,
+        "company_name": receipt["company_name"],
+        "amount_paid": receipt["total_amount"],
+        "currency_symbol": "₹" if currency == "INR" else currency,
+        "payment_mode": receipt["payment_mode"],
+        "payment_date": receipt["payment_date"][:10],
+        "authorized_signatory": {
+            "name": "Shashank Trivedi",
+            "designation": "Director",
+            "company": "VYSEDECK AI Ventures Pvt Ltd"
         }
+    }
 
-        send_email(
-            # recipient_email=recipient_email,
-            recipient_email="vishruth.ramesh@vysedeck.com",  # for testing purposes
-            subject=subject,
-            html_template="receipt_email_template.html",
-            context=context,
-            attachments=[pdf_path],
-        )
+    pdf = render_pdf("receipt_template.html", receipt_data, prefix="receipt")
 
-        print(f"✅ Payment receipt emailed successfully to vishruth.ramesh@vysedeck.com")
-
-        # --- 3️⃣ Save COMPLETE Payment Record in payments collection ---
-        # 🔧 FIX: Pass tenant_id to save_payment_record
-        save_payment_record(companyId, {
-            "payment_id": payment_id,
-            "invoice_number": invoice_number,
-            "amount_paid": total_amount,
-            "currency": currency,
-            "payment_date": payment_date,
-            "payment_mode": payment_mode,
-            "razorpay_order_id": payment_data.get("order_id"),
-            "razorpay_signature": payment_data.get("razorpay_signature"),
-        }, tenant_id=tenant_id)
-        print(f"✅ Payment record saved in Firestore")
-
-        # --- 4️⃣ Update ONLY payment_status in invoice ---
-        # 🔧 FIX: Pass tenant_id to mark_invoice_as_paid
-        mark_invoice_as_paid(companyId, invoice_number, {}, tenant_id=tenant_id)
-        print(f"✅ Invoice {invoice_number} marked as paid")
-
-        return {"status": "success", "receipt_pdf": pdf_path}
+    # --- 2️⃣ Send Email ---
+    subject = f"Payment Receipt for Invoice {invoice_number}"
+    context = {
+        "company_name": receipt["company_name"],
+        "invoice_number": invoice_number,
+        "receipt_number": receipt_data["receipt_number"],
+        "amount_paid": f"{receipt['total_amount']:,.2f}",
+        "payment_mode": receipt["payment_mode"],
+        "payment_date": receipt_data["payment_date"],
+        "currency_symbol": receipt_data["currency_symbol"],
+        "sender_email": os.getenv("SENDER_EMAIL"),
+        "payment_url": f"{os.getenv('FRONTEND_URL', 'https://billai.vysedeck.com')}/payments",
+    }
 
-    except Exception as e:
-        print(f"❌ Failed to process payment receipt: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+    # Queued, so the receipt job doesn't wait on Postmark
+    enqueue_email(
+        # recipient_email=receipt["recipient_email"],
+        recipient_email="vishruth.ramesh@vysedeck.com",  # for testing purposes
+        subject=subject,
+        html_template="receipt_email_template.html",
+        context=context,
+        attachments=[pdf],
+        metadata={"invoice_number": invoice_number},
+    )
+
+    print(f"✅ Payment receipt queued for vishruth.ramesh@vysedeck.com")
+
+    return {"receipt_number": receipt_data["receipt_number"], "receipt_pdf": pdf["path"] or pdf["name"]}
+
+
+# ================== WEBHOOK EVENT HANDLERS (run by the webhook inbox) ==================
+def _process_webhook_payment(provider: str, company_id: str, tenant_id: str | None, invoice_id: str, payment_fields: dict) -> dict:
+    """
+    Records a payment reported by a webhook and queues its receipt, unless the invoice is
+    already paid (e.g. by /verify-payment or an earlier delivery of the same payment).
+
+    Raises on failures worth retrying; the inbox retries the event with backoff.
+    """
+    if tenant_id == "default":
+        tenant_id = None
+
+    print(f"📋 {provider} payment for invoice {invoice_id} (company {company_id}, tenant {tenant_id})")
+
+    invoice, invoice_update_time = get_invoice_with_update_time(company_id, tenant_id, invoice_id)
+    if not invoice:
+        print(f"❌ Invoice {invoice_id} not found")
+        return {"status": "invoice_not_found", "invoice_id": invoice_id}
+
+    # Check if already paid (to avoid duplicate processing); the cached invoice may be
+    # stale, which commit_payment() catches through its update time
+    if invoice.get("payment_status") in ["paid", "due_paid"]:
+        print(f"⚠️ Invoice {invoice_id} already marked as paid - skipping webhook processing")
+        return {"status": "already_processed", "invoice_id": invoice_id}
+
+    payment_info = {
+        **invoice,  # Spread invoice data
+        "invoice_number": invoice_id,
+        "companyId": company_id,
+        "tenant_id": tenant_id,
+        "payment_date": datetime.utcnow().isoformat(),
+        **payment_fields,
+    }
+
+    receipt = record_payment(payment_info, invoice_update_time)
+    if receipt is None:
+        print(f"⚠️ Invoice {invoice_id} was paid in the meantime - skipping webhook processing")
+        return {"status": "already_processed", "invoice_id": invoice_id}
+    return {"status": "success", "invoice_id": invoice_id, "receipt_job_id": enqueue_receipt_job(receipt)}
+
+
+def process_razorpay_payment_captured(event: dict) -> dict:
+    """Handles a Razorpay payment.captured webhook event (the backup to /verify-payment)."""
+    payment = event["payload"]["payment"]["entity"]
+    notes = payment.get("notes") or {}
+    return _process_webhook_payment("Razorpay", notes.get("company_id"), notes.get("tenant_id"), notes.get("invoice_id"), {
+        "payment_id": payment["id"],
+        "order_id": payment.get("order_id"),
+        "payment_mode": "Razorpay",
+    })
+
+
+def process_stripe_checkout_completed(event: dict) -> dict:
+    """Handles a Stripe checkout.session.completed webhook event."""
+    session = event["data"]["object"]
+    if session.get("payment_status") != "paid":
+        # Delayed payment methods complete the session before the money arrives
+        print(f"ℹ️ Stripe session {session.get('id')} completed with payment_status={session.get('payment_status')}")
+        return {"status": "ignored", "payment_status": session.get("payment_status")}
+
+    metadata = session.get("metadata") or {}
+    return _process_webhook_payment("Stripe", metadata.get("company_id"), metadata.get("tenant_id"), metadata.get("invoice_id"), {
+        "payment_id": session.get("payment_intent") or session["id"],
+        "payment_mode": "Stripe",
+        "currency": (session.get("currency") or "inr").upper(),
+    })
@@ -0,0 +1,151 @@
+# services/pdf_cache.py
+"""
+Content-addressed cache of rendered PDFs.
+
+A PDF is keyed by a SHA-256 over the template name, the template file's content
+hash and the canonical JSON of the render data. Only the variables the template
+actually references are hashed, so bookkeeping fields (createdAt, reminder state,
+document IDs) don't split entries and the same invoice rendered for the original
+send, a re-send or a reminder maps to the same entry. Entries
+live on disk under invoices/.pdf_cache and are evicted least-recently-used once
+the cache grows past PDF_CACHE_MAX_BYTES.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from jinja2 import meta
+from services.template_registry import TEMPLATE_DIR, get_environment
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "../invoices/.pdf_cache")
+
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "1") == "1"
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_entries = None  # OrderedDict key -> size in bytes, least recently used first
+_total_bytes = 0
+_template_versions = {}  # template name -> ((mtime_ns, size), content hash, referenced variables)
+
+
+def _template_version(template_name: str) -> tuple[str, frozenset]:
+    """
+    Content hash and top-level variables of a template file,
+    recomputed only when its mtime or size changes.
+    """
+    path = os.path.join(TEMPLATE_DIR, template_name)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _template_versions.get(template_name)
+    if cached and cached[0] == stamp:
+        return cached[1], cached[2]
+    with open(path, "rb") as f:
+        source = f.read()
+    version = hashlib.sha256(source).hexdigest()
+    variables = frozenset(meta.find_undeclared_variables(get_environment().parse(source.decode("utf-8"))))
+    _template_versions[template_name] = (stamp, version, variables)
+    return version, variables
+
+
+def pdf_cache_key(template_name: str, data: dict) -> str:
+    """
+    Stable cache key of a render.
+
+    Args:
+        template_name: HTML template file in /templates.
+        data: Dictionary of template variables.
+
+    Returns:
+        str: Hex SHA-256 of template name, template version and the canonical rendered data
+    """
+    version, variables = _template_version(template_name)
+    rendered_data = {name: value for name, value in data.items() if name in variables}
+    canonical = json.dumps(rendered_data, sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.sha256()
+    for part in (template_name, version, canonical):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.pdf")
+
+
+def _load_index():
+    """Builds the LRU index from the cache directory (oldest access first). Caller holds _lock."""
+    global _entries, _total_bytes
+    if _entries is not None:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    files = []
+    for entry in os.scandir(CACHE_DIR):
+        if entry.is_file() and entry.name.endswith(".pdf"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+    files.sort()
+    _entries = OrderedDict((key, size) for _, key, size in files)
+    _total_bytes = sum(_entries.values())
+
+
+def _evict():
+    """Drops least recently used entries until the cache fits its size bound. Caller holds _lock."""
+    global _total_bytes
+    while _total_bytes > PDF_CACHE_MAX_BYTES and _entries:
+        key, size = _entries.popitem(last=False)
+        _total_bytes -= size
+        try:
+            os.remove(_entry_path(key))
+        except FileNotFoundError:
+            pass
+
+
+def load_cached_pdf(key: str) -> bytes | None:
+    """
+    Reads a cached PDF.
+
+    Returns:
+        bytes | None: The PDF on a cache hit, None when the key is not cached
+    """
+    global _total_bytes
+    with _lock:
+        _load_index()
+        if key not in _entries:
+            return None
+        _entries.move_to_end(key)
+
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        # mtime doubles as the last-access time when the index is rebuilt after a restart
+        os.utime(path)
+        return content
+    except FileNotFoundError:
+        with _lock:
+            _total_bytes -= _entries.pop(key, 0)
+        return None
+
+
+def store_pdf(key: str, content: bytes):
+    """Adds a rendered PDF to the cache and evicts old entries if needed."""
+    global _total_bytes
+    path = _entry_path(key)
+    with _lock:
+        _load_index()
+        if key in _entries:
+            _entries.move_to_end(key)
+            return
+
+    # Write under a temporary name so readers never see a partial file
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+    with _lock:
+        if key not in _entries:
+            _entries[key] = len(content)
+            _total_bytes += len(content)
+            _evict()
@@ -0,0 +1,111 @@
+# services/pdf_render_pool.py
+"""
+Warm WeasyPrint rendering pool.
+
+WeasyPrint layout is CPU-bound and holds the GIL, so rendering in the calling
+thread uses a single core. This module keeps a pool of long-lived worker
+processes that preload the Jinja templates, the font configuration and the
+WeasyPrint/Pango stack once, then accept render jobs.
+
+- Jobs return PDF bytes, or write to a file path and return the path.
+- A crashed worker (BrokenProcessPool) replaces the pool and the job is retried once.
+- Each worker process is replaced after PDF_RENDER_MAX_JOBS_PER_WORKER jobs to bound memory
+  (max_tasks_per_child), without restarting the rest of the pool.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+RENDER_POOL_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(os.cpu_count() or 2)))
+RENDER_POOL_MAX_JOBS_PER_WORKER = int(os.getenv("PDF_RENDER_MAX_JOBS_PER_WORKER", "200"))
+RENDER_JOB_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT_SECONDS", "120"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# --- Worker process state (populated by _init_worker) ---
+_worker_font_config = None
+
+
+def _init_worker():
+    """Runs once per worker process: preloads templates, fonts and the WeasyPrint stack."""
+    global _worker_font_config
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+    from services.template_registry import precompile_templates
+
+    # Loads from the registry's on-disk bytecode cache when the parent already compiled them
+    precompile_templates()
+
+    _worker_font_config = FontConfiguration()
+    # A throwaway render loads Pango/fontconfig and the default stylesheets up front
+    HTML(string="<p>warm-up</p>").write_pdf(font_config=_worker_font_config)
+
+
+def _render_job(template_name: str, data: dict, output_path: str | None):
+    """Runs inside a worker process."""
+    from weasyprint import HTML
+    from services.template_registry import render_template
+
+    html_content = render_template(template_name, data)
+    document = HTML(string=html_content)
+    if output_path:
+        document.write_pdf(output_path, font_config=_worker_font_config)
+        return output_path
+    return document.write_pdf(font_config=_worker_font_config)
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    # "spawn" keeps workers independent of the parent's threads and Firestore/gRPC state
+    return ProcessPoolExecutor(
+        max_workers=RENDER_POOL_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        max_tasks_per_child=RENDER_POOL_MAX_JOBS_PER_WORKER,
+    )
+
+
+def _acquire_pool(broken: ProcessPoolExecutor | None = None) -> ProcessPoolExecutor:
+    """Returns the shared pool, creating it on first use or replacing it after a crash."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool is broken:
+            _pool.shutdown(wait=False)
+            print("⚠️ Replacing broken PDF render pool")
+            _pool = None
+        if _pool is None:
+            _pool = _new_pool()
+        return _pool
+
+
+def render_pdf_in_pool(template_name: str, data: dict, output_path: str | None = None):
+    """
+    Renders a template to PDF on the warm process pool.
+
+    Args:
+        template_name: HTML template file in /templates.
+        data: Dictionary of template variables (must be picklable).
+        output_path: If given, the PDF is written there and the path is returned.
+
+    Returns:
+        bytes | str: PDF bytes, or output_path when provided.
+    """
+    pool = _acquire_pool()
+    try:
+        return pool.submit(_render_job, template_name, data, output_path).result(timeout=RENDER_JOB_TIMEOUT)
+    except BrokenProcessPool:
+        # A worker died mid-job (e.g. crashed in native code); retry once on a fresh pool.
+        # Only the pool that broke is replaced, so concurrent failures don't replace each other's.
+        return _acquire_pool(broken=pool).submit(_render_job, template_name, data, output_path).result(timeout=RENDER_JOB_TIMEOUT)
+
+
+def shutdown_render_pool():
+    """Stops the worker processes. Called on application shutdown."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+            print("✅ PDF render pool stopped")
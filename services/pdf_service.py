@@ -1,17 +1,22 @@
 # services/pdf_service.py
 import os
-from jinja2 import Environment, FileSystemLoader
 from weasyprint import HTML
 from datetime import datetime
+from services.pdf_cache import PDF_CACHE_ENABLED, pdf_cache_key, load_cached_pdf, store_pdf
+from services.template_registry import render_template
+from utils.artifacts import make_artifact, persist_artifact
 
-TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "../templates")
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "../invoices")
 
+# Render on the warm worker pool (services/pdf_render_pool.py); set to "0" to render in-process
+USE_RENDER_POOL = os.getenv("PDF_RENDER_POOL", "1") == "1"
+
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def generate_pdf(template_name: str, data: dict, prefix: str = "document") -> str:
+def render_pdf(template_name: str, data: dict, prefix: str = "document") -> dict:
     """
-    Generic PDF generator using Jinja2 and WeasyPrint.
+    Renders a PDF in memory using Jinja2 (shared template registry) and WeasyPrint.
+    The PDF is also written to /invoices when the disk sink is enabled (ARTIFACT_DISK_SINK).
 
     Args:
         template_name: HTML template file in /templates.
@@ -19,21 +24,53 @@ def generate_pdf(template_name: str, data: dict, prefix: str = "document") -> st
         prefix: 'invoice', 'receipt', etc.
 
     Returns:
-        str: Path to generated PDF file.
+        dict: PDF artifact {"name", "content" (bytes), "content_type", "path"}
     """
     try:
-        env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
-        template = env.get_template(template_name)
-        html_content = template.render(**data)
-
         # Generate safe filename
         doc_id = data.get("invoice_number") or data.get("receipt_number") or datetime.now().isoformat()
         safe_name = doc_id.replace(":", "-").replace("/", "-")
         file_name = f"{prefix}_{safe_name}.pdf"
         file_path = os.path.join(OUTPUT_DIR, file_name)
 
-        HTML(string=html_content).write_pdf(file_path)
-        print(f"✅ PDF generated: {file_path}")
-        return file_path
+        cache_key = pdf_cache_key(template_name, data) if PDF_CACHE_ENABLED else None
+        content = load_cached_pdf(cache_key) if cache_key else None
+
+        if content is not None:
+            print(f"✅ PDF served from cache: {file_name}")
+        else:
+            if USE_RENDER_POOL:
+                from services.pdf_render_pool import render_pdf_in_pool
+                content = render_pdf_in_pool(template_name, data)
+            else:
+                html_content = render_template(template_name, data)
+                content = HTML(string=html_content).write_pdf()
+
+            if cache_key:
+                store_pdf(cache_key, content)
+            print(f"✅ PDF generated: {file_name}")
+
+        return persist_artifact(make_artifact(file_name, content, "application/pdf"), file_path)
     except Exception as e:
         raise RuntimeError(f"Failed to generate {prefix} PDF: {e}")
+
+
+def generate_pdf(template_name: str, data: dict, prefix: str = "document") -> str:
+    """
+    Generic PDF generator that always writes the PDF to /invoices.
+
+    Args:
+        template_name: HTML template file in /templates.
+        data: Dictionary of template variables.
+        prefix: 'invoice', 'receipt', etc.
+
+    Returns:
+        str: Path to generated PDF file.
+    """
+    artifact = render_pdf(template_name, data, prefix)
+    if artifact["path"] is None:
+        file_path = os.path.join(OUTPUT_DIR, artifact["name"])
+        with open(file_path, "wb") as f:
+            f.write(artifact["content"])
+        artifact["path"] = file_path
+    return artifact["path"]
@@ -0,0 +1,95 @@
+# services/receipt_job_service.py
+"""
+Deferred payment receipts.
+
+Once a payment is committed, its receipt (PDF render + email) is queued as a job
+(enqueue_receipt_job) instead of being produced inside the request, so the payer gets
+their answer as soon as the payment is recorded. Clients poll get_receipt_status().
+
+A dispatcher (utils/local_queue.py), started with the app, runs the jobs with at most
+RECEIPT_WORKERS in flight, retrying failures with backoff.
+"""
+import os
+
+from utils.local_queue import LocalQueue, handle_each
+
+RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", "2"))
+RECEIPT_MAX_ATTEMPTS = int(os.getenv("RECEIPT_MAX_ATTEMPTS", "5"))
+RECEIPT_BACKOFF_BASE_SECONDS = float(os.getenv("RECEIPT_BACKOFF_BASE_SECONDS", "10"))
+RECEIPT_BACKOFF_MAX_SECONDS = float(os.getenv("RECEIPT_BACKOFF_MAX_SECONDS", "600"))
+RECEIPT_POLL_SECONDS = float(os.getenv("RECEIPT_POLL_SECONDS", "2"))
+
+# Job states as reported to clients
+_PUBLIC_STATUS = {"pending": "queued", "processing": "processing", "done": "completed", "dead": "failed"}
+
+# One job per payment: keyed by payment ID
+_receipts = LocalQueue(
+    "Receipts",
+    "receipt_jobs",
+    workers=RECEIPT_WORKERS,
+    max_attempts=RECEIPT_MAX_ATTEMPTS,
+    backoff_base_seconds=RECEIPT_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=RECEIPT_BACKOFF_MAX_SECONDS,
+    poll_seconds=RECEIPT_POLL_SECONDS,
+    dedupe=True,
+)
+
+
+def enqueue_receipt_job(receipt: dict) -> int:
+    """
+    Queues the receipt of a committed payment.
+
+    Args:
+        receipt: Receipt details from payment_service.record_payment()
+
+    Returns:
+        int: Job ID (the existing job's ID if this payment's receipt was already queued)
+    """
+    job_id, _ = _receipts.enqueue(receipt, key=receipt["payment_id"])
+    print(f"🧾 Receipt for invoice {receipt['invoice_number']} queued (job #{job_id})")
+    return job_id
+
+
+def get_receipt_status(job_id: int) -> dict | None:
+    """
+    Client-facing status of a receipt job.
+
+    Returns:
+        dict: {"job_id", "invoice_id", "payment_id", "status", ...} or None if there is no such job.
+        status is "queued", "processing", "completed" (receipt emailed; receipt_number and
+        receipt_pdf set) or "failed" (error set).
+    """
+    job = _receipts.get(job_id)
+    if job is None:
+        return None
+    receipt = job["payload"]
+    status = {
+        "job_id": job["id"],
+        "company_id": receipt["companyId"],
+        "tenant_id": receipt.get("tenant_id"),
+        "invoice_id": receipt["invoice_number"],
+        "payment_id": receipt["payment_id"],
+        "status": _PUBLIC_STATUS.get(job["status"], job["status"]),
+        "attempts": job["attempts"],
+    }
+    if job["result"]:
+        status.update(job["result"])
+    if job["status"] == "dead":
+        status["error"] = job["last_error"]
+    return status
+
+
+def _send_receipt(receipt: dict) -> dict:
+    # Imported lazily: payment_service pulls in the provider SDKs and the PDF stack
+    from services.payment_service import send_payment_receipt
+    return send_payment_receipt(receipt)
+
+
+def start_receipt_dispatcher():
+    """Starts the dispatcher on the running event loop (called from the app lifespan)."""
+    _receipts.start(handle_each(_send_receipt))
+
+
+async def stop_receipt_dispatcher():
+    """Stops the dispatcher after its in-flight receipts finish."""
+    await _receipts.stop()
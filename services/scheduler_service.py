@@ -3,6 +3,7 @@ Background Scheduler Service for Invoice Management
 
 This service runs scheduled tasks automatically:
 - Updates overdue invoices from 'pending' to 'due' daily at midnight
+- Writes daily usage rollups for the previous UTC day
 """
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -28,7 +29,7 @@ def update_overdue_invoices_job():
         result = update_all_overdue_invoices()
         
         print(f"✅ Scheduled task completed:")
-        print(f"   - Companies processed: {result.get('companies_processed', 0)}")
+        print(f"   - Companies with overdue invoices: {result.get('companies_processed', 0)}")
         print(f"   - Invoices updated: {result.get('total_updated', 0)}")
         print(f"   - Invoices skipped: {result.get('total_skipped', 0)}")
         
@@ -58,6 +59,28 @@ def check_payment_reminders_job():
         print(f"❌ Error in scheduled task 'check_payment_reminders_job': {e}")
 
 
+def daily_usage_rollup_job():
+    """
+    Scheduled job that runs daily once the UTC day has closed.
+    Writes per-company and per-tenant usage rollups for the previous UTC day,
+    so month-end billing can sum ~30 rollups instead of scanning every call.
+    """
+    try:
+        print(f"\n🕐 [{datetime.now()}] Running scheduled task: Daily Usage Rollup")
+        
+        from services.usage_rollup_service import run_daily_rollups
+        
+        result = run_daily_rollups()
+        
+        print(f"✅ Scheduled task completed:")
+        print(f"   - Day rolled up: {result.get('date')}")
+        print(f"   - Companies processed: {result.get('companies_processed', 0)}")
+        print(f"   - Rollups written: {result.get('rollups_written', 0)}")
+        
+    except Exception as e:
+        print(f"❌ Error in scheduled task 'daily_usage_rollup_job': {e}")
+
+
 def start_scheduler(run_on_startup=False):
     """
     Initializes and starts the background scheduler.
@@ -104,6 +127,16 @@ def start_scheduler(run_on_startup=False):
             misfire_grace_time=3600  # If missed, can run within 1 hour
         )
         
+        # Schedule: Roll up the previous UTC day at 6:00 AM IST (the UTC day closes at 05:30 IST)
+        scheduler.add_job(
+            func=daily_usage_rollup_job,
+            trigger=CronTrigger(hour=6, minute=0, timezone='Asia/Kolkata'),
+            id='daily_usage_rollup',
+            name='Write Daily Usage Rollups',
+            replace_existing=True,
+            misfire_grace_time=3600  # If missed, can run within 1 hour
+        )
+        
         # Start the scheduler
         scheduler.start()
         
@@ -111,6 +144,7 @@ def start_scheduler(run_on_startup=False):
         print("📅 Scheduled Tasks:")
         print("   - Update Overdue Invoices: Daily at 00:00 IST (midnight)")
         print("   - Check Payment Reminders: Daily at 09:00 IST")
+        print("   - Daily Usage Rollup: Daily at 06:00 IST")
         for job in scheduler.get_jobs():
             print(f"   - {job.name}: Next run at {job.next_run_time}")
         print("\n💡 TIP: To disable startup update, set run_on_startup=False in main.py\n")
@@ -0,0 +1,89 @@
+# services/template_registry.py
+"""
+Shared registry of compiled Jinja templates.
+
+pdf_service, mailer_service and the PDF render workers all render through one
+Environment, so each template in templates/ is parsed and compiled once per
+process instead of once per PDF or email. Compiled bytecode is also persisted
+on disk, which lets new processes (render workers, the CLI) skip compilation.
+
+Set TEMPLATE_HOT_RELOAD=1 to pick up edited templates without a restart
+(Jinja re-checks the file mtime on every lookup).
+"""
+import os
+import tempfile
+import threading
+import time
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "../templates")
+BYTECODE_CACHE_DIR = os.getenv(
+    "TEMPLATE_BYTECODE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "billing-jinja-bytecode")
+)
+HOT_RELOAD = os.getenv("TEMPLATE_HOT_RELOAD", "0") == "1"
+
+os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    bytecode_cache=FileSystemBytecodeCache(BYTECODE_CACHE_DIR),
+    auto_reload=HOT_RELOAD,
+)
+
+_stats_lock = threading.Lock()
+_render_stats = {}  # template name -> {"renders", "total_seconds", "max_seconds"}
+
+
+def get_environment() -> Environment:
+    """The shared Jinja environment."""
+    return _env
+
+
+def precompile_templates() -> list[str]:
+    """
+    Compiles every HTML template up front so the first render pays no compile cost.
+
+    Returns:
+        list: Names of the compiled templates
+    """
+    names = _env.list_templates(extensions=["html"])
+    for name in names:
+        _env.get_template(name)
+    return names
+
+
+def render_template(template_name: str, context: dict) -> str:
+    """
+    Renders a template from the registry and records its render time.
+
+    Args:
+        template_name: HTML template file in /templates.
+        context: Dictionary of template variables.
+
+    Returns:
+        str: Rendered HTML
+    """
+    start = time.perf_counter()
+    html = _env.get_template(template_name).render(**context)
+    elapsed = time.perf_counter() - start
+
+    with _stats_lock:
+        stats = _render_stats.setdefault(template_name, {"renders": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["renders"] += 1
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+    return html
+
+
+def get_render_stats() -> dict:
+    """Per-template render counts and timings (seconds) for this process."""
+    with _stats_lock:
+        return {
+            name: {
+                "renders": s["renders"],
+                "total_seconds": round(s["total_seconds"], 6),
+                "avg_seconds": round(s["total_seconds"] / s["renders"], 6),
+                "max_seconds": round(s["max_seconds"], 6),
+            }
+            for name, s in _render_stats.items()
+        }
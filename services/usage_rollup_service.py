@@ -0,0 +1,429 @@
+# services/usage_rollup_service.py
+"""
+Daily usage rollups.
+
+Once a UTC day has closed, the rollup job scans that day's calls for a company
+once, splits them by tenant and stores, for the company and for every tenant:
+- a rollup document (call count, total seconds, ceil-billed minutes, histogram)
+- the day's detailed CSV rows as fragments (one per call source), stored in
+  Firestore with the rollup so every billing host can use them
+
+Month-end billing then sums ~30 rollups and splices the fragments into the
+call log CSV, falling back to raw calls only for days that have no rollup.
+
+Calls can land after their day was rolled up (delayed ingestion, replays), so
+each run also re-counts the previous ROLLUP_RECHECK_DAYS days and rolls up again
+any day whose stored call count no longer matches.
+"""
+import io
+import os
+from datetime import date, datetime, timedelta, timezone
+from itertools import chain
+from typing import Iterable, Iterator
+
+from repositories.callLogs_repo import (
+    CSV_CALL_FIELDS,
+    count_calls_from_top_level,
+    count_calls_from_company_doc,
+    get_calls_from_top_level,
+    get_calls_from_company_doc,
+    stream_calls_from_top_level,
+    stream_calls_from_company_doc,
+)
+from repositories.companies_repo import get_all_companies, get_company_billing_details, get_tenants
+from repositories.usage_rollup_repo import (
+    save_daily_rollups,
+    get_rollups_for_period,
+    get_rollups_for_tenants,
+    get_rollup_fragments,
+)
+from services.csv_service import write_call_log_fragment
+from services.usage_aggregation import partition_calls_by_tenant, call_day_index
+from utils.date_utils import _get_date_format_for_tz
+
+# Closed days before the one being rolled up that are re-counted for late calls
+ROLLUP_RECHECK_DAYS = int(os.getenv("ROLLUP_RECHECK_DAYS", "3"))
+# Fragments fetched per read while building a call log CSV
+ROLLUP_FRAGMENT_PREFETCH = int(os.getenv("ROLLUP_FRAGMENT_PREFETCH", "8"))
+
+# Call sources, in the order their rows appear in the call log CSV
+CALL_SOURCES = {
+    "top": stream_calls_from_top_level,
+    "nested": stream_calls_from_company_doc,
+}
+# Call counts per source, used to detect days that received calls after their rollup
+CALL_COUNTS = {
+    "top": count_calls_from_top_level,
+    "nested": count_calls_from_company_doc,
+}
+
+
+def day_window(day: date) -> tuple[datetime, datetime]:
+    """
+    UTC window of a day. The end is the last whole second of the day, matching how
+    billing periods end, so rollups cover exactly the calls a monthly scan would.
+    """
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1) - timedelta(seconds=1)
+
+
+def rollup_company_day(company_id: str, day: date) -> dict:
+    """
+    Writes the daily rollups of a company and all its tenants for a closed day.
+
+    Args:
+        company_id: Company whose calls are rolled up
+        day: UTC day to roll up (must be before today)
+
+    Returns:
+        dict: Summary with the number of rollups written and calls seen
+    """
+    if day >= datetime.now(timezone.utc).date():
+        raise ValueError(f"Cannot roll up {day.isoformat()}: the day has not closed yet")
+
+    start, end = day_window(day)
+
+    # One scan per source for the whole company; a single day is small enough to hold
+    calls = {
+        "top": get_calls_from_top_level(company_id, start, end, fields=CSV_CALL_FIELDS),
+        "nested": get_calls_from_company_doc(company_id, start, end, fields=CSV_CALL_FIELDS),
+    }
+    by_tenant = {source: partition_calls_by_tenant(source_calls) for source, source_calls in calls.items()}
+
+    # (tenant_id, calls per source); None is the company itself, covering all of its calls
+    entities = [(None, calls)]
+    for tenant_id in get_tenants(company_id):
+        entities.append((tenant_id, {source: by_tenant[source].get(tenant_id, []) for source in CALL_SOURCES}))
+
+    entries = []
+    for tenant_id, entity_calls in entities:
+        details = get_company_billing_details(company_id=company_id, tenant_id=tenant_id) or {}
+        tzone = details.get("tzone")
+
+        sources, fragments = {}, {}
+        for source in CALL_SOURCES:
+            out = io.StringIO(newline='')
+            sources[source] = write_call_log_fragment(entity_calls[source], out, day, tzone)
+            fragments[source] = out.getvalue().encode("utf-8")
+        entries.append((company_id, tenant_id, day, {
+            "callCount": sum(s["callCount"] for s in sources.values()),
+            "totalSeconds": sum(s["totalSeconds"] for s in sources.values()),
+            "billedMinutes": sum(s["billedMinutes"] for s in sources.values()),
+            "dateFormat": sources["top"]["dateFormat"],
+            "sources": sources,
+            "fragments": fragments,
+        }))
+
+    save_daily_rollups(entries)
+
+    summary = {
+        "company_id": company_id,
+        "date": day.isoformat(),
+        "rollups_written": len(entries),
+        "calls": len(calls["top"]) + len(calls["nested"]),
+    }
+    print(f"📦 Rolled up {summary['calls']} calls for {company_id} on {summary['date']} ({summary['rollups_written']} rollups)")
+    return summary
+
+
+def stale_rollup_days(company_id: str, day: date) -> list[date]:
+    """
+    The ROLLUP_RECHECK_DAYS closed days before `day` whose company rollup is missing or
+    no longer matches the calls stored for that day, e.g. because calls landed after the
+    day was rolled up.
+
+    Returns:
+        list: Days to roll up again, newest first
+    """
+    if ROLLUP_RECHECK_DAYS <= 0:
+        return []
+    last_day = day - timedelta(days=1)
+    first_day = day - timedelta(days=ROLLUP_RECHECK_DAYS)
+    rollups = get_rollups_for_period(company_id, None, first_day, last_day)
+
+    stale = []
+    for i in range(ROLLUP_RECHECK_DAYS):
+        check_day = last_day - timedelta(days=i)
+        rollup = rollups.get(check_day.isoformat())
+        start, end = day_window(check_day)
+        if rollup is None or any(
+            count_fn(company_id, start, end) != rollup["sources"].get(source, {}).get("callCount")
+            for source, count_fn in CALL_COUNTS.items()
+        ):
+            stale.append(check_day)
+    return stale
+
+
+def run_daily_rollups(day: date | None = None) -> dict:
+    """
+    Rolls up a closed day for every company. Defaults to yesterday (UTC).
+    Called by the scheduler once the UTC day has closed; can also be used to backfill.
+
+    The previous ROLLUP_RECHECK_DAYS days are rolled up again where calls were added
+    after their rollup (see stale_rollup_days).
+
+    Returns:
+        dict: Summary of all rollups
+    """
+    day = day or (datetime.now(timezone.utc).date() - timedelta(days=1))
+    companies_processed = 0
+    total_rollups = 0
+    failed = []
+    rerolled = []
+
+    for company_id in get_all_companies():
+        try:
+            result = rollup_company_day(company_id, day)
+            total_rollups += result["rollups_written"]
+            for stale_day in stale_rollup_days(company_id, day):
+                print(f"🔁 Calls changed for {company_id} on {stale_day.isoformat()} since its rollup, rolling up again")
+                result = rollup_company_day(company_id, stale_day)
+                total_rollups += result["rollups_written"]
+                rerolled.append({"company_id": company_id, "date": stale_day.isoformat()})
+            companies_processed += 1
+        except Exception as e:
+            print(f"⚠️ Error rolling up {company_id} for {day.isoformat()}: {e}")
+            failed.append(company_id)
+
+    summary = {
+        "date": day.isoformat(),
+        "companies_processed": companies_processed,
+        "rollups_written": total_rollups,
+        "days_rerolled": rerolled,
+        "failed_companies": failed,
+        "message": f"Rolled up {companies_processed} companies for {day.isoformat()}",
+    }
+    print(f"✅ {summary['message']}")
+    return summary
+
+
+def plan_call_log_segments(
+    company_id: str,
+    tenant_id: str | None,
+    start_date: datetime,
+    end_date: datetime,
+    tzone: str | None,
+    rollups: dict[str, dict] | None = None
+) -> tuple[list[dict], int]:
+    """
+    Plans the segments of an entity's billing CSV (see csv_service.build_call_log_csv):
+    stored fragments for rolled-up days, lazy raw call streams for the remaining day ranges.
+
+    A day counts as rolled up only when its rollup exists, was formatted for the same
+    date format and has its fragments stored with it (rollups written before fragments
+    were stored in Firestore have no fragmentVersion). Fragments are read lazily, a few
+    per read, as the CSV is built.
+
+    Args:
+        company_id: Company whose calls are billed
+        tenant_id: Tenant whose calls are billed, or None for all of the company's calls
+        start_date: Start of the billing period
+        end_date: End of the billing period
+        tzone: Timezone of the billed entity (drives the CSV date format)
+        rollups: The entity's rollups for the period if already fetched (get_rollups_for_period)
+
+    Returns:
+        tuple: (segments, number of days that still need raw calls)
+    """
+    first_day, last_day = start_date.date(), end_date.date()
+    if rollups is None:
+        rollups = get_rollups_for_period(company_id, tenant_id, first_day, last_day)
+    day_rollups = _usable_rollups(rollups, first_day, last_day, tzone)
+    missing_days = sum(1 for rollup in day_rollups.values() if rollup is None)
+
+    segments = []
+    fragments = _FragmentLoader(company_id, tenant_id)
+    for source, stream_fn in CALL_SOURCES.items():
+        raw_range = []
+        for day in list(day_rollups) + [None]:
+            rollup = day_rollups.get(day) if day else None
+            if day is not None and rollup is None:
+                raw_range.append(day)
+                continue
+            if raw_range:
+                range_start, range_end = _raw_range_window(raw_range, start_date, end_date)
+                segments.append({"calls": _entity_calls(stream_fn, company_id, tenant_id, range_start, range_end)})
+                raw_range = []
+            if day is not None and rollup["sources"][source]["callCount"]:
+                segments.append({
+                    "fragment": fragments.add(rollup, source),
+                    "day": day,
+                    "rollup": rollup["sources"][source],
+                })
+
+    return segments, missing_days
+
+
+def plan_tenant_call_logs(
+    company_id: str,
+    tenant_tzones: dict[str, str | None],
+    start_date: datetime,
+    end_date: datetime,
+    open_stream=None
+) -> tuple[Iterator[tuple[str, dict]], dict[str, int]]:
+    """
+    Plans the billing CSVs of several tenants of a company together: stored fragments for
+    each tenant's rolled-up days, and one company-wide raw scan per call source covering
+    only the days some tenant has no usable rollup for.
+
+    The raw scan is consumed one UTC day at a time and split by tenant, so at most one
+    day of the company's calls is held; calls of tenants that have that day rolled up
+    are skipped. Rollups of all tenants are read in one batched read.
+
+    Args:
+        company_id: Parent company of the tenants
+        tenant_tzones: tenant_id -> timezone of the tenant (drives its CSV date format)
+        start_date: Start of the billing period
+        end_date: End of the billing period
+        open_stream: Optional wrapper applied to each raw call stream (e.g. a read-ahead)
+
+    Returns:
+        tuple: (segments, missing days per tenant). segments yields (tenant_id, segment)
+        in each tenant's CSV order (see csv_service.build_call_log_csv); closing it stops
+        the raw scans.
+    """
+    first_day, last_day = start_date.date(), end_date.date()
+    rollups = get_rollups_for_tenants(company_id, list(tenant_tzones), first_day, last_day)
+    day_rollups = {
+        tenant_id: _usable_rollups(rollups[tenant_id], first_day, last_day, tzone)
+        for tenant_id, tzone in tenant_tzones.items()
+    }
+    days = [last_day - timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    raw_days = [day for day in days if any(tenant_days[day] is None for tenant_days in day_rollups.values())]
+    missing_days = {
+        tenant_id: sum(1 for rollup in tenant_days.values() if rollup is None)
+        for tenant_id, tenant_days in day_rollups.items()
+    }
+
+    # Registered up front, in the order they are consumed, so they are read a few per read
+    fragments = {}
+    for tenant_id in tenant_tzones:
+        loader = _FragmentLoader(company_id, tenant_id)
+        for source in CALL_SOURCES:
+            for day in days:
+                rollup = day_rollups[tenant_id][day]
+                if rollup is not None and rollup["sources"][source]["callCount"]:
+                    fragments[(tenant_id, source, day)] = loader.add(rollup, source)
+
+    streams = {}
+    if raw_days:
+        open_stream = open_stream or (lambda calls: calls)
+        for source, stream_fn in CALL_SOURCES.items():
+            # Contiguous runs of raw days, newest first like the days themselves
+            runs, run = [], []
+            for day in raw_days:
+                if run and run[-1] - day > timedelta(days=1):
+                    runs.append(run)
+                    run = []
+                run.append(day)
+            runs.append(run)
+            streams[source] = open_stream(chain.from_iterable(
+                _raw_run_streams(stream_fn, company_id, runs, start_date, end_date)
+            ))
+
+    def segments():
+        try:
+            for source in CALL_SOURCES:
+                calls_by_day = _calls_by_day(streams[source], first_day) if source in streams else iter(())
+                pending = next(calls_by_day, None)
+                for day in days:
+                    by_tenant = {}
+                    while pending is not None and pending[0] >= day:
+                        if pending[0] == day:
+                            by_tenant = partition_calls_by_tenant(pending[1])
+                        pending = next(calls_by_day, None)
+                    for tenant_id in tenant_tzones:
+                        rollup = day_rollups[tenant_id][day]
+                        if rollup is None:
+                            if by_tenant.get(tenant_id):
+                                yield tenant_id, {"calls": by_tenant[tenant_id]}
+                        elif (tenant_id, source, day) in fragments:
+                            yield tenant_id, {
+                                "fragment": fragments[(tenant_id, source, day)],
+                                "day": day,
+                                "rollup": rollup["sources"][source],
+                            }
+        finally:
+            for stream in streams.values():
+                if hasattr(stream, "close"):
+                    stream.close()
+
+    return segments(), missing_days
+
+
+def _usable_rollups(rollups: dict[str, dict], first_day: date, last_day: date, tzone: str | None) -> dict[date, dict | None]:
+    """
+    Day -> usable rollup (None when the day needs raw calls), newest day first, matching
+    the descending receivedAt order of the raw streams. See plan_call_log_segments.
+    """
+    date_format = _get_date_format_for_tz(tzone)
+
+    def usable(day: date) -> dict | None:
+        rollup = rollups.get(day.isoformat())
+        if not rollup or rollup.get("dateFormat") != date_format or not rollup.get("fragmentVersion"):
+            return None
+        return rollup
+
+    return {
+        day: usable(day)
+        for day in (last_day - timedelta(days=i) for i in range((last_day - first_day).days + 1))
+    }
+
+
+def _raw_range_window(raw_days: list[date], start_date: datetime, end_date: datetime) -> tuple[datetime, datetime]:
+    """receivedAt window of a run of consecutive days (newest first), clamped to the billing period."""
+    return max(day_window(raw_days[-1])[0], start_date), min(day_window(raw_days[0])[1], end_date)
+
+
+def _raw_run_streams(stream_fn, company_id: str, runs: list[list[date]], start_date: datetime, end_date: datetime) -> Iterator:
+    """Opens the raw call stream of each run of days lazily, once the previous run is read."""
+    for run in runs:
+        yield stream_fn(company_id, *_raw_range_window(run, start_date, end_date), fields=CSV_CALL_FIELDS)
+
+
+def _calls_by_day(calls: Iterable[dict], period_start: date) -> Iterator[tuple[date, list[dict]]]:
+    """Groups a descending receivedAt call stream into (UTC day, calls of that day)."""
+    day, day_calls = None, []
+    for call in calls:
+        index = call_day_index(call, period_start)
+        call_day = period_start + timedelta(days=index) if index >= 0 else day
+        if day_calls and call_day != day:
+            yield day, day_calls
+            day_calls = []
+        day = call_day
+        day_calls.append(call)
+    if day_calls:
+        yield day, day_calls
+
+
+class _FragmentLoader:
+    """
+    Reads an entity's stored fragments in the order the CSV consumes them: the first
+    request for a fragment fetches it together with the next ROLLUP_FRAGMENT_PREFETCH - 1
+    ones in one read, and each fragment is dropped once handed out.
+    """
+
+    def __init__(self, company_id: str, tenant_id: str | None):
+        self.company_id = company_id
+        self.tenant_id = tenant_id
+        self.pending = []  # (rollup, source) not fetched yet, in segment order
+        self.loaded = {}   # (ISO date, source) -> fragment bytes
+
+    def add(self, rollup: dict, source: str):
+        """Registers a fragment; returns its loader for the segment."""
+        self.pending.append((rollup, source))
+        key = (rollup["date"], source)
+        return lambda: self.load(key)
+
+    def load(self, key: tuple[str, str]) -> str:
+        if key not in self.loaded:
+            while self.pending and key not in self.loaded:
+                wanted = self.pending[:ROLLUP_FRAGMENT_PREFETCH]
+                del self.pending[:ROLLUP_FRAGMENT_PREFETCH]
+                self.loaded.update(get_rollup_fragments(self.company_id, self.tenant_id, wanted))
+        return self.loaded.pop(key).decode("utf-8")
+
+
+def _entity_calls(stream_fn, company_id: str, tenant_id: str | None, start: datetime, end: datetime):
+    """Lazy raw call stream of an entity, projected to the CSV fields and filtered by tenant server-side."""
+    return stream_fn(company_id, start, end, fields=CSV_CALL_FIELDS, tenant_id=tenant_id)
@@ -0,0 +1,89 @@
+# services/webhook_inbox_service.py
+"""
+Durable webhook inbox.
+
+Webhook routes only verify the provider's signature, store the event (accept_webhook_event)
+and acknowledge it, so Razorpay/Stripe get their 200 within milliseconds and don't time
+out and redeliver. Events are keyed by payment/event ID: a redelivery of an event that is
+already in the inbox is acknowledged without being stored or processed again.
+
+A dispatcher (utils/local_queue.py), started with the app, runs each stored event's handler
+once, with at most WEBHOOK_WORKERS in flight, retrying failures with backoff.
+"""
+import os
+
+from utils.local_queue import LocalQueue, PermanentFailure, handle_each
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_BASE_SECONDS", "30"))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "3600"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "2"))
+
+# Events the inbox stores; routes acknowledge any other event without storing it
+HANDLED_EVENTS = {
+    ("razorpay", "payment.captured"),
+    ("stripe", "checkout.session.completed"),
+}
+
+# Keyed by "{provider}:{payment/event ID}"
+_inbox = LocalQueue(
+    "Webhook inbox",
+    "webhook_inbox",
+    workers=WEBHOOK_WORKERS,
+    max_attempts=WEBHOOK_MAX_ATTEMPTS,
+    backoff_base_seconds=WEBHOOK_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=WEBHOOK_BACKOFF_MAX_SECONDS,
+    poll_seconds=WEBHOOK_POLL_SECONDS,
+    dedupe=True,
+)
+
+
+def accept_webhook_event(provider: str, event_key: str, event_type: str, event: dict) -> dict:
+    """
+    Stores a verified webhook event for the dispatcher to process.
+
+    Args:
+        provider: "razorpay" or "stripe"
+        event_key: Idempotency key (payment ID or provider event ID)
+        event_type: Provider event type
+        event: Parsed event body
+
+    Returns:
+        dict: {"status": "queued" | "duplicate", "inbox_id"}
+    """
+    inbox_id, created = _inbox.enqueue(
+        {"provider": provider, "event_type": event_type, "event": event}, key=f"{provider}:{event_key}"
+    )
+    if not created:
+        print(f"♻️ Duplicate {provider} webhook {event_type} ({event_key}) - already in inbox #{inbox_id}")
+        return {"status": "duplicate", "inbox_id": inbox_id}
+
+    print(f"📥 {provider} webhook {event_type} ({event_key}) queued (inbox #{inbox_id})")
+    return {"status": "queued", "inbox_id": inbox_id}
+
+
+def _process_event(entry: dict) -> dict:
+    """Runs the handler of one stored event."""
+    # Imported lazily: payment_service pulls in the provider SDKs and the PDF stack
+    from services.payment_service import process_razorpay_payment_captured, process_stripe_checkout_completed
+    handlers = {
+        ("razorpay", "payment.captured"): process_razorpay_payment_captured,
+        ("stripe", "checkout.session.completed"): process_stripe_checkout_completed,
+    }
+    handler = handlers.get((entry["provider"], entry["event_type"]))
+    if handler is None:
+        raise PermanentFailure(f"No handler for {entry['provider']} event {entry['event_type']}")
+    result = handler(entry["event"])
+    print(f"✅ {entry['provider']} {entry['event_type']} processed: {(result or {}).get('status')}")
+    return result
+
+
+def start_webhook_dispatcher():
+    """Starts the dispatcher on the running event loop (called from the app lifespan)."""
+    _inbox.start(handle_each(_process_event))
+
+
+async def stop_webhook_dispatcher():
+    """Stops the dispatcher after its in-flight events finish."""
+    await _inbox.stop()
@@ -0,0 +1,18 @@
+# tests/conftest.py
+"""
+Shared test setup: makes the project importable when pytest is run from the project
+root, and points the local SQLite state at a throwaway file.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("LOCAL_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="billing-tests-"), "local_state.db"))
+# Keep tests off the on-disk PDF cache and the render process pool
+os.environ.setdefault("PDF_CACHE_ENABLED", "0")
+os.environ.setdefault("PDF_RENDER_POOL", "0")
+os.environ.setdefault("ARTIFACT_DISK_SINK", "0")
@@ -0,0 +1,184 @@
+# tests/fake_firestore.py
+"""
+In-memory stand-in for the parts of the Firestore client the repositories use:
+document get/set/update (with last-update-time preconditions), get_all, write batches
+and simple where() queries over one collection or a collection group.
+Every write bumps the document's update time; a precondition on an older update time
+raises FailedPrecondition, as Firestore does.
+"""
+import copy
+import threading
+
+from google.api_core.exceptions import FailedPrecondition, NotFound
+
+
+class FakeSnapshot:
+    def __init__(self, ref, data: dict | None, update_time: int | None):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self) -> dict | None:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str):
+        value = self._data
+        for part in field_path.split("."):
+            value = (value or {}).get(part)
+        return value
+
+
+class FakeDocument:
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str):
+        return FakeCollection(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None) -> FakeSnapshot:
+        with self._client.lock:
+            self._client.reads += 1
+            return FakeSnapshot(self, copy.deepcopy(self._client.docs.get(self.path)), self._client.update_times.get(self.path))
+
+    def set(self, data: dict, merge: bool = False):
+        with self._client.lock:
+            self._client._write(self.path, lambda doc: {**(doc or {}), **data} if merge else data)
+
+    def update(self, data: dict, option=None):
+        with self._client.lock:
+            self._client._check(self.path, option)
+            if self.path not in self._client.docs:
+                raise NotFound(f"No document to update: {self.path}")
+            self._client._write(self.path, lambda doc: _apply_field_paths(doc, data))
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    "<": lambda a, b: a is not None and a < b,
+}
+
+
+class FakeQuery:
+    def __init__(self, client, path: str, filters: tuple = (), group: bool = False):
+        self._client = client
+        self.path = path
+        self._filters = filters
+        self._group = group
+
+    def where(self, field: str, op: str, value):
+        return FakeQuery(self._client, self.path, self._filters + ((field, _OPERATORS[op], value),), self._group)
+
+    def select(self, field_paths):
+        # Projections only save payload; the fake returns whole documents
+        return self
+
+    def _matches_path(self, path: str) -> bool:
+        parent = path.rsplit("/", 1)[0]
+        if self._group:
+            return parent.rsplit("/", 1)[-1] == self.path
+        return parent == self.path
+
+    def stream(self):
+        with self._client.lock:
+            paths = sorted(p for p in self._client.docs if self._matches_path(p))
+            snapshots = [FakeDocument(self._client, p).get() for p in paths]
+        return iter([s for s in snapshots if all(op(s.get(field), value) for field, op, value in self._filters)])
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self._client, f"{self.path}/{doc_id}")
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref: FakeDocument, data: dict, merge: bool = False):
+        self._writes.append(("set", ref, data, merge))
+
+    def update(self, ref: FakeDocument, data: dict, option=None):
+        self._writes.append(("update", ref, data, option))
+
+    def delete(self, ref: FakeDocument):
+        self._writes.append(("delete", ref, None, None))
+
+    def commit(self):
+        # All-or-nothing, like a Firestore batch
+        with self._client.lock:
+            self._client.commits.append(len(self._writes))
+            for kind, ref, _, option in self._writes:
+                if kind == "update":
+                    self._client._check(ref.path, option)
+                    if ref.path not in self._client.docs:
+                        raise NotFound(f"No document to update: {ref.path}")
+            for kind, ref, data, extra in self._writes:
+                if kind == "delete":
+                    self._client.docs.pop(ref.path, None)
+                    self._client.update_times.pop(ref.path, None)
+                elif kind == "set":
+                    self._client._write(ref.path, lambda doc, data=data, merge=extra: {**(doc or {}), **data} if merge else data)
+                else:
+                    self._client._write(ref.path, lambda doc, data=data: _apply_field_paths(doc, data))
+        return []
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.docs = {}
+        self.update_times = {}
+        self.reads = 0
+        self.commits = []  # number of writes of each committed batch
+        self.lock = threading.RLock()
+        self._clock = 0
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def collection_group(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name, group=True)
+
+    def document(self, path: str) -> FakeDocument:
+        return FakeDocument(self, path)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def get_all(self, refs):
+        return iter([ref.get() for ref in refs])
+
+    def write_option(self, last_update_time=None):
+        return {"last_update_time": last_update_time}
+
+    def _check(self, path: str, option):
+        if option is not None and self.update_times.get(path) != option["last_update_time"]:
+            raise FailedPrecondition(f"{path} was updated since it was read")
+
+    def _write(self, path: str, change):
+        self._clock += 1
+        self.docs[path] = copy.deepcopy(change(copy.deepcopy(self.docs.get(path))))
+        self.update_times[path] = self._clock
+
+
+def _apply_field_paths(doc: dict, data: dict) -> dict:
+    for field_path, value in data.items():
+        *parents, leaf = field_path.split(".")
+        target = doc
+        for part in parents:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        target[leaf] = value
+    return doc
@@ -0,0 +1,71 @@
+# tests/test_billing_prefetch.py
+"""prefetch_stream: order and errors are preserved, and the producer never outlives its consumer."""
+import gc
+import itertools
+import threading
+import time
+
+import pytest
+
+from services import billing_prefetch
+
+
+def _producer_threads(name: str) -> list[threading.Thread]:
+    return [t for t in threading.enumerate() if t.name == f"billing-prefetch-{name}"]
+
+
+def _wait_for_producers_to_stop(name: str, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not _producer_threads(name):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _endless_calls():
+    for i in itertools.count():
+        yield {"id": i}
+
+
+def test_yields_calls_in_order():
+    calls = [{"id": i} for i in range(1000)]
+    assert list(billing_prefetch.prefetch_stream("test-order", iter(calls))) == calls
+
+
+def test_raises_the_producer_error():
+    def _failing():
+        yield {"id": 1}
+        raise RuntimeError("stream broke")
+
+    stream = billing_prefetch.prefetch_stream("test-error", _failing())
+    assert next(stream) == {"id": 1}
+    with pytest.raises(RuntimeError, match="stream broke"):
+        next(stream)
+    assert _wait_for_producers_to_stop("test-error")
+
+
+def test_close_before_first_read_stops_the_producer(monkeypatch):
+    monkeypatch.setattr(billing_prefetch, "PREFETCH_STREAM_BUFFER", 10)
+    stream = billing_prefetch.prefetch_stream("test-close", _endless_calls())
+    assert _producer_threads("test-close")
+
+    stream.close()
+
+    assert _wait_for_producers_to_stop("test-close")
+    assert list(stream) == []
+
+
+def test_dropped_stream_stops_the_producer(monkeypatch):
+    monkeypatch.setattr(billing_prefetch, "PREFETCH_STREAM_BUFFER", 10)
+
+    def _build_segments():
+        segments = [{"calls": billing_prefetch.prefetch_stream("test-dropped", _endless_calls())}]
+        # An earlier segment fails before the stream is ever read
+        raise ValueError("rollup fragment missing")
+
+    with pytest.raises(ValueError):
+        _build_segments()
+    gc.collect()
+
+    assert _wait_for_producers_to_stop("test-dropped")
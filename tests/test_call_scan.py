@@ -0,0 +1,103 @@
+# tests/test_call_scan.py
+"""
+callLogs_repo._scan_calls sizes its slices without a count() round trip and never
+buffers every slice of a range before yielding.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from repositories import callLogs_repo
+
+START = datetime(2026, 3, 1, tzinfo=timezone.utc)
+END = START + timedelta(days=1) - timedelta(seconds=1)
+
+
+class _Doc:
+    def __init__(self, call: dict):
+        self._call = call
+
+    def to_dict(self) -> dict:
+        return dict(self._call)
+
+
+class _Query:
+    def __init__(self, calls: list[dict], start, end, inclusive: bool, streams: list):
+        self._calls = [c for c in calls if start <= c["receivedAt"] and (c["receivedAt"] <= end if inclusive else c["receivedAt"] < end)]
+        self._streams = streams
+
+    def count(self):
+        raise AssertionError("count() should not run before a scan")
+
+    def stream(self):
+        self._streams.append(len(self._calls))
+        return iter(_Doc(c) for c in sorted(self._calls, key=lambda c: c["receivedAt"], reverse=True))
+
+
+@pytest.fixture
+def rollups(monkeypatch):
+    """Stored daily rollups of the scanned entity (none by default)."""
+    stored = {}
+    monkeypatch.setattr(callLogs_repo, "get_rollups_for_period",
+                        lambda company_id, tenant_id, start_day, end_day: dict(stored))
+    return stored
+
+
+@pytest.fixture
+def scan(monkeypatch, rollups):
+    monkeypatch.setattr(callLogs_repo, "_observed_density", {})
+    calls = [{"id": n, "receivedAt": START + timedelta(seconds=10 * n)} for n in range(8000)]
+    streams = []
+
+    def query_fn(company_id, start, end, fields=None, tenant_id=None, end_inclusive=True):
+        return _Query(calls, start, end, end_inclusive, streams)
+
+    def run() -> list[dict]:
+        streams.clear()
+        return list(callLogs_repo._scan_calls(query_fn, "top", "acme", START, END, None, None))
+
+    return calls, streams, run
+
+
+def test_first_scan_without_rollups_uses_default_density(scan, monkeypatch):
+    monkeypatch.setattr(callLogs_repo, "CALL_SCAN_DEFAULT_CALLS_PER_HOUR", 20)
+    calls, streams, run = scan
+
+    assert [c["id"] for c in run()] == [c["id"] for c in reversed(calls)]
+    # 480 calls expected for the day: a single stream
+    assert len(streams) == 1
+
+
+def test_later_scans_follow_observed_density(scan):
+    calls, streams, run = scan
+    run()
+
+    assert [c["id"] for c in run()] == [c["id"] for c in reversed(calls)]
+    assert len(streams) == 4
+    assert sum(streams) == len(calls)
+
+
+def test_first_scan_is_sized_from_rollups(scan, rollups):
+    calls, streams, run = scan
+    rollups["2026-02-28"] = {"sources": {"top": {"callCount": 8000}, "nested": {"callCount": 0}}}
+
+    assert [c["id"] for c in run()] == [c["id"] for c in reversed(calls)]
+    assert len(streams) == 4
+    # The same read seeded the other source too
+    assert callLogs_repo._known_density(("nested", "acme", None)) == 0
+
+
+def test_newest_slice_is_yielded_before_every_slice_is_fetched(scan, rollups, monkeypatch):
+    calls, streams, run = scan
+    monkeypatch.setattr(callLogs_repo, "CALL_SCAN_PARALLELISM", 8)
+    rollups["2026-02-28"] = {"sources": {"top": {"callCount": 8000}}}
+
+    def query_fn(company_id, start, end, fields=None, tenant_id=None, end_inclusive=True):
+        return _Query(calls, start, end, end_inclusive, streams)
+
+    scan_iter = callLogs_repo._scan_calls(query_fn, "top", "acme", START, END, None, None)
+    next(scan_iter)
+    # 4 slices: at most 3 were submitted when the first call came out
+    assert len(streams) <= 3
+    assert len(list(scan_iter)) == len(calls) - 1
+    assert len(streams) == 4
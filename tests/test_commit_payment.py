@@ -0,0 +1,101 @@
+# tests/test_commit_payment.py
+"""
+bill_repo.commit_payment records a payment in one commit from the invoice the caller
+loaded, and once only, even when that invoice came from a stale cache.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.api_core.exceptions import FailedPrecondition
+
+from fake_firestore import FakeFirestore
+from repositories import bill_repo, invoice_repo
+
+INVOICE_PATH = "companies/acme/tenants/t1/invoices/T1092026"
+PAYMENTS_PATH = "companies/acme/tenants/t1/payments"
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    client = FakeFirestore()
+    client.document(INVOICE_PATH).set({"payment_status": "pending", "dueDate": "2099-01-31T00:00:00+00:00", "totalAmount": 1180.0})
+    monkeypatch.setattr(bill_repo, "firestore_client", client)
+    monkeypatch.setattr(invoice_repo, "firestore_client", client)
+    invoice_repo._invoice_cache.clear()
+    return client
+
+
+def _payment(payment_id: str) -> dict:
+    return {"payment_id": payment_id, "invoice_number": "T1092026", "amount_paid": 1180.0, "payment_mode": "Razorpay"}
+
+
+def test_records_payment_and_status(firestore):
+    assert bill_repo.commit_payment("acme", _payment("pay_1"), tenant_id="t1") == "paid"
+    assert firestore.docs[INVOICE_PATH]["payment_status"] == "paid"
+    assert firestore.docs[f"{PAYMENTS_PATH}/REC_T1092026"]["payment_id"] == "pay_1"
+
+
+def test_invoice_paid_elsewhere_is_not_recorded_again(firestore):
+    # This worker's cache still says pending
+    assert invoice_repo.get_invoice_by_id("acme", "t1", "T1092026")["payment_status"] == "pending"
+    # ... while another worker records a payment
+    firestore.document(INVOICE_PATH).update({"payment_status": "paid"})
+    firestore.document(f"{PAYMENTS_PATH}/REC_T1092026").set({"payment_id": "pay_other"})
+
+    assert bill_repo.commit_payment("acme", _payment("pay_1"), tenant_id="t1") is None
+    assert firestore.docs[f"{PAYMENTS_PATH}/REC_T1092026"]["payment_id"] == "pay_other"
+
+
+def test_concurrent_payments_record_one(firestore):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(lambda n: bill_repo.commit_payment("acme", _payment(f"pay_{n}"), tenant_id="t1"), range(8)))
+
+    assert statuses.count("paid") == 1
+    assert statuses.count(None) == 7
+    winner = f"pay_{statuses.index('paid')}"
+    assert firestore.docs[f"{PAYMENTS_PATH}/REC_T1092026"]["payment_id"] == winner
+
+
+def test_missing_invoice_raises(firestore):
+    with pytest.raises(ValueError):
+        bill_repo.commit_payment("acme", {**_payment("pay_1"), "invoice_number": "NOPE"}, tenant_id="t1")
+
+
+def test_loaded_invoice_is_committed_without_a_second_read(firestore):
+    invoice, update_time = invoice_repo.get_invoice_with_update_time("acme", "t1", "T1092026")
+    reads = firestore.reads
+
+    assert bill_repo.commit_payment("acme", _payment("pay_1"), tenant_id="t1", invoice=invoice, update_time=update_time) == "paid"
+    assert firestore.reads == reads
+    assert firestore.commits == [2]
+
+
+def test_stale_loaded_invoice_is_read_again(firestore):
+    invoice, update_time = invoice_repo.get_invoice_with_update_time("acme", "t1", "T1092026")
+    # Paid by another worker after this one cached the invoice
+    firestore.document(INVOICE_PATH).update({"payment_status": "paid"})
+
+    assert bill_repo.commit_payment("acme", _payment("pay_1"), tenant_id="t1", invoice=invoice, update_time=update_time) is None
+    assert f"{PAYMENTS_PATH}/REC_T1092026" not in firestore.docs
+    assert invoice_repo.get_invoice_by_id("acme", "t1", "T1092026")["payment_status"] == "paid"
+
+
+def test_conflicts_are_retried_a_bounded_number_of_times(firestore, monkeypatch):
+    attempts = []
+
+    class _ConflictingBatch:
+        def set(self, *args, **kwargs):
+            pass
+
+        def update(self, *args, **kwargs):
+            pass
+
+        def commit(self):
+            attempts.append(1)
+            raise FailedPrecondition("invoice changed")
+
+    monkeypatch.setattr(firestore, "batch", _ConflictingBatch)
+
+    with pytest.raises(FailedPrecondition):
+        bill_repo.commit_payment("acme", _payment("pay_1"), tenant_id="t1")
+    assert len(attempts) == bill_repo.PAYMENT_COMMIT_MAX_ATTEMPTS
@@ -0,0 +1,57 @@
+# tests/test_invoice_batch.py
+"""
+run_invoice_batch sends the emails of companies that are done billing while other
+companies are still being billed, and keeps the invoice documents out of its report.
+"""
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    try:
+        from services import invoice_batch_service
+    except (ImportError, OSError) as e:
+        # WeasyPrint needs the Pango/Cairo system libraries (see requirements.txt)
+        pytest.skip(f"WeasyPrint unavailable: {e}")
+
+    slow_billing = threading.Event()
+    sent = []
+
+    def bill_company(company, month, year):
+        if company == "slow":
+            assert slow_billing.wait(5), "the slow company was never released"
+        result = invoice_batch_service._result(invoice_batch_service.PARENT_COMPANY, company, False)
+        return [(result, {"invoice_number": f"INV-{company}", "csvAttachment": {"content": b"x" * 1024}})]
+
+    def deliver_invoice(result, invoice, render_pool, batch_emails=False):
+        result["invoice_number"] = invoice["invoice_number"]
+        result["pdf"] = f"invoices/{invoice['invoice_number']}.pdf"
+        return result, {"To": result["tenant"], "Metadata": {"invoice_number": invoice["invoice_number"]}}
+
+    def send_email_batch(messages):
+        sent.append([m["To"] for m in messages])
+        # The first company's email goes out before the slow company finishes billing
+        slow_billing.set()
+        return [{"status": "sent"} for _ in messages]
+
+    monkeypatch.setattr(invoice_batch_service, "_bill_company", bill_company)
+    monkeypatch.setattr(invoice_batch_service, "_deliver_invoice", deliver_invoice)
+    monkeypatch.setattr(invoice_batch_service, "send_email_batch", send_email_batch)
+    monkeypatch.setattr(invoice_batch_service, "message_size", lambda message: 1)
+    monkeypatch.setattr(invoice_batch_service, "POSTMARK_BATCH_SIZE", 1)
+    return invoice_batch_service, sent
+
+
+def test_emails_are_sent_while_other_companies_are_billed(batch):
+    invoice_batch_service, sent = batch
+
+    report = invoice_batch_service.run_invoice_batch(["slow", "fast"], 9, 2026, io_workers=4, batch_emails=True)
+
+    assert sent == [["fast"], ["slow"]]
+    assert report["sent"] == 2
+    assert sorted(report["invoices"], key=lambda i: i["invoice_number"]) == [
+        {"invoice_number": "INV-fast", "pdf": "invoices/INV-fast.pdf"},
+        {"invoice_number": "INV-slow", "pdf": "invoices/INV-slow.pdf"},
+    ]
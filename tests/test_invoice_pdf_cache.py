@@ -0,0 +1,129 @@
+# tests/test_invoice_pdf_cache.py
+"""
+An invoice's PDF is rendered once: the payment reminder for a saved invoice maps to
+the same render cache entry as the invoice's original send.
+"""
+import copy
+from datetime import datetime, timezone
+
+import pytest
+
+try:
+    import weasyprint  # noqa: F401
+except (ImportError, OSError) as e:
+    # WeasyPrint needs the Pango/Cairo system libraries (see requirements.txt)
+    pytest.skip(f"WeasyPrint unavailable: {e}", allow_module_level=True)
+
+from repositories import bill_repo
+from services import billing_service, invoice_service, pdf_cache, pdf_service
+
+
+class _FakeDoc:
+    def __init__(self, store: dict, path: str):
+        self._store = store
+        self._path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def set(self, data):
+        self._store[self._path] = copy.deepcopy(data)
+
+
+class _FakeInvoices:
+    def __init__(self, store: dict, path: str):
+        self._store = store
+        self._path = path
+
+    def document(self, doc_id: str) -> _FakeDoc:
+        return _FakeDoc(self._store, f"{self._path}/{doc_id}")
+
+
+@pytest.fixture
+def saved_invoices(monkeypatch):
+    store = {}
+    monkeypatch.setattr(
+        bill_repo, "_invoices_ref",
+        lambda company_id, tenant_id: _FakeInvoices(store, f"companies/{company_id}/tenants/{tenant_id}/invoices"),
+    )
+    monkeypatch.setattr(bill_repo, "invalidate_invoice", lambda *args: None)
+    return store
+
+
+@pytest.fixture
+def renders(monkeypatch, tmp_path):
+    """Counts actual PDF renders; the cache lives in a temporary directory."""
+    rendered = []
+
+    class _FakeHTML:
+        def __init__(self, string: str):
+            self._html = string
+
+        def write_pdf(self) -> bytes:
+            rendered.append(self._html)
+            return f"%PDF-{len(rendered)}".encode()
+
+    monkeypatch.setattr(pdf_service, "HTML", _FakeHTML)
+    monkeypatch.setattr(pdf_service, "USE_RENDER_POOL", False)
+    monkeypatch.setattr(pdf_service, "PDF_CACHE_ENABLED", True)
+    monkeypatch.setattr(pdf_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(pdf_cache, "_entries", None)
+    monkeypatch.setattr(pdf_cache, "_total_bytes", 0)
+    return rendered
+
+
+@pytest.fixture
+def queued_emails(monkeypatch):
+    emails = []
+    monkeypatch.setattr(invoice_service, "enqueue_email", lambda **email: emails.append(email) or len(emails))
+    return emails
+
+
+BILLING_DETAILS = {
+    "tzone": "Asia/Kolkata",
+    # Integer rates: validation turns some of them into floats in the saved document
+    "ratePerMinute": 2,
+    "gstRate": 18,
+    "maintenanceFee": 500,
+    "billing": {
+        "billingPolicy": "per_minute", "currency": "INR", "ratePerMinute": 2, "gstRate": 18, "maintenanceFee": 500,
+        "purchaseOrder": "PO-77", "poDate": "2026-01-15T00:00:00+00:00",
+    },
+    "billingInfo": {
+        "legalName": "Tenant One Pvt Ltd",
+        "billingEmail": "accounts@tenant.example",
+        "billingAddresses": [{"isActive": True, "gstNumber": "29ABCDE1234F1Z5", "city": "Bengaluru"}],
+    },
+}
+VENDOR_DETAILS = {
+    "id": "acme",
+    "billingInfo": {
+        "legalName": "Acme Voice Ltd",
+        "billingEmail": "billing@acme.example",
+        "billingAddresses": [{"isActive": True, "gstNumber": "27ABCDE1234F1Z5", "city": "Mumbai"}],
+    },
+}
+
+
+def test_reminder_reuses_the_pdf_of_the_original_send(monkeypatch, saved_invoices, renders, queued_emails):
+    usage = {
+        "total_minutes": 1234,
+        "total_calls": 321,
+        "attachment": {"name": "calls.csv", "content": b"", "content_type": "text/csv", "path": None},
+    }
+
+    invoice = billing_service._build_and_save_invoice(
+        "acme", "t1", True, BILLING_DETAILS, billing_service._build_vendor_info(VENDOR_DETAILS), usage,
+        datetime(2026, 9, 1, tzinfo=timezone.utc), datetime(2026, 9, 30, 23, 59, 59, tzinfo=timezone.utc),
+    )
+    assert invoice_service.send_invoice_to_client(invoice, isSubEntity=True) is not None
+    assert len(renders) == 1
+
+    # The reminder job reads the saved document back (see bill_repo.get_invoices_due_for_reminder)
+    [(path, document)] = saved_invoices.items()
+    reminder_invoice = copy.deepcopy(document)
+    reminder_invoice["invoice_id"] = reminder_invoice["invoice_number"] = path.rsplit("/", 1)[-1]
+    invoice_service._send_reminder_email(reminder_invoice, "acme", "t1", reminder_type="first")
+
+    assert len(renders) == 1
+    sent_pdf, reminder_pdf = (email["attachments"][0] for email in queued_emails)
+    assert reminder_pdf["content"] == sent_pdf["content"]
+    assert reminder_pdf["name"] == sent_pdf["name"]
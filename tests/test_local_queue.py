@@ -0,0 +1,84 @@
+# tests/test_local_queue.py
+"""LocalQueue claiming, outcome recording and retries."""
+import asyncio
+import time
+import uuid
+
+from utils.local_queue import LocalQueue, done, failed
+
+
+def _queue(**options) -> LocalQueue:
+    # A fresh table per test: the schema is created on first use of the shared local DB
+    return LocalQueue("Test queue", f"test_queue_{uuid.uuid4().hex[:8]}", poll_seconds=0.01, **options)
+
+
+def _drain(queue: LocalQueue, handler, timeout: float = 5):
+    async def _run():
+        await asyncio.wait_for(queue.run(handler, asyncio.Event(), drain=True), timeout=timeout)
+    asyncio.run(_run())
+
+
+async def _one_pass(queue: LocalQueue, handler):
+    """Claims due entries once and handles them, without retrying."""
+    claimed = await asyncio.to_thread(queue.claim_due, queue.claim_limit)
+    await asyncio.to_thread(queue._handle, handler, claimed)
+
+
+def test_handler_exception_releases_claims_with_backoff():
+    queue = _queue(claim_limit=10, backoff_base_seconds=60)
+    ids = [queue.enqueue({"n": i})[0] for i in range(3)]
+
+    def _raising(entries):
+        raise ValueError("POSTMARK_API_TOKEN missing in environment.")
+
+    started = time.time()
+    asyncio.run(_one_pass(queue, _raising))
+
+    assert queue.counts() == {"pending": 3}
+    for entry_id in ids:
+        entry = queue.get(entry_id)
+        assert entry["attempts"] == 1
+        assert "POSTMARK_API_TOKEN" in entry["last_error"]
+    assert queue.next_pending_attempt_at() >= started + 60
+
+
+def test_short_outcome_list_fails_the_whole_claim():
+    queue = _queue(claim_limit=10, backoff_base_seconds=60)
+    for i in range(3):
+        queue.enqueue({"n": i})
+
+    asyncio.run(_one_pass(queue, lambda entries: [done()]))
+
+    assert queue.counts() == {"pending": 3}
+
+
+def test_claims_are_limited_by_payload_size():
+    queue = _queue(claim_limit=10, claim_max_bytes=250)
+    for i in range(5):
+        queue.enqueue({"body": "x" * 100, "n": i})
+    # Larger than the byte budget on its own: still claimed, alone
+    queue.enqueue({"body": "x" * 500, "n": 5})
+
+    claims = []
+
+    def _handler(entries):
+        claims.append([entry["payload"]["n"] for entry in entries])
+        return [done() for _ in entries]
+
+    _drain(queue, _handler)
+
+    assert sorted(n for claim in claims for n in claim) == list(range(6))
+    assert [5] in claims
+    assert all(len(claim) <= 2 for claim in claims)
+    assert queue.counts() == {"done": 6}
+
+
+def test_failed_entries_are_retried_then_dead_lettered():
+    queue = _queue(max_attempts=3, backoff_base_seconds=0.01, backoff_max_seconds=0.01)
+    entry_id, _ = queue.enqueue({"n": 1})
+
+    _drain(queue, lambda entries: [failed("still broken") for _ in entries])
+
+    entry = queue.get(entry_id)
+    assert entry["status"] == "dead"
+    assert entry["attempts"] == 3
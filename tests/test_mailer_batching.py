@@ -0,0 +1,142 @@
+# tests/test_mailer_batching.py
+"""
+send_email_batch against a local HTTP stand-in for Postmark's /email/batch endpoint:
+chunking by message count and by request size, and mapping of per-message results.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services import mailer_service
+
+
+class _PostmarkStandIn(BaseHTTPRequestHandler):
+    """Accepts every message except recipients containing "bad" (ErrorCode 300), and
+    answers 500 for any batch containing a recipient containing "boom"."""
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.loads(raw)
+        self.requests.append({"path": self.path, "size": len(raw), "messages": body})
+
+        if any("boom" in m["To"] for m in body):
+            status, response = 500, {"ErrorCode": 500, "Message": "Internal error"}
+        else:
+            status, response = 200, [
+                {"ErrorCode": 300, "Message": "Invalid 'To' address", "To": m["To"]}
+                if "bad" in m["To"] else
+                {"ErrorCode": 0, "Message": "OK", "MessageID": f"msg-{m['To']}", "To": m["To"]}
+                for m in body
+            ]
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def postmark(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _PostmarkStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _PostmarkStandIn.requests = []
+
+    monkeypatch.setattr(mailer_service, "POSTMARK_API_TOKEN", "test-token")
+    monkeypatch.setattr(mailer_service, "POSTMARK_API_URL", f"http://127.0.0.1:{server.server_port}/")
+    monkeypatch.setattr(mailer_service, "_client", None)
+    yield _PostmarkStandIn.requests
+    server.shutdown()
+    server.server_close()
+
+
+def _message(to: str, invoice_number: str, body_size: int = 10) -> dict:
+    return {
+        "From": "billing@example.com",
+        "To": to,
+        "Subject": f"Invoice {invoice_number}",
+        "HtmlBody": "x" * body_size,
+        "Attachments": [],
+        "Metadata": {"invoice_number": invoice_number},
+    }
+
+
+def test_chunks_by_message_count(postmark, monkeypatch):
+    monkeypatch.setattr(mailer_service, "POSTMARK_BATCH_SIZE", 3)
+    messages = [_message(f"user{i}@example.com", f"INV{i}") for i in range(7)]
+
+    results = mailer_service.send_email_batch(messages)
+
+    assert [len(r["messages"]) for r in postmark] == [3, 3, 1]
+    assert all(r["path"] == "/email/batch" for r in postmark)
+    assert [r["invoice_number"] for r in results] == [f"INV{i}" for i in range(7)]
+    assert all(r["status"] == "sent" for r in results)
+
+
+def test_chunks_by_request_size(postmark, monkeypatch):
+    messages = [_message(f"user{i}@example.com", f"INV{i}", body_size=1000) for i in range(5)]
+    size = mailer_service.message_size(messages[0])
+    # Room for two messages per request, well under the count limit
+    monkeypatch.setattr(mailer_service, "POSTMARK_BATCH_MAX_BYTES", 2 * size + size // 2)
+
+    results = mailer_service.send_email_batch(messages)
+
+    assert [len(r["messages"]) for r in postmark] == [2, 2, 1]
+    assert all(r["size"] <= 2 * size + size // 2 + 16 for r in postmark)
+    assert all(r["status"] == "sent" for r in results)
+
+
+def test_oversized_message_gets_its_own_request(postmark, monkeypatch):
+    messages = [
+        _message("a@example.com", "INV1"),
+        _message("b@example.com", "INV2", body_size=5000),
+        _message("c@example.com", "INV3"),
+    ]
+    monkeypatch.setattr(mailer_service, "POSTMARK_BATCH_MAX_BYTES", 1000)
+
+    mailer_service.send_email_batch(messages)
+
+    assert [[m["To"] for m in r["messages"]] for r in postmark] == [
+        ["a@example.com"], ["b@example.com"], ["c@example.com"],
+    ]
+
+
+def test_maps_per_message_errors(postmark):
+    messages = [
+        _message("ok1@example.com", "INV1"),
+        _message("bad@example.com", "INV2"),
+        _message("ok2@example.com", "INV3"),
+    ]
+
+    results = mailer_service.send_email_batch(messages)
+
+    assert len(postmark) == 1
+    assert [r["status"] for r in results] == ["sent", "failed", "sent"]
+    assert results[0]["message_id"] == "msg-ok1@example.com"
+    assert results[0]["error"] is None
+    assert results[1]["invoice_number"] == "INV2"
+    assert results[1]["error_code"] == 300
+    assert results[1]["error"] == "Invalid 'To' address"
+
+
+def test_failed_request_fails_only_its_chunk(postmark, monkeypatch):
+    monkeypatch.setattr(mailer_service, "POSTMARK_BATCH_SIZE", 2)
+    messages = [
+        _message("ok1@example.com", "INV1"),
+        _message("ok2@example.com", "INV2"),
+        _message("boom@example.com", "INV3"),
+        _message("ok3@example.com", "INV4"),
+        _message("ok4@example.com", "INV5"),
+    ]
+
+    results = mailer_service.send_email_batch(messages)
+
+    assert len(postmark) == 3
+    assert [r["status"] for r in results] == ["sent", "sent", "failed", "failed", "sent"]
+    assert [r["error_code"] for r in results[2:4]] == [-1, -1]
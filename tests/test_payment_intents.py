@@ -0,0 +1,172 @@
+# tests/test_payment_intents.py
+"""
+Payment order/session reuse (payment_service._get_or_create_intent) against local
+stand-ins for the Razorpay and Stripe APIs and an in-memory Firestore.
+"""
+import copy
+import json
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import razorpay
+import stripe
+
+try:
+    import weasyprint  # noqa: F401  (payment_service renders receipts)
+except (ImportError, OSError) as e:
+    pytest.skip(f"WeasyPrint unavailable: {e}", allow_module_level=True)
+
+from fake_firestore import FakeFirestore
+from repositories import bill_repo
+from services import payment_service
+
+INVOICE_PATH = "companies/acme/tenants/t1/invoices/T1092026"
+
+
+class _ProviderStandIn(BaseHTTPRequestHandler):
+    """Razorpay /v1/orders and Stripe /v1/checkout/sessions, with some latency."""
+    calls = []
+    fail_next = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(0.2)
+        cls = type(self)
+        if cls.fail_next:
+            cls.fail_next -= 1
+            return self._reply(500, {"error": {"code": "SERVER_ERROR", "description": "provider unavailable", "message": "provider unavailable"}})
+
+        cls.calls.append(self.path)
+        n = len(cls.calls)
+        if self.path == "/v1/orders":
+            body = json.loads(raw)
+            return self._reply(200, {"id": f"order_{n}", "entity": "order", "amount": body["amount"], "currency": body["currency"], "status": "created"})
+        if self.path == "/v1/checkout/sessions":
+            body = urllib.parse.parse_qs(raw.decode())
+            return self._reply(200, {"id": f"cs_test_{n}", "object": "checkout.session", "url": f"https://checkout.test/{n}", "expires_at": int(body["expires_at"][0])})
+        self._reply(404, {})
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ProviderStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    _ProviderStandIn.calls = []
+    _ProviderStandIn.fail_next = 0
+
+    monkeypatch.setattr(stripe, "api_base", base)
+    monkeypatch.setattr(stripe, "api_key", "sk_test_standin")
+    monkeypatch.setattr(stripe, "max_network_retries", 0, raising=False)
+    monkeypatch.setattr(payment_service, "razorpay_client", razorpay.Client(auth=("rzp_test", "secret"), base_url=base))
+    yield _ProviderStandIn
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    client = FakeFirestore()
+    client.document(INVOICE_PATH).set({"totalAmount": 1180.0, "payment_status": "pending", "companyId": "t1"})
+    monkeypatch.setattr(bill_repo, "firestore_client", client)
+    return client
+
+
+def _invoice(firestore) -> dict:
+    """The invoice as a payment route loads it (possibly stale by the time it is used)."""
+    invoice = firestore.document(INVOICE_PATH).get().to_dict()
+    return {**invoice, "invoice_number": "T1092026", "companyId": "acme", "tenant_id": "t1"}
+
+
+CREATORS = {
+    "razorpay": (payment_service.create_razorpay_order, "/v1/orders"),
+    "stripe": (payment_service.create_stripe_checkout_session, "/v1/checkout/sessions"),
+}
+
+
+@pytest.mark.parametrize("name", CREATORS)
+def test_open_intent_is_reused(name, provider, firestore):
+    create, path = CREATORS[name]
+    stale = _invoice(firestore)
+
+    first = create(copy.deepcopy(stale))
+    # A retry whose invoice was loaded before the intent was stored
+    again = create(copy.deepcopy(stale))
+    # ... and one that loaded the invoice with the intent
+    fresh = create(_invoice(firestore))
+
+    assert provider.calls == [path]
+    assert again == first == fresh
+    assert firestore.docs[INVOICE_PATH]["paymentIntents"][name]["amount"] == 118000
+
+
+@pytest.mark.parametrize("name", CREATORS)
+def test_expired_or_changed_intent_is_replaced(name, provider, firestore):
+    create, path = CREATORS[name]
+    first = create(_invoice(firestore))
+
+    intents = firestore.docs[INVOICE_PATH]["paymentIntents"]
+    intents[name]["expires_at"] = (datetime.now(timezone.utc) + timedelta(minutes=5)).isoformat()
+    renewed = create(_invoice(firestore))
+    assert renewed != first
+    assert len(provider.calls) == 2
+
+    firestore.document(INVOICE_PATH).update({"totalAmount": 2360.0})
+    changed = create(_invoice(firestore))
+    assert changed != renewed
+    assert provider.calls == [path] * 3
+    assert firestore.docs[INVOICE_PATH]["paymentIntents"][name]["amount"] == 236000
+
+
+@pytest.mark.parametrize("name", CREATORS)
+def test_concurrent_requests_create_one_intent(name, provider, firestore):
+    create, path = CREATORS[name]
+    stale = _invoice(firestore)
+
+    # Each thread stands in for a request on a different worker: nothing is shared but Firestore
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda _: create(copy.deepcopy(stale)), range(8)))
+
+    assert provider.calls == [path]
+    assert all(response == responses[0] for response in responses)
+    assert "claim_id" not in firestore.docs[INVOICE_PATH]["paymentIntents"][name]
+
+
+def test_failed_creation_releases_the_claim(provider, firestore):
+    provider.fail_next = 1
+    with pytest.raises(Exception):
+        payment_service.create_razorpay_order(_invoice(firestore))
+    assert firestore.docs[INVOICE_PATH]["paymentIntents"]["razorpay"] is None
+
+    started = time.monotonic()
+    payment_service.create_razorpay_order(_invoice(firestore))
+    assert time.monotonic() - started < payment_service.PAYMENT_INTENT_CLAIM_SECONDS
+    assert provider.calls == ["/v1/orders"]
+
+
+def test_abandoned_claim_is_taken_over(provider, firestore):
+    abandoned_at = datetime.now(timezone.utc) - timedelta(seconds=payment_service.PAYMENT_INTENT_CLAIM_SECONDS + 1)
+    firestore.document(INVOICE_PATH).update({
+        "paymentIntents.razorpay": {"claim_id": "dead-worker", "claimed_at": abandoned_at.isoformat()},
+    })
+
+    response = payment_service.create_razorpay_order(_invoice(firestore))
+
+    assert response["id"] == "order_1"
+    assert firestore.docs[INVOICE_PATH]["paymentIntents"]["razorpay"]["id"] == "order_1"
@@ -0,0 +1,95 @@
+# tests/test_payment_reminders.py
+"""A payment reminder missed on its day (scheduler skipped a day, send failed) is still sent."""
+from datetime import date, datetime
+
+import pytest
+
+from fake_firestore import FakeFirestore
+from repositories import bill_repo
+
+INVOICE_PATH = "companies/acme/tenants/t1/invoices/T1032026"
+FIRST_DAY = date(2026, 3, 4)
+DUE_DAY = date(2026, 3, 15)
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    client = FakeFirestore()
+    client.document(INVOICE_PATH).set({
+        "payment_status": "pending",
+        "invoiceDate": "2026-03-01T00:00:00+00:00",
+        "dueDate": "2026-03-15T00:00:00+00:00",
+        "nextReminderDate": FIRST_DAY.isoformat(),
+        "nextReminderType": "first",
+    })
+    monkeypatch.setattr(bill_repo, "firestore_client", client)
+    return client
+
+
+@pytest.fixture
+def reminders(firestore, monkeypatch):
+    """Runs check_and_send_payment_reminders() on a given day; returns the reminder types sent."""
+    try:
+        from services import invoice_service
+    except (ImportError, OSError) as e:
+        # WeasyPrint needs the Pango/Cairo system libraries (see requirements.txt)
+        pytest.skip(f"WeasyPrint unavailable: {e}")
+
+    sent, failing = [], set()
+
+    def send(invoice_data, company_id, tenant_id, reminder_type):
+        if reminder_type in failing:
+            raise RuntimeError("Postmark unavailable")
+        sent.append(reminder_type)
+
+    monkeypatch.setattr(invoice_service, "_send_reminder_email", send)
+
+    def run(day: date) -> list[str]:
+        class _Today(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime(day.year, day.month, day.day, 9, 0, tzinfo=tz)
+
+        monkeypatch.setattr(invoice_service, "datetime", _Today)
+        sent.clear()
+        invoice_service.check_and_send_payment_reminders()
+        return list(sent)
+
+    run.failing = failing
+    return run
+
+
+def test_due_payment_reminder_sends_latest_missed():
+    invoice_date, due_date = "2026-03-01", "2026-03-15"
+    assert bill_repo.due_payment_reminder(invoice_date, due_date, "2026-03-04", date(2026, 3, 4)) == "first"
+    assert bill_repo.due_payment_reminder(invoice_date, due_date, "2026-03-04", date(2026, 3, 6)) == "first"
+    assert bill_repo.due_payment_reminder(invoice_date, due_date, "2026-03-04", date(2026, 3, 20)) == "final"
+    assert bill_repo.due_payment_reminder(invoice_date, due_date, "2026-03-15", date(2026, 3, 14)) is None
+
+
+def test_missed_reminder_day_is_picked_up_later(firestore):
+    assert bill_repo.get_invoices_due_for_reminder("2026-03-03") == []
+
+    # The scheduler did not run on the 4th
+    due = bill_repo.get_invoices_due_for_reminder("2026-03-05")
+    assert [(d["invoice_data"]["invoice_number"], d["reminder_type"]) for d in due] == [("T1032026", "first")]
+
+
+def test_skipped_days_still_send_the_final_reminder(firestore, reminders):
+    assert reminders(FIRST_DAY) == ["first"]
+    assert firestore.docs[INVOICE_PATH]["nextReminderDate"] == DUE_DAY.isoformat()
+
+    # The scheduler is down on the due date and comes back two days later
+    assert reminders(date(2026, 3, 17)) == ["final"]
+    assert firestore.docs[INVOICE_PATH]["nextReminderDate"] is None
+    assert reminders(date(2026, 3, 18)) == []
+
+
+def test_failed_send_is_retried_next_run(firestore, reminders):
+    reminders.failing.add("first")
+    assert reminders(FIRST_DAY) == []
+    assert firestore.docs[INVOICE_PATH]["nextReminderDate"] == FIRST_DAY.isoformat()
+
+    reminders.failing.clear()
+    assert reminders(FIRST_DAY.replace(day=5)) == ["first"]
+    assert firestore.docs[INVOICE_PATH]["nextReminderDate"] == DUE_DAY.isoformat()
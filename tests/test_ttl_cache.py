@@ -0,0 +1,141 @@
+# tests/test_ttl_cache.py
+"""TTLCache single-flight loads (sync and async) and invalidation during a load."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.ttl_cache import TTLCache
+
+
+def _cache() -> TTLCache:
+    return TTLCache("test", ttl_seconds=60, negative_ttl_seconds=60)
+
+
+def test_concurrent_sync_misses_share_one_load():
+    cache = _cache()
+    loads = []
+
+    def _load():
+        loads.append(1)
+        time.sleep(0.1)
+        return {"value": 1}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: cache.get_or_load("k", _load), range(8)))
+
+    assert len(loads) == 1
+    assert all(result == {"value": 1} for result in results)
+    assert cache.get_or_load("k", _load) == {"value": 1}
+
+
+def test_concurrent_async_misses_share_one_load():
+    cache = _cache()
+    loads = []
+
+    async def _load():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        return None
+
+    async def _run():
+        return await asyncio.gather(*(cache.get_or_load_async("missing", _load) for _ in range(20)))
+
+    assert asyncio.run(_run()) == [None] * 20
+    assert len(loads) == 1
+    # None is cached as a missing entry
+    assert asyncio.run(cache.get_or_load_async("missing", _load)) is None
+    assert len(loads) == 1
+
+
+def test_async_load_overlapping_an_invalidation_is_not_cached():
+    cache = _cache()
+    values = iter(["stale", "fresh"])
+
+    async def _load():
+        value = next(values)
+        if value == "stale":
+            await asyncio.sleep(0.05)
+        return value
+
+    async def _run():
+        load = asyncio.create_task(cache.get_or_load_async("k", _load))
+        await asyncio.sleep(0.01)
+        # The document is written (and the key invalidated) while the read is in flight
+        cache.invalidate("k")
+        assert await load == "stale"
+        return await cache.get_or_load_async("k", _load)
+
+    assert asyncio.run(_run()) == "fresh"
+
+
+def test_async_waiter_joins_a_sync_load():
+    cache = _cache()
+    started, release = threading.Event(), threading.Event()
+
+    def _sync_load():
+        started.set()
+        release.wait(5)
+        return "from-sync"
+
+    async def _async_load():
+        raise AssertionError("the in-flight sync load should be shared")
+
+    thread = threading.Thread(target=cache.get_or_load, args=("k", _sync_load))
+    thread.start()
+    started.wait(5)
+
+    async def _run():
+        waiter = asyncio.create_task(cache.get_or_load_async("k", _async_load))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await waiter
+
+    assert asyncio.run(_run()) == "from-sync"
+    thread.join(5)
+
+
+def test_cancelled_loader_hands_the_load_to_a_waiter():
+    cache = _cache()
+    calls = []
+
+    async def _load():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return "second"
+
+    async def _run():
+        owner = asyncio.create_task(cache.get_or_load_async("k", _load))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_load_async("k", _load))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await asyncio.wait_for(waiter, timeout=5)
+
+    assert asyncio.run(_run()) == "second"
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_load():
+    cache = _cache()
+
+    async def _load():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def _run():
+        owner = asyncio.create_task(cache.get_or_load_async("k", _load))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_load_async("k", _load))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(_run()) == "value"
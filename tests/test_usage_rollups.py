@@ -0,0 +1,206 @@
+# tests/test_usage_rollups.py
+"""
+Daily rollups keep their CSV fragments in Firestore, so billing on any host can splice
+them, and days that receive calls after their rollup are rolled up again.
+"""
+import os
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from fake_firestore import FakeFirestore
+from repositories import usage_rollup_repo
+from services import usage_rollup_service
+from services.csv_service import CallLogCsvBuilder, build_call_log_csv
+
+DAY = date(2026, 3, 10)
+ROLLUP_PATH = f"companies/acme/usageRollups/{DAY.isoformat()}"
+
+
+def _call(n: int, day: date, tenant_id: str | None = "t1") -> dict:
+    received_at = datetime(day.year, day.month, day.day, 12, tzinfo=timezone.utc) - timedelta(seconds=n)
+    return {
+        "id": f"call_{day.isoformat()}_{n}", "duration": 30 + n % 200, "receivedAt": received_at,
+        "tenantId": tenant_id, "customer_phone": "+919800000000", "assistant_phone": "+918000000000",
+        "finished_at": received_at.isoformat(), "created_at": received_at.isoformat(),
+    }
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Stored calls per source; the service's call reads and counts run against them."""
+    stored = {"top": [], "nested": []}
+
+    def in_range(source, start, end, tenant_id=None):
+        return sorted(
+            (c for c in stored[source] if start <= c["receivedAt"] <= end and tenant_id in (None, c["tenantId"])),
+            key=lambda c: c["receivedAt"], reverse=True,
+        )
+
+    for source, getter in (("top", "get_calls_from_top_level"), ("nested", "get_calls_from_company_doc")):
+        monkeypatch.setattr(usage_rollup_service, getter,
+                            lambda company_id, start, end, fields=None, source=source: in_range(source, start, end))
+        monkeypatch.setitem(usage_rollup_service.CALL_SOURCES, source,
+                            lambda company_id, start, end, fields=None, tenant_id=None, source=source:
+                            iter(in_range(source, start, end, tenant_id)))
+        monkeypatch.setitem(usage_rollup_service.CALL_COUNTS, source,
+                            lambda company_id, start, end, source=source: len(in_range(source, start, end)))
+    monkeypatch.setattr(usage_rollup_service, "get_tenants", lambda company_id: ["t1"])
+    monkeypatch.setattr(usage_rollup_service, "get_all_companies", lambda: ["acme"])
+    monkeypatch.setattr(usage_rollup_service, "get_company_billing_details",
+                        lambda company_id, tenant_id=None: {"tzone": "Asia/Kolkata"})
+    return stored
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    client = FakeFirestore()
+    monkeypatch.setattr(usage_rollup_repo, "firestore_client", client)
+    return client
+
+
+def _fragment_paths(firestore) -> list[str]:
+    return sorted(p for p in firestore.docs if "/fragments/" in p)
+
+
+def _call_log_csv(segments, start, end) -> bytes:
+    return build_call_log_csv("acme", segments, start, end, "Asia/Kolkata")["attachment"]["content"]
+
+
+def test_fragments_round_trip_across_chunks_and_batches(firestore):
+    # Incompressible rows, so the fragment needs several chunk documents and batches
+    content = os.urandom(10 * usage_rollup_repo.FRAGMENT_CHUNK_BYTES)
+    rollup = {"callCount": 1, "dateFormat": "%d-%m-%Y",
+              "sources": {"top": {"callCount": 1}, "nested": {"callCount": 0}},
+              "fragments": {"top": content, "nested": b""}}
+
+    usage_rollup_repo.save_daily_rollups([("acme", None, DAY, rollup)])
+
+    stored = firestore.docs[ROLLUP_PATH]
+    assert "fragments" not in stored
+    assert stored["sources"]["top"]["fragmentChunks"] >= 10
+    assert len(firestore.commits) > 1
+    # Every fragment chunk lands before the rollup that points at it
+    assert all(firestore.update_times[p] < firestore.update_times[ROLLUP_PATH] for p in _fragment_paths(firestore))
+    assert all(len(firestore.docs[p]["data"]) <= usage_rollup_repo.FRAGMENT_CHUNK_BYTES for p in _fragment_paths(firestore))
+
+    fragments = usage_rollup_repo.get_rollup_fragments("acme", None, [(stored, "top"), (stored, "nested")])
+    assert fragments == {(DAY.isoformat(), "top"): content, (DAY.isoformat(), "nested"): b""}
+
+
+def test_rolling_up_again_replaces_the_fragments(firestore, calls):
+    calls["top"] = [_call(n, DAY) for n in range(5)]
+    usage_rollup_service.rollup_company_day("acme", DAY)
+    first = _fragment_paths(firestore)
+
+    calls["top"].append(_call(99, DAY))
+    usage_rollup_service.rollup_company_day("acme", DAY)
+    second = _fragment_paths(firestore)
+
+    assert firestore.docs[ROLLUP_PATH]["callCount"] == 6
+    assert second and not set(first) & set(second)
+    version = firestore.docs[ROLLUP_PATH]["fragmentVersion"]
+    assert all(f"/{version}." in p for p in second if p.startswith(ROLLUP_PATH))
+
+
+def test_billing_csv_from_stored_fragments_matches_raw_calls(firestore, calls, monkeypatch):
+    days = [DAY - timedelta(days=i) for i in range(3)]
+    calls["top"] = [_call(n, day) for day in days for n in range(40)]
+    calls["nested"] = [_call(n, day, tenant_id=None) for day in days for n in range(7)]
+    for day in days[1:]:
+        usage_rollup_service.rollup_company_day("acme", day)
+    monkeypatch.setattr(usage_rollup_service, "ROLLUP_FRAGMENT_PREFETCH", 2)
+
+    start = datetime(days[-1].year, days[-1].month, days[-1].day, tzinfo=timezone.utc)
+    end = usage_rollup_service.day_window(DAY)[1]
+    raw_segments = [{"calls": usage_rollup_service.CALL_SOURCES[s]("acme", start, end)} for s in ("top", "nested")]
+
+    segments, missing_days = usage_rollup_service.plan_call_log_segments("acme", None, start, end, "Asia/Kolkata")
+
+    assert missing_days == 1
+    assert sum("fragment" in s for s in segments) == 4
+    assert _call_log_csv(segments, start, end) == _call_log_csv(raw_segments, start, end)
+
+
+def test_rollups_without_stored_fragments_are_not_used(firestore, calls):
+    calls["top"] = [_call(n, DAY) for n in range(3)]
+    usage_rollup_service.rollup_company_day("acme", DAY)
+    # A rollup written when fragments were still kept on the rolling host's disk
+    legacy = dict(firestore.docs[ROLLUP_PATH])
+    legacy.pop("fragmentVersion")
+    firestore.document(ROLLUP_PATH).set(legacy)
+
+    start, end = usage_rollup_service.day_window(DAY)
+    segments, missing_days = usage_rollup_service.plan_call_log_segments("acme", None, start, end, "Asia/Kolkata")
+
+    assert missing_days == 1
+    assert not any("fragment" in s for s in segments)
+
+
+def test_late_calls_roll_the_day_up_again(firestore, calls, monkeypatch):
+    monkeypatch.setattr(usage_rollup_service, "ROLLUP_RECHECK_DAYS", 3)
+    earlier = DAY - timedelta(days=2)
+    calls["top"] = [_call(n, earlier) for n in range(4)]
+    for day in (DAY - timedelta(days=3), earlier, DAY - timedelta(days=1)):
+        usage_rollup_service.rollup_company_day("acme", day)
+
+    # Calls for an already rolled-up day arrive late
+    calls["nested"] = [_call(n, earlier, tenant_id=None) for n in range(2)]
+    summary = usage_rollup_service.run_daily_rollups(DAY)
+
+    assert summary["days_rerolled"] == [{"company_id": "acme", "date": earlier.isoformat()}]
+    rollup = firestore.docs[f"companies/acme/usageRollups/{earlier.isoformat()}"]
+    assert rollup["callCount"] == 6
+    assert rollup["sources"]["nested"]["callCount"] == 2
+
+    # Nothing changed since: the next run only rolls up its own day
+    assert usage_rollup_service.run_daily_rollups(DAY)["days_rerolled"] == []
+
+
+def test_tenant_csvs_scan_only_days_missing_a_rollup(firestore, calls, monkeypatch):
+    days = [DAY - timedelta(days=i) for i in range(3)]
+    calls["top"] = [_call(n, day, tenant_id=f"t{n % 2 + 1}") for day in days for n in range(40)]
+    calls["nested"] = [_call(n, day, tenant_id=n % 3 and "t2" or None) for day in days for n in range(9)]
+    monkeypatch.setattr(usage_rollup_service, "get_tenants", lambda company_id: ["t1", "t2"])
+    for day in days[1:]:
+        usage_rollup_service.rollup_company_day("acme", day)
+    # t2's rollup of the middle day was never written
+    del firestore.docs[f"companies/acme/tenants/t2/usageRollups/{days[1].isoformat()}"]
+
+    start = datetime(days[-1].year, days[-1].month, days[-1].day, tzinfo=timezone.utc)
+    end = usage_rollup_service.day_window(DAY)[1]
+    expected = {
+        tenant_id: build_call_log_csv(
+            tenant_id,
+            [{"calls": usage_rollup_service.CALL_SOURCES[s]("acme", start, end, tenant_id=tenant_id)} for s in ("top", "nested")],
+            start, end, "Asia/Kolkata",
+        )["attachment"]["content"]
+        for tenant_id in ("t1", "t2")
+    }
+
+    windows = []
+    for source, stream_fn in list(usage_rollup_service.CALL_SOURCES.items()):
+        def recording(company_id, start, end, fields=None, tenant_id=None, stream_fn=stream_fn):
+            windows.append((start, end, tenant_id))
+            return stream_fn(company_id, start, end, fields=fields, tenant_id=tenant_id)
+        monkeypatch.setitem(usage_rollup_service.CALL_SOURCES, source, recording)
+    monkeypatch.setattr(usage_rollup_service, "get_rollups_for_period", None)
+    reads = firestore.reads
+
+    segments, missing_days = usage_rollup_service.plan_tenant_call_logs(
+        "acme", {"t1": "Asia/Kolkata", "t2": "Asia/Kolkata"}, start, end
+    )
+
+    # One point read per tenant and day
+    assert firestore.reads - reads == 2 * len(days)
+    assert missing_days == {"t1": 1, "t2": 2}
+
+    builders = {tenant_id: CallLogCsvBuilder(tenant_id, start, end, "Asia/Kolkata") for tenant_id in ("t1", "t2")}
+    for tenant_id, segment in segments:
+        builders[tenant_id].add_segment(segment)
+    for tenant_id, builder in builders.items():
+        assert builder.finish()["attachment"]["content"] == expected[tenant_id]
+        builder.close()
+
+    # One company-wide scan per source, of the uncovered days only
+    assert windows == [(usage_rollup_service.day_window(days[1])[0], end, None)] * 2
@@ -0,0 +1,56 @@
+import base64
+import os
+
+# Generated PDFs/CSVs stay in memory unless set to "1" (also written to invoices/)
+ARTIFACT_DISK_SINK = os.getenv("ARTIFACT_DISK_SINK", "0") == "1"
+
+# Multiple of 3 so every chunk base64-encodes without padding
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+
+def make_artifact(name: str, content, content_type: str, path: str | None = None) -> dict:
+    """
+    In-memory file produced by a renderer (invoice/receipt PDF, call log CSV).
+
+    Args:
+        name: File name shown to the recipient
+        content: bytes, or a binary file-like object
+        content_type: MIME type
+        path: Where the artifact was persisted, if a disk sink wrote it
+    """
+    return {"name": name, "content": content, "content_type": content_type, "path": path}
+
+
+def persist_artifact(artifact: dict, path: str) -> dict:
+    """Disk sink: writes the artifact to path when ARTIFACT_DISK_SINK is enabled."""
+    if not ARTIFACT_DISK_SINK:
+        return artifact
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(artifact["content"])
+    artifact["path"] = path
+    return artifact
+
+
+def b64encode_stream(content) -> str:
+    """
+    Base64-encodes bytes or a binary stream chunk by chunk, without materializing
+    an intermediate copy of the whole input.
+    """
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        view = memoryview(content)
+        return "".join(
+            base64.b64encode(view[i:i + BASE64_CHUNK_SIZE]).decode("ascii")
+            for i in range(0, len(view), BASE64_CHUNK_SIZE)
+        )
+
+    encoded = []
+    pending = b""
+    for chunk in iter(lambda: content.read(BASE64_CHUNK_SIZE), b""):
+        pending += chunk
+        # Short reads may not end on a 3-byte boundary; carry the remainder over
+        cut = len(pending) - len(pending) % 3
+        encoded.append(base64.b64encode(pending[:cut]).decode("ascii"))
+        pending = pending[cut:]
+    encoded.append(base64.b64encode(pending).decode("ascii"))
+    return "".join(encoded)
@@ -0,0 +1,400 @@
+# utils/local_queue.py
+"""
+Durable work queue on the local SQLite database, drained by an asyncio dispatcher.
+
+The email outbox, the webhook inbox and the receipt jobs each create a LocalQueue and
+supply only the handler for its entries:
+- enqueue() stores an entry (optionally deduplicated on a key) and wakes the dispatcher
+- the dispatcher claims due entries atomically, so each entry is handled by one worker,
+  with at most `workers` claims in flight, and records the handler's outcome per entry
+- failed entries are retried with exponential backoff; entries that keep failing, or
+  whose failure is permanent, are dead-lettered
+- entries left claimed by a crashed process are returned to the queue on startup
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+from db_configs.local_db import local_db, register_schema
+
+
+class PermanentFailure(Exception):
+    """Raised by a handler for an entry that retrying cannot fix; the entry is dead-lettered."""
+
+
+def done(result=None) -> dict:
+    """Handler outcome of an entry that was handled."""
+    return {"status": "done", "result": result}
+
+
+def failed(error: str, permanent: bool = False) -> dict:
+    """Handler outcome of an entry that failed (retried unless permanent)."""
+    return {"status": "failed", "error": error, "permanent": permanent}
+
+
+def handle_each(fn):
+    """
+    Adapts fn(payload) -> result into a queue handler that handles claimed entries one by
+    one: an exception fails only its own entry (PermanentFailure dead-letters it).
+    """
+    def _handler(entries: list[dict]) -> list[dict]:
+        outcomes = []
+        for entry in entries:
+            try:
+                outcomes.append(done(fn(entry["payload"])))
+            except PermanentFailure as e:
+                outcomes.append(failed(str(e), permanent=True))
+            except Exception as e:
+                outcomes.append(failed(str(e)))
+        return outcomes
+    return _handler
+
+
+class LocalQueue:
+    """
+    A SQLite-backed queue table plus its dispatcher.
+
+    Entry states: pending -> claimed -> done, or back to pending (retry) / dead (dead-lettered).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        *,
+        workers: int = 4,
+        claim_limit: int = 1,
+        claim_max_bytes: int | None = None,
+        max_attempts: int = 6,
+        backoff_base_seconds: float = 30,
+        backoff_max_seconds: float = 3600,
+        poll_seconds: float = 2,
+        stale_claim_seconds: float = 600,
+        dedupe: bool = False,
+        payload_column: str = "payload",
+        result_column: str = "result",
+        claimed_status: str = "processing",
+        done_status: str = "done",
+    ):
+        """
+        Args:
+            name: Name shown in logs
+            table: SQLite table of the queue (created on first use)
+            workers: Handler calls in flight at once
+            claim_limit: Entries passed to one handler call
+            claim_max_bytes: Largest total encoded payload size passed to one handler call
+                (an entry larger than this on its own is still claimed, alone)
+            max_attempts: Attempts before an entry is dead-lettered
+            backoff_base_seconds: Delay before the first retry (doubled on every further attempt)
+            backoff_max_seconds: Longest delay between retries
+            poll_seconds: Idle wait between checks for due entries
+            stale_claim_seconds: Claims older than this are assumed lost by a crashed dispatcher
+            dedupe: Adds a unique `key` column; enqueue() ignores an entry whose key is already stored
+            payload_column, result_column, claimed_status, done_status: Column and state names,
+                for tables that existed before they moved to LocalQueue
+        """
+        self.name = name
+        self.table = table
+        self.workers = workers
+        self.claim_limit = claim_limit
+        self.claim_max_bytes = claim_max_bytes
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.poll_seconds = poll_seconds
+        self.stale_claim_seconds = stale_claim_seconds
+        self.dedupe = dedupe
+        self._payload = payload_column
+        self._result = result_column
+        self._claimed = claimed_status
+        self._done = done_status
+
+        self._task = None
+        self._stop = None
+        self._wake = None
+        self._loop = None
+        self._wake_lock = threading.Lock()
+
+        register_schema(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {"key TEXT NOT NULL UNIQUE," if dedupe else ""}
+            {payload_column} TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            {result_column} TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_{table}_due ON {table} (status, next_attempt_at);
+        """)
+
+    # ---------- storage ----------
+
+    def enqueue(self, payload: dict, key: str | None = None) -> tuple[int, bool]:
+        """
+        Stores an entry and wakes the dispatcher.
+
+        Args:
+            payload: JSON-serializable entry
+            key: Deduplication key (queues created with dedupe=True only)
+
+        Returns:
+            tuple: (entry ID, True if stored / False if an entry with this key already existed)
+        """
+        now = time.time()
+        with local_db() as conn:
+            if self.dedupe:
+                cursor = conn.execute(
+                    f"INSERT OR IGNORE INTO {self.table} (key, {self._payload}, next_attempt_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, json.dumps(payload), now, now, now),
+                )
+                if not cursor.rowcount:
+                    row = conn.execute(f"SELECT id FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                    return row["id"], False
+            else:
+                cursor = conn.execute(
+                    f"INSERT INTO {self.table} ({self._payload}, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                    (json.dumps(payload), now, now, now),
+                )
+            entry_id = cursor.lastrowid
+        self.wake()
+        return entry_id, True
+
+    def get(self, entry_id: int) -> dict | None:
+        """
+        An entry, or None if there is no such entry.
+
+        Returns:
+            dict: {"id", "status", "attempts", "last_error", "payload", "result", "created_at", "updated_at"}
+        """
+        with local_db() as conn:
+            row = conn.execute(
+                f"SELECT id, status, attempts, last_error, {self._payload} AS payload, {self._result} AS result, "
+                f"created_at, updated_at FROM {self.table} WHERE id = ?",
+                (entry_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["payload"] = json.loads(entry["payload"])
+        entry["result"] = json.loads(entry["result"]) if entry["result"] else None
+        return entry
+
+    def claim_due(self, limit: int) -> list[dict]:
+        """
+        Atomically claims up to `limit` due entries, within claim_max_bytes of payload.
+
+        Returns:
+            list: {"id", "attempts", "payload"} of the claimed entries
+        """
+        now = time.time()
+        with local_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT id, attempts, {self._payload} AS payload, length({self._payload}) AS size FROM {self.table} "
+                    "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                rows = self._within_byte_budget(rows)
+                if rows:
+                    placeholders = ",".join("?" * len(rows))
+                    conn.execute(
+                        f"UPDATE {self.table} SET status = ?, updated_at = ? WHERE id IN ({placeholders})",
+                        (self._claimed, now, *[row["id"] for row in rows]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [{"id": row["id"], "attempts": row["attempts"], "payload": json.loads(row["payload"])} for row in rows]
+
+    def _within_byte_budget(self, rows: list) -> list:
+        """Longest prefix of rows whose payloads fit in claim_max_bytes (at least one row)."""
+        if self.claim_max_bytes is None:
+            return rows
+        total = 0
+        for i, row in enumerate(rows):
+            # Payloads are ASCII JSON (json.dumps escapes the rest), so characters == bytes
+            total += row["size"]
+            if i and total > self.claim_max_bytes:
+                return rows[:i]
+        return rows
+
+    def mark_done(self, entry_id: int, result=None):
+        with local_db() as conn:
+            conn.execute(
+                f"UPDATE {self.table} SET status = ?, {self._result} = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                (self._done, json.dumps(result), time.time(), entry_id),
+            )
+
+    def mark_failed(self, entry_id: int, attempts: int, error: str, retry_at: float | None):
+        """Records a failed attempt: schedules a retry at retry_at, or dead-letters the entry if None."""
+        with local_db() as conn:
+            conn.execute(
+                f"UPDATE {self.table} SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? "
+                "WHERE id = ?",
+                ("pending" if retry_at is not None else "dead", attempts, error, retry_at or time.time(), time.time(), entry_id),
+            )
+
+    def release_stale_claims(self, older_than_seconds: float | None = None) -> int:
+        """Returns entries claimed longer ago than older_than_seconds (default stale_claim_seconds) to the queue."""
+        cutoff = time.time() - (self.stale_claim_seconds if older_than_seconds is None else older_than_seconds)
+        with local_db() as conn:
+            cursor = conn.execute(
+                f"UPDATE {self.table} SET status = 'pending', updated_at = ? WHERE status = ? AND updated_at < ?",
+                (time.time(), self._claimed, cutoff),
+            )
+            return cursor.rowcount
+
+    def requeue_dead(self) -> int:
+        """Puts every dead-lettered entry back in the queue with a fresh attempt budget."""
+        now = time.time()
+        with local_db() as conn:
+            cursor = conn.execute(
+                f"UPDATE {self.table} SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? "
+                "WHERE status = 'dead'",
+                (now, now),
+            )
+            return cursor.rowcount
+
+    def counts(self) -> dict:
+        """Number of entries per status."""
+        with local_db() as conn:
+            rows = conn.execute(f"SELECT status, COUNT(*) AS count FROM {self.table} GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    def next_pending_attempt_at(self) -> float | None:
+        """Earliest scheduled attempt among pending entries (None when the queue is empty)."""
+        with local_db() as conn:
+            row = conn.execute(f"SELECT MIN(next_attempt_at) AS next_at FROM {self.table} WHERE status = 'pending'").fetchone()
+        return row["next_at"]
+
+    # ---------- dispatching ----------
+
+    def _backoff_seconds(self, attempts: int) -> float:
+        delay = min(self.backoff_base_seconds * 2 ** (attempts - 1), self.backoff_max_seconds)
+        # Jitter spreads out retries of entries that failed together
+        return delay + random.uniform(0, delay * 0.1)
+
+    def _record(self, entry: dict, outcome: dict):
+        if outcome["status"] == "done":
+            self.mark_done(entry["id"], outcome.get("result"))
+            return
+        attempts = entry["attempts"] + 1
+        if attempts >= self.max_attempts or outcome.get("permanent"):
+            print(f"☠️ {self.name} #{entry['id']} dead-lettered after {attempts} attempt(s): {outcome['error']}")
+            self.mark_failed(entry["id"], attempts, outcome["error"], None)
+        else:
+            print(f"⚠️ {self.name} #{entry['id']} failed (attempt {attempts}), will retry: {outcome['error']}")
+            self.mark_failed(entry["id"], attempts, outcome["error"], time.time() + self._backoff_seconds(attempts))
+
+    def _handle(self, handler, entries: list[dict]):
+        """
+        Runs the handler on claimed entries and records its outcome for each of them.
+        If the handler raises (or doesn't return one outcome per entry), every entry is
+        failed with backoff instead of being left claimed.
+        """
+        try:
+            outcomes = handler(entries)
+            if len(outcomes) != len(entries):
+                raise RuntimeError(f"handler returned {len(outcomes)} outcomes for {len(entries)} entries")
+        except Exception as e:
+            print(f"❌ {self.name} handler failed on {len(entries)} entries: {e}")
+            outcomes = [failed(str(e))] * len(entries)
+        for entry, outcome in zip(entries, outcomes):
+            self._record(entry, outcome)
+
+    async def run(self, handler, stop_event: asyncio.Event, wake_event: asyncio.Event | None = None, drain: bool = False):
+        """
+        Dispatch loop. Runs until stop_event is set or, with drain=True, until the queue
+        has no pending entries left. Setting wake_event ends an idle wait early.
+
+        Args:
+            handler: handler(entries) -> one outcome (done()/failed()) per entry, in order;
+                entries are {"id", "attempts", "payload"}. Runs on a worker thread.
+        """
+        wake_event = wake_event or asyncio.Event()
+        released = await asyncio.to_thread(self.release_stale_claims)
+        if released:
+            print(f"♻️ {self.name}: re-queued {released} entries left in flight by a previous run")
+
+        slots = asyncio.Semaphore(self.workers)
+        in_flight = set()
+
+        def _done(task: asyncio.Task):
+            in_flight.discard(task)
+            slots.release()
+            if not task.cancelled() and task.exception():
+                print(f"❌ {self.name} dispatch failed: {task.exception()}")
+
+        while not stop_event.is_set():
+            await slots.acquire()
+            claimed = await asyncio.to_thread(self.claim_due, self.claim_limit)
+
+            if claimed:
+                task = asyncio.create_task(asyncio.to_thread(self._handle, handler, claimed))
+                in_flight.add(task)
+                task.add_done_callback(_done)
+                continue
+
+            slots.release()
+            wait = self.poll_seconds
+            if drain:
+                if in_flight:
+                    await asyncio.wait(set(in_flight))
+                    continue
+                next_at = await asyncio.to_thread(self.next_pending_attempt_at)
+                if next_at is None:
+                    break
+                wait = max(next_at - time.time(), 0)
+            try:
+                await asyncio.wait_for(wake_event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            wake_event.clear()
+
+        if in_flight:
+            await asyncio.wait(set(in_flight))
+
+    def wake(self):
+        """Lets an idle dispatcher pick up a new entry immediately instead of at its next poll."""
+        with self._wake_lock:
+            if self._loop is None:
+                return
+            loop, wake = self._loop, self._wake
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:
+            # The loop has already been closed
+            pass
+
+    def start(self, handler):
+        """Starts the dispatcher on the running event loop (called from the app lifespan)."""
+        if self._task is not None:
+            return
+        with self._wake_lock:
+            self._stop = asyncio.Event()
+            self._wake = asyncio.Event()
+            self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self.run(handler, self._stop, self._wake))
+        print(f"🚚 {self.name} dispatcher started ({self.workers} workers)")
+
+    async def stop(self):
+        """Stops the dispatcher after its in-flight handler calls finish."""
+        if self._task is None:
+            return
+        with self._wake_lock:
+            stop, wake = self._stop, self._wake
+            self._stop = self._wake = self._loop = None
+        stop.set()
+        wake.set()
+        await self._task
+        self._task = None
+        print(f"✅ {self.name} dispatcher stopped")
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+
+# Stored for keys whose loader returned None (e.g. a missing document)
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries expire after a TTL.
+
+    - get_or_load()/get_or_load_async() are read-through: concurrent misses on the same
+      key (sync or async) share one load
+    - None results are cached too (negative caching), with their own, usually shorter, TTL
+    - invalidate()/clear() drop entries when the source changes
+    - stats() reports hits, misses and evictions
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int = 1024, negative_ttl_seconds: float | None = None):
+        """
+        Args:
+            name: Name shown in logs and stats
+            ttl_seconds: Lifetime of a cached value
+            max_entries: Entries kept before the least recently used ones are evicted
+            negative_ttl_seconds: Lifetime of a cached None (defaults to ttl_seconds; 0 disables)
+        """
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.negative_ttl_seconds = ttl_seconds if negative_ttl_seconds is None else negative_ttl_seconds
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._loading = {}              # key -> Future of an in-flight load
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "loads": 0, "evictions": 0, "invalidations": 0}
+
+    def _lookup(self, key):
+        """Cached value of key, or None if absent/expired. Must be called with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value):
+        """Must be called with the lock held."""
+        ttl = self.ttl_seconds if value is not None else self.negative_ttl_seconds
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, _MISSING if value is None else value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _begin_load(self, key) -> tuple[str, object]:
+        """
+        Looks key up and, on a miss, joins or starts its load.
+
+        Returns:
+            tuple: ("hit", value), ("wait", Future of the in-flight load) or
+                   ("load", Future the caller must complete with _end_load())
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                if entry[1] is _MISSING:
+                    self._stats["negative_hits"] += 1
+                    return "hit", None
+                self._stats["hits"] += 1
+                return "hit", entry[1]
+
+            self._stats["misses"] += 1
+            in_flight = self._loading.get(key)
+            if in_flight is not None:
+                return "wait", in_flight
+            in_flight = self._loading[key] = Future()
+            return "load", in_flight
+
+    def _end_load(self, key, in_flight: Future, value=None, error: BaseException | None = None):
+        """Completes a load started by _begin_load(), caching its value unless it was invalidated meanwhile."""
+        with self._lock:
+            # An invalidation during the load removed the marker: don't cache a possibly stale value
+            current = self._loading.get(key) is in_flight
+            if current:
+                del self._loading[key]
+            if error is None:
+                self._stats["loads"] += 1
+                if current:
+                    self._store(key, value)
+        if error is None:
+            in_flight.set_result(value)
+        elif isinstance(error, (asyncio.CancelledError, CancelledError)):
+            # The loading caller gave up; waiters start a load of their own
+            in_flight.cancel()
+        else:
+            in_flight.set_exception(error)
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value of key, calling loader() on a miss.
+
+        Args:
+            key: Hashable cache key
+            loader: Zero-argument function reading the value from the source
+
+        Returns:
+            The cached or freshly loaded value (None is a valid, cached result)
+        """
+        while True:
+            state, result = self._begin_load(key)
+            if state == "hit":
+                return result
+            if state == "load":
+                break
+            try:
+                return result.result()
+            except CancelledError:
+                continue
+
+        in_flight = result
+        try:
+            value = loader()
+        except BaseException as e:
+            self._end_load(key, in_flight, error=e)
+            raise
+        self._end_load(key, in_flight, value)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        """
+        Async get_or_load(): loader is a zero-argument coroutine function. Misses share
+        one load with concurrent sync and async callers of the same key, and a load that
+        overlaps an invalidation of the key isn't cached.
+
+        Returns:
+            The cached or freshly loaded value (None is a valid, cached result)
+        """
+        while True:
+            state, result = self._begin_load(key)
+            if state == "hit":
+                return result
+            if state == "load":
+                break
+            try:
+                # Shielded: a waiter that is cancelled must not cancel the shared load
+                return await asyncio.shield(asyncio.wrap_future(result))
+            except asyncio.CancelledError:
+                if not result.cancelled():
+                    raise
+
+        in_flight = result
+        try:
+            value = await loader()
+        except BaseException as e:
+            self._end_load(key, in_flight, error=e)
+            raise
+        self._end_load(key, in_flight, value)
+        return value
+
+    def invalidate(self, key):
+        """Drops a key (and makes an in-flight load of it skip caching its result)."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._loading.pop(key, None)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._loading.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["negative_hits"] + self._stats["misses"]
+            hit_rate = (self._stats["hits"] + self._stats["negative_hits"]) / lookups if lookups else 0.0
+            return {"name": self.name, "size": len(self._entries), "hit_rate": round(hit_rate, 4), **self._stats}